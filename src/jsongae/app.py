@@ -1,9 +1,10 @@
-from google.appengine.api import users
 from google.appengine.ext import db
 from google.appengine.ext import webapp
-from google.appengine.ext.webapp import template
 from google.appengine.ext.webapp import util
-from json_rpc import JsonRpcHandler, ServiceMethod
+from json_rpc import JsonRpcHandler, Return, ServiceMethod
+from json_rpc_cache import ResultCache
+from json_rpc_deferred import TaskQueue
+from json_rpc_models import ModelSerializer, Projection, paginate
 import logging
 import os
 
@@ -11,9 +12,6 @@ import os
 class MyData(db.Model):
     string = db.StringProperty()
 
-    def json(self):
-        return "{'string': %s}" % self.string
-
 
 class MainHandler(webapp.RequestHandler):
     """The main handler."""
@@ -21,6 +19,10 @@ class MainHandler(webapp.RequestHandler):
     def get(self):
         """Handles GET."""
 
+        # Imported here to keep them, and Django, off the RPC path
+        from google.appengine.api import users
+        from google.appengine.ext.webapp import template
+
         MyData.get_or_insert(key_name="foobar", string="Some test data.")
 
         user = users.get_current_user()
@@ -39,24 +41,48 @@ class RPCHandler(JsonRpcHandler):
     No need to define post().
     """
 
-    @ServiceMethod
-    def data(self, key_name):
-        entity = MyData.get_by_key_name(key_name)
+    deduplicate_batches = True
+
+    allow_get = True
+
+    notification_queue = TaskQueue(url='/rpc')
+
+    model_serializer = ModelSerializer()
+
+    @ServiceMethod(cache=ResultCache(ttl=10), safe=True, coroutine=True,
+                   cache_control='public, max-age=10',
+                   params={'key_name': basestring, 'fields': list})
+    def data(self, key_name, fields=None):
+        entity = yield self.loader.get_by_key_name(MyData, key_name)
         if entity:
-            return entity.json()
+            raise Return(Projection(entity, fields))
+
+    @ServiceMethod(safe=True, params={'cursor': basestring, 'limit': int})
+    def datalist(self, cursor=None, limit=20):
+        return paginate(MyData.all(), min(limit, 100), cursor)
 
     @ServiceMethod
     def notify(self, message, number):
         logging.info("%s (%i)", message, number)
 
-    @ServiceMethod
+    @ServiceMethod(safe=True)
     def test(self, message):
         return message
 
 
+class WarmupHandler(webapp.RequestHandler):
+    """Prepares a new instance before it receives requests."""
+
+    def get(self):
+        """Handles GET."""
+
+        RPCHandler.warm_up()
+
+
 app = webapp.WSGIApplication([
     ('/', MainHandler),
     ('/rpc', RPCHandler),
+    ('/_ah/warmup', WarmupHandler),
 ], debug=True)
 
 
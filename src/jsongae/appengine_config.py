@@ -1,4 +1,20 @@
+import os
+
+
+# Recording every request with appstats slows down all of them; it is only
+# enabled on the development server unless the environment variable
+# JSONGAE_APPSTATS is set to 1 for a profiling run or 0 to switch it off.
+appstats_enabled = os.environ.get('JSONGAE_APPSTATS')
+if appstats_enabled is None:
+    appstats_enabled = os.environ.get(
+        'SERVER_SOFTWARE', '').startswith('Development')
+else:
+    appstats_enabled = appstats_enabled == '1'
+
+
 def webapp_add_wsgi_middleware(app):
+    if not appstats_enabled:
+        return app
     from google.appengine.ext.appstats import recording
     app = recording.appstats_wsgi_middleware(app)
     return app
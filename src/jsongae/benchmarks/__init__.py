@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Micro-benchmarks for the JSON-RPC handler.
+
+Each module can be run with the buildout interpreter, e.g.:
+
+  $ bin/python -m jsongae.benchmarks.bench_codecs
+"""
+
+import StringIO
+import time
+
+
+def measure(function, number=1000, repeat=3):
+    """Measures the time of a function call.
+
+    :param function function: A function without arguments.
+    :param int number: Calls per measurement.
+    :param int repeat: Number of measurements.
+    :returns: The best time per call in seconds.
+    """
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        for j in xrange(number):
+            function()
+        elapsed = (time.time() - start) / number
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def report(title, rows):
+    """Prints a table of measurements.
+
+    :param string title: The title of the table.
+    :param list rows: Tuples of a label and the seconds per call.
+    """
+    print
+    print title
+    print '-' * len(title)
+    for label, seconds in rows:
+        print '%-40s %12.1f us %12.0f /s' % (
+            label, seconds * 1e6, seconds and 1.0 / seconds or 0)
+
+
+def call_handler(handler_class, body):
+    """Posts a body to a JsonRpcHandler as the unit tests do.
+
+    :param class handler_class: A JsonRpcHandler subclass.
+    :param string body: The HTTP body.
+    :returns: Tuple of status and response body.
+    """
+    from google.appengine.ext.webapp import Request, Response
+    handler = handler_class()
+    handler.request = Request.blank('/rpc')
+    handler.response = Response()
+    handler.request.body = body
+    handler.post()
+    return handler.response.status, handler.response.out.getvalue()
+
+
+def call_wsgi(application, body, path='/rpc', environ=None):
+    """Posts a body to a WSGI application.
+
+    :param application: A WSGI application.
+    :param string body: The HTTP body.
+    :param string path: The request path.
+    :param dict environ: Additional WSGI environment variables.
+    :returns: Tuple of status line and response body.
+    """
+    extra = environ
+    environ = {
+        'REQUEST_METHOD': 'POST',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '8080',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'CONTENT_TYPE': 'application/json-rpc',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': StringIO.StringIO(body),
+        'wsgi.errors': StringIO.StringIO(),
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    if extra:
+        environ.update(extra)
+    status = []
+    written = []
+    def start_response(status_line, headers, exc_info=None):
+        status.append(status_line)
+        return written.append
+    result = ''.join(application(environ, start_response))
+    return status[0], ''.join(written) + result
+
+
+def request(index=1, params=None):
+    """Returns a JSON-RPC request object."""
+    if params is None:
+        params = [u'foobar', index]
+    return {'jsonrpc': '2.0', 'method': 'echo', 'params': params,
+            'id': index}
+
+
+def batch_request(size, params=None):
+    """Returns a list of JSON-RPC request objects."""
+    return [request(i, params) for i in xrange(size)]
+
+
+def response(index=1, result=None):
+    """Returns a JSON-RPC response object."""
+    if result is None:
+        result = {'string': u'Some test data.', 'number': index,
+                  'values': [1.5, 2.5, None, True]}
+    return {'jsonrpc': '2.0', 'result': result, 'id': index}
+
+
+def batch_response(size, result=None):
+    """Returns a list of JSON-RPC response objects."""
+    return [response(i, result) for i in xrange(size)]
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compares request parsing and response encoding of the JSON backends."""
+
+from jsongae import json_rpc_codecs
+from jsongae.benchmarks import *
+
+
+SIZES = [1, 10, 100]
+
+
+def main():
+    """Runs the benchmark."""
+
+    default = json_rpc_codecs.get_codec()
+    codecs = [('default (%s)' % default.name, default)]
+    for name in json_rpc_codecs.available_backends():
+        codec = json_rpc_codecs.get_codec(name)
+        codecs.append((codec.name, codec))
+
+    reference = json_rpc_codecs.get_codec('simplejson')
+    for size in SIZES:
+        if size == 1:
+            req, resp, label = request(), response(), 'single'
+        else:
+            req, resp = batch_request(size), batch_response(size)
+            label = 'batch of %i' % size
+        body = reference.dumps(req)
+        number = max(10, 10000 / size)
+
+        rows = []
+        for name, codec in codecs:
+            rows.append((name, measure(lambda: codec.loads(body), number)))
+        report('Parse request (%s, %i bytes)' % (label, len(body)), rows)
+
+        rows = []
+        for name, codec in codecs:
+            rows.append((name, measure(lambda: codec.dumps(resp), number)))
+        report('Encode response (%s)' % label, rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Shows the size and time trade-off of compressed responses."""
+
+from jsongae.benchmarks import *
+from jsongae.json_rpc import *
+import simplejson
+
+
+class DataService(Dispatcher):
+
+    @ServiceMethod
+    def rows(self, count):
+        return [response(i)['result'] for i in xrange(count)]
+
+
+def service(threshold, level=6):
+    """Returns a DataService subclass with the given compression options."""
+    return type('DataService', (DataService,), {
+        'compression_threshold': threshold, 'compression_level': level})
+
+
+def main():
+    """Runs the benchmark."""
+
+    accept = {'HTTP_ACCEPT_ENCODING': 'gzip, deflate'}
+    options = [('uncompressed', None, 6), ('threshold 512', 512, 6),
+               ('threshold 4096', 4096, 6), ('threshold 65536', 65536, 6),
+               ('threshold 512, level 1', 512, 1),
+               ('threshold 512, level 9', 512, 9)]
+    for count in (1, 10, 100, 1000):
+        body = simplejson.dumps(request(1, [count]))
+        body = body.replace('"echo"', '"rows"')
+        title = 'Result of %i rows' % count
+        print
+        print title
+        print '-' * len(title)
+        number = max(10, 2000 / count)
+        for label, threshold, level in options:
+            application = JsonRpcApplication(service(threshold, level))
+            size = len(call_wsgi(application, body, environ=accept)[1])
+            seconds = measure(
+                lambda: call_wsgi(application, body, environ=accept), number)
+            print '%-40s %12.1f us %12i bytes' % (label, seconds * 1e6, size)
+
+
+if __name__ == '__main__':
+    main()
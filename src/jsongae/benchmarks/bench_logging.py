@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measures the cost of logging bodies and tracebacks per request."""
+
+from jsongae.benchmarks import *
+from jsongae.json_rpc import JsonRpcHandler, ServiceMethod
+import logging
+import simplejson
+
+
+class NullHandler(logging.Handler):
+    """Formats log records like a real handler, but discards them."""
+
+    def emit(self, record):
+        self.format(record)
+
+
+class BenchmarkHandler(JsonRpcHandler):
+    log_body_limit = None
+
+    @ServiceMethod
+    def echo(self, value):
+        return value
+
+    @ServiceMethod
+    def broken(self):
+        raise ValueError('broken')
+
+
+class TruncatingHandler(BenchmarkHandler):
+    log_body_limit = 1024
+
+
+class SamplingHandler(TruncatingHandler):
+    log_body_sample_rate = 0.01
+
+
+class TracebackHandler(BenchmarkHandler):
+    include_tracebacks = True
+
+
+def main():
+    """Runs the benchmark."""
+
+    logger = logging.getLogger()
+    for handler in logger.handlers[:]:
+        logger.removeHandler(handler)
+    logger.addHandler(NullHandler())
+
+    body = simplejson.dumps(batch_request(1000, [u'x' * 200]))
+    for level in (logging.WARNING, logging.DEBUG):
+        logger.setLevel(level)
+        rows = []
+        for handler_class in (BenchmarkHandler, TruncatingHandler,
+                              SamplingHandler):
+            rows.append((handler_class.__name__, measure(
+                lambda: call_handler(handler_class, body), 10)))
+        report('Batch of 1000 calls, %i bytes, log level %s' %
+               (len(body), logging.getLevelName(level)), rows)
+
+    calls = simplejson.dumps(
+        [{'jsonrpc': '2.0', 'method': 'broken', 'id': i} for i in range(100)])
+    notifications = simplejson.dumps(
+        [{'jsonrpc': '2.0', 'method': 'broken'} for i in range(100)])
+    logger.setLevel(logging.CRITICAL)
+    rows = []
+    for label, handler_class, body in [
+            ('calls', BenchmarkHandler, calls),
+            ('calls with tracebacks', TracebackHandler, calls),
+            ('notifications with tracebacks', TracebackHandler,
+             notifications)]:
+        rows.append((label, measure(
+            lambda: call_handler(handler_class, body), 20)))
+    report('Batch of 100 failing calls, log level CRITICAL', rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compares MessagePack with JSON for numeric payloads."""
+
+from jsongae import json_rpc_codecs
+from jsongae import json_rpc_msgpack
+from jsongae.benchmarks import *
+from jsongae.json_rpc import *
+import random
+
+
+class MatrixService(Dispatcher):
+    compression_threshold = None
+
+    @ServiceMethod
+    def scale(self, values, factor):
+        return [value * factor for value in values]
+
+
+def codecs():
+    """Returns the codecs to compare as tuples of label and codec."""
+    result = [('JSON (%s)' % json_rpc_codecs.get_codec().name,
+               json_rpc_codecs.get_codec())]
+    msgpack = json_rpc_msgpack.get_codec()
+    if msgpack.name != 'msgpack.pure':
+        result.append(('MessagePack (msgpack)', msgpack))
+    result.append(('MessagePack (pure Python)', json_rpc_msgpack.MessagePackCodec(
+        'msgpack.pure', json_rpc_msgpack.unpackb, json_rpc_msgpack.packb)))
+    return result
+
+
+def main():
+    """Runs the benchmark."""
+
+    rng = random.Random(42)
+    for size in (10, 1000):
+        values = [rng.random() * 1000 for i in xrange(size / 2)]
+        values += [rng.randint(-100000, 100000) for i in xrange(size / 2)]
+        message = batch_response(10, values)
+        number = max(10, 10000 / size)
+        rows = []
+        sizes = []
+        for label, codec in codecs():
+            data = codec.dumps(message)
+            sizes.append((label, len(data)))
+            rows.append(('%s encode' % label,
+                         measure(lambda: codec.dumps(message), number)))
+            rows.append(('%s decode' % label,
+                         measure(lambda: codec.loads(data), number)))
+        report('Batch of 10 responses with %i numbers each' % size, rows)
+        for label, length in sizes:
+            print '%-40s %12i bytes' % (label, length)
+
+    application = JsonRpcApplication(MatrixService)
+    values = [rng.random() for i in xrange(1000)]
+    message = {'jsonrpc': '2.0', 'method': 'scale', 'params': [values, 2],
+               'id': 1}
+    rows = []
+    for codec in (json_rpc_codecs.get_codec(), json_rpc_msgpack.get_codec()):
+        body = codec.dumps(message)
+        environ = {'CONTENT_TYPE': codec.content_type}
+        assert call_wsgi(application, body, environ=environ)[0] == '200 OK'
+        rows.append((codec.name, measure(
+            lambda: call_wsgi(application, body, environ=environ), 100)))
+    report('Request with 1000 floats', rows)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measures the time to the first RPC of a new instance.
+
+Every run starts a fresh interpreter which imports the application module,
+optionally answers a warmup request and then serves two RPCs, so imports
+and lazily built state are paid for as on a cold App Engine instance:
+
+  $ bin/python -m jsongae.benchmarks.bench_startup --runs 10 --imports 15
+
+With --imports the slowest imports of one run are listed with their
+inclusive time.
+"""
+
+from jsongae.benchmarks import call_wsgi
+import __builtin__
+import optparse
+import os
+import simplejson
+import subprocess
+import sys
+import time
+
+
+BODY = '{"jsonrpc": "2.0", "method": "test", "params": ["ping"], "id": 1}'
+
+
+def profile_imports():
+    """Records the inclusive time of every module imported from now on.
+
+    :returns: A dictionary being filled with module names and seconds.
+    """
+    timings = {}
+    original = __builtin__.__import__
+    def timed_import(name, *args, **kwargs):
+        if name in sys.modules:
+            return original(name, *args, **kwargs)
+        start = time.time()
+        try:
+            return original(name, *args, **kwargs)
+        finally:
+            timings.setdefault(name, time.time() - start)
+    __builtin__.__import__ = timed_import
+    return timings
+
+
+def child(module_name, warm_up, imports):
+    """Runs in a fresh interpreter and prints its timings as JSON."""
+    timings = imports and profile_imports()
+    start = time.time()
+    module = __import__(module_name, {}, {}, ['app'])
+    imported = time.time()
+    if warm_up:
+        status = call_wsgi(module.app, '', '/_ah/warmup',
+                           {'REQUEST_METHOD': 'GET'})[0]
+        assert status.startswith('200'), status
+    warmed = time.time()
+    status = call_wsgi(module.app, BODY)[0]
+    assert status.startswith('200'), status
+    first = time.time()
+    call_wsgi(module.app, BODY)
+    second = time.time()
+    print simplejson.dumps({
+        'import': imported - start,
+        'warmup': warmed - imported,
+        'first': first - warmed,
+        'second': second - first,
+        'modules': len(sys.modules),
+        'django': 'django' in sys.modules,
+        'imports': timings and sorted(
+            timings.items(), key=lambda item: -item[1])[:imports] or [],
+    })
+
+
+def spawn(module_name, warm_up, imports=0):
+    """Starts a child interpreter and returns its timings."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(p for p in sys.path if p)
+    args = [sys.executable, '-m', 'jsongae.benchmarks.bench_startup',
+            '--child', '--module', module_name, '--imports', str(imports)]
+    if warm_up:
+        args.append('--warm-up')
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, env=env)
+    output = process.communicate()[0]
+    if process.returncode:
+        raise RuntimeError('Child failed with status %i' % process.returncode)
+    return simplejson.loads(output.splitlines()[-1])
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    """Runs the benchmark."""
+
+    parser = optparse.OptionParser()
+    parser.add_option('--module', default='jsongae.app',
+                      help='application module defining app')
+    parser.add_option('--runs', type='int', default=5,
+                      help='fresh interpreters per variant')
+    parser.add_option('--imports', type='int', default=0,
+                      help='number of the slowest imports to list')
+    parser.add_option('--warm-up', action='store_true', help='child only')
+    parser.add_option('--child', action='store_true', help='child only')
+    options, args = parser.parse_args()
+    if options.child:
+        child(options.module, options.warm_up, options.imports)
+        return
+
+    for warm_up in (False, True):
+        runs = [spawn(options.module, warm_up) for i in xrange(options.runs)]
+        title = '%s, %s' % (options.module,
+                            warm_up and 'warmup request' or 'no warmup')
+        print
+        print title
+        print '-' * len(title)
+        for key in ('import', 'warmup', 'first', 'second'):
+            print '%-40s %12.2f ms' % (
+                key, median([run[key] for run in runs]) * 1000)
+        print '%-40s %12.2f ms' % ('time to first RPC', median(
+            [run['import'] + run['first'] for run in runs]) * 1000)
+        print '%-40s %12i' % ('modules loaded', runs[0]['modules'])
+        print '%-40s %12s' % ('Django loaded', runs[0]['django'])
+
+    if options.imports:
+        title = 'Slowest imports (inclusive)'
+        print
+        print title
+        print '-' * len(title)
+        for name, seconds in spawn(options.module, False,
+                                   options.imports)['imports']:
+            print '%-40s %12.2f ms' % (name, seconds * 1000)
+
+if __name__ == '__main__':
+    main()
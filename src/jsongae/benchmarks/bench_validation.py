@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compares the single-pass message validation with the former set-based one.
+"""
+
+from jsongae.benchmarks import *
+from jsongae.json_rpc import InvalidRequestError, JsonRpcMessage
+import logging
+import sys
+
+
+JSON_RPC_KEYS = frozenset(['method', 'jsonrpc', 'params', 'id'])
+
+
+class SetBasedMessage(object):
+    """The validation as implemented before, kept for comparison."""
+
+    def __init__(self, json=None):
+        self.message_id = None
+        self.notification = False
+        self.error = None
+        self.result = None
+        self.event = None
+        if json is not None:
+            self.from_json(json)
+
+    def from_json(self, json):
+        try:
+            if not isinstance(json, dict):
+                raise InvalidRequestError(
+                        'Invalid JSON-RPC Message; must be an object')
+
+            if not set(json.keys()) <= JSON_RPC_KEYS:
+                raise InvalidRequestError('Invalid members in request object')
+
+            if not ('jsonrpc' in json and json['jsonrpc'] == '2.0'):
+                raise InvalidRequestError('Server supports JSON-RPC 2.0 only')
+
+            if 'method' not in json:
+                raise InvalidRequestError('No method specified')
+
+            if not isinstance(json['method'], basestring):
+                raise InvalidRequestError('Method must be a string')
+
+            self.method_name = json['method']
+
+            if 'params' in json:
+                params = json['params']
+                if not isinstance(params, (dict, list, tuple)):
+                    raise InvalidRequestError(
+                            "'params' must be an array or object")
+                self.params = params
+
+            if 'id' in json:
+                self.message_id = json['id']
+            else:
+                self.notification = True
+        except InvalidRequestError, ex:
+            self.error = ex
+            logging.error('Encountered invalid json message')
+
+
+def size_of(msg):
+    """Returns the size of a message object including its __dict__."""
+    size = sys.getsizeof(msg)
+    if hasattr(msg, '__dict__'):
+        size += sys.getsizeof(msg.__dict__)
+    return size
+
+
+def main():
+    """Runs the benchmark."""
+
+    logging.disable(logging.CRITICAL)
+    calls = batch_request(1000, [1, 2])
+    named = [{'jsonrpc': '2.0', 'method': 'echo', 'params': {'a': 1}}
+             for i in range(1000)]
+    invalid = [{'jsonrpc': '2.0', 'method': 'echo', 'foo': i}
+               for i in range(1000)]
+
+    for label, batch in [('calls', calls), ('named notifications', named),
+                         ('invalid members', invalid)]:
+        rows = []
+        for message_class in (SetBasedMessage, JsonRpcMessage):
+            seconds = measure(
+                lambda: [message_class(obj) for obj in batch], 20)
+            rows.append((message_class.__name__, seconds / len(batch)))
+        report('Validation of a batch of 1000 %s, per message' % label, rows)
+
+    print
+    print 'Memory per message object'
+    print '-------------------------'
+    for message_class in (SetBasedMessage, JsonRpcMessage):
+        print '%-40s %12i bytes' % (
+            message_class.__name__, size_of(message_class(calls[0])))
+
+
+if __name__ == '__main__':
+    main()
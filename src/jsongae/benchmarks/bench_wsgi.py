@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compares the webapp handler with the plain WSGI application."""
+
+from google.appengine.ext import webapp
+from jsongae.benchmarks import *
+from jsongae.json_rpc import *
+import simplejson
+
+
+class EchoService(Dispatcher):
+
+    @ServiceMethod
+    def echo(self, value, index):
+        return value
+
+
+class EchoHandler(JsonRpcHandler, EchoService):
+    pass
+
+
+def main():
+    """Runs the benchmark."""
+
+    webapp_application = webapp.WSGIApplication([('/rpc', EchoHandler)])
+    wsgi_application = JsonRpcApplication(EchoService)
+
+    for size in (1, 10, 100):
+        if size == 1:
+            body, label = simplejson.dumps(request()), 'single call'
+        else:
+            body = simplejson.dumps(batch_request(size))
+            label = 'batch of %i' % size
+        assert (call_wsgi(webapp_application, body)[1] ==
+                call_wsgi(wsgi_application, body)[1])
+        number = max(10, 5000 / size)
+        report('Request (%s)' % label, [
+            ('webapp JsonRpcHandler', measure(
+                lambda: call_wsgi(webapp_application, body), number)),
+            ('WSGI JsonRpcApplication', measure(
+                lambda: call_wsgi(wsgi_application, body), number)),
+        ])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Load test of the RPC endpoint with a baseline for regression checks.
+
+Drives a JsonRpcHandler through webapp Request and Response objects, as the
+unit tests do, and a JsonRpcApplication through a raw WSGI call with a fixed
+set of workloads. For every workload it reports requests per second, the
+percentiles of the latency per message and the growth of the peak memory of
+the process. Every workload is run in a fresh interpreter, since the peak
+memory of a process never shrinks and would hide later workloads.
+
+Usage:
+
+  $ bin/python -m jsongae.benchmarks.loadtest --save baseline.json
+  $ bin/python -m jsongae.benchmarks.loadtest --compare baseline.json
+
+Comparing exits with status 1 if a workload got slower than the tolerance
+allows.
+"""
+
+from jsongae import json_rpc_codecs
+from jsongae.benchmarks import *
+from jsongae.json_rpc import *
+import gc
+import logging
+import optparse
+import os
+import random
+import simplejson
+import subprocess
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class LoadTestService(Dispatcher):
+
+    @ServiceMethod
+    def echo(self, value, index):
+        return value
+
+    @ServiceMethod
+    def broken(self):
+        raise ValueError('broken')
+
+
+class LoadTestHandler(JsonRpcHandler, LoadTestService):
+    pass
+
+
+def error_mix(size, seed=42):
+    """Returns a batch of which about half of the messages fail.
+
+    Failures are spread over internal errors, unknown methods, invalid
+    parameters and invalid requests.
+
+    :param int size: The number of messages.
+    :param int seed: Seed for the random order.
+    """
+    rng = random.Random(seed)
+    batch = []
+    for i in xrange(size):
+        kind = rng.randint(0, 7)
+        if kind == 0:
+            batch.append({'jsonrpc': '2.0', 'method': 'broken', 'id': i})
+        elif kind == 1:
+            batch.append({'jsonrpc': '2.0', 'method': 'missing', 'id': i})
+        elif kind == 2:
+            batch.append(request(i, [1]))
+        elif kind == 3:
+            batch.append({'jsonrpc': '2.0', 'id': i})
+        else:
+            batch.append(request(i))
+    return batch
+
+
+def workloads():
+    """Returns the workloads as tuples of name, request and number of
+    messages.
+
+    The requests are encoded by measure, so the bodies of other workloads do
+    not count towards the peak memory.
+    """
+    notification = request()
+    del notification['id']
+    large = [u'x' * 100000, 1]
+    result = [
+        ('single call', request(), 1),
+        ('notification', notification, 1),
+        ('batch of 10', batch_request(10), 10),
+        ('batch of 100', batch_request(100), 100),
+        ('batch of 1000', batch_request(1000), 1000),
+        ('large params', request(1, large), 1),
+        ('batch of 10 large params', batch_request(10, large), 10),
+        ('error mix of 100', error_mix(100), 100),
+    ]
+    return result
+
+
+def drivers():
+    """Returns the ways to call the endpoint as tuples of name and function.
+    """
+    application = JsonRpcApplication(LoadTestService)
+    return [
+        ('handler', lambda body: call_handler(LoadTestHandler, body)),
+        ('wsgi', lambda body: call_wsgi(application, body)),
+    ]
+
+
+def percentile(samples, q):
+    """Returns the q-th percentile of sorted samples.
+
+    :param list samples: Sorted list of numbers.
+    :param float q: The percentile between 0 and 100.
+    """
+    if not samples:
+        return 0.0
+    index = int(round(q / 100.0 * (len(samples) - 1)))
+    return samples[index]
+
+
+def peak_memory():
+    """Returns the peak resident memory of the process in KiB or None."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak /= 1024
+    return peak
+
+
+def run(function, body, size, requests):
+    """Calls the endpoint repeatedly with the same body.
+
+    The garbage collector is disabled while measuring, as timeit does.
+
+    :param function function: A driver function.
+    :param string body: The HTTP body.
+    :param int size: The number of messages in the body.
+    :param int requests: The number of requests.
+    :returns: A dictionary of measurements; latencies in microseconds per
+        message.
+    """
+    samples = []
+    timer = time.time
+    gc.collect()
+    gc.disable()
+    try:
+        start = timer()
+        for i in xrange(requests):
+            begin = timer()
+            function(body)
+            samples.append(timer() - begin)
+        elapsed = timer() - start
+    finally:
+        gc.enable()
+    samples = sorted(s / size * 1e6 for s in samples)
+    return {
+        'requests_per_second': requests / elapsed,
+        'p50': percentile(samples, 50),
+        'p95': percentile(samples, 95),
+        'p99': percentile(samples, 99),
+    }
+
+
+def measure(key, scale=1.0, repeat=3):
+    """Runs one workload with one driver in this process.
+
+    The workload is run repeat times and the fastest run is kept. The peak
+    memory is the growth since before the warm up in KiB; it is only
+    meaningful in a process which did not run other workloads.
+
+    :param string key: The 'workload/driver' to run.
+    :param float scale: Factor for the number of requests per workload.
+    :param int repeat: Number of runs per workload.
+    :returns: A dictionary of measurements.
+    """
+    for name, obj, size in workloads():
+        for driver, function in drivers():
+            if '%s/%s' % (name, driver) != key:
+                continue
+            requests = max(10, int(scale * 2000 / size))
+            memory = peak_memory()
+            body = simplejson.dumps(obj)
+            # Warm up caches and lazily imported modules
+            function(body)
+            runs = [run(function, body, size, requests)
+                    for i in xrange(repeat)]
+            best = max(runs, key=lambda r: r['requests_per_second'])
+            if memory is not None:
+                memory = peak_memory() - memory
+            best['peak_memory'] = memory
+            return best
+    raise ValueError('Unknown workload %s' % key)
+
+
+def run_all(scale=1.0, repeat=3):
+    """Runs all workloads with all drivers.
+
+    Every workload is measured in a fresh interpreter.
+
+    :param float scale: Factor for the number of requests per workload.
+    :param int repeat: Number of runs per workload.
+    :returns: A list of tuples of 'workload/driver' and measurements.
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(p for p in sys.path if p)
+    results = []
+    for name, obj, size in workloads():
+        for driver, function in drivers():
+            key = '%s/%s' % (name, driver)
+            process = subprocess.Popen(
+                [sys.executable, '-m', 'jsongae.benchmarks.loadtest',
+                 '--measure', key, '--scale', str(scale),
+                 '--repeat', str(repeat)],
+                stdout=subprocess.PIPE, env=env)
+            output = process.communicate()[0]
+            if process.returncode:
+                raise RuntimeError('Measuring %s failed' % key)
+            results.append((key, simplejson.loads(output)))
+    return results
+
+
+def print_results(results, baseline=None):
+    """Prints the measurements, compared with a baseline if given.
+
+    :param list results: Tuples of 'workload/driver' and measurements.
+    :param dict baseline: The measurements of the baseline or None.
+    """
+    header = '%-34s %10s %9s %9s %9s %9s' % (
+        'workload', 'req/s', 'p50 us', 'p95 us', 'p99 us', 'mem KiB')
+    if baseline is not None:
+        header += ' %8s %8s' % ('req/s', 'p95')
+    print header
+    print '-' * len(header)
+    for key, r in results:
+        line = '%-34s %10.1f %9.1f %9.1f %9.1f %9s' % (
+            key, r['requests_per_second'], r['p50'], r['p95'], r['p99'],
+            r['peak_memory'] is None and '-' or r['peak_memory'])
+        if baseline is not None and key in baseline:
+            b = baseline[key]
+            line += ' %+7.1f%% %+7.1f%%' % (
+                change(r['requests_per_second'], b['requests_per_second']),
+                change(r['p95'], b['p95']))
+        print line
+
+
+def change(value, reference):
+    """Returns the relative change against a reference in percent."""
+    if not reference:
+        return 0.0
+    return (value - reference) / reference * 100
+
+
+def regressions(results, baseline, tolerance=0.2):
+    """Finds workloads which got slower than a baseline.
+
+    :param list results: Tuples of 'workload/driver' and measurements.
+    :param dict baseline: The measurements of the baseline.
+    :param float tolerance: The accepted relative slowdown.
+    :returns: A list of 'workload/driver' keys.
+    """
+    found = []
+    for key, r in results:
+        b = baseline.get(key)
+        if b is None:
+            continue
+        if (r['requests_per_second'] <
+                b['requests_per_second'] * (1 - tolerance) or
+                r['p95'] > b['p95'] * (1 + tolerance)):
+            found.append(key)
+    return found
+
+
+def main(argv=None):
+    """Runs the load test."""
+
+    parser = optparse.OptionParser(
+        usage='%prog [--save FILE] [--compare FILE]')
+    parser.add_option('--save', metavar='FILE',
+                      help='write the results to a baseline file')
+    parser.add_option('--compare', metavar='FILE',
+                      help='compare the results with a baseline file')
+    parser.add_option('--tolerance', type='float', default=0.2,
+                      help='accepted relative slowdown [default: %default]')
+    parser.add_option('--scale', type='float', default=1.0,
+                      help='factor for the number of requests '
+                           '[default: %default]')
+    parser.add_option('--repeat', type='int', default=3,
+                      help='runs per workload [default: %default]')
+    parser.add_option('--measure', metavar='WORKLOAD',
+                      help=optparse.SUPPRESS_HELP)
+    options, args = parser.parse_args(argv)
+
+    logging.disable(logging.CRITICAL)
+
+    if options.measure:
+        # A child process of run_all
+        simplejson.dump(
+            measure(options.measure, options.scale, options.repeat),
+            sys.stdout)
+        return 0
+
+    baseline = None
+    if options.compare:
+        f = open(options.compare)
+        try:
+            saved = simplejson.load(f)
+        finally:
+            f.close()
+        baseline = saved['results']
+        codec = json_rpc_codecs.get_codec().name
+        if (saved['python'], saved['codec']) != (sys.version.split()[0],
+                                                 codec):
+            print ('Baseline was recorded with Python %s and codec %s' %
+                   (saved['python'], saved['codec']))
+            print
+
+    results = run_all(options.scale, options.repeat)
+    print_results(results, baseline)
+
+    if options.save:
+        f = open(options.save, 'w')
+        try:
+            simplejson.dump({
+                'python': sys.version.split()[0],
+                'codec': json_rpc_codecs.get_codec().name,
+                'scale': options.scale,
+                'results': dict(results),
+            }, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+
+    if baseline is not None:
+        slower = regressions(results, baseline, options.tolerance)
+        if slower:
+            print
+            print 'Regressions beyond %i%%:' % (options.tolerance * 100)
+            for key in slower:
+                print '  ' + key
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
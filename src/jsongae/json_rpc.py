@@ -15,37 +15,79 @@
 # limitations under the License.
 """JsonRpcHandler webapp.RequestHandler for TyphoonAE and Google App Engine.
 
+The Dispatcher implementing JSON-RPC is framework independent; it is served
+by the JsonRpcHandler with webapp or by the JsonRpcApplication with any WSGI
+server.
+
 See specs:
   - http://groups.google.com/group/json-rpc/web/json-rpc-2-0
   - http://groups.google.com/group/json-rpc/web/json-rpc-over-http
 
 This version does not support:
-  - *args, **kwargs and default-values are not allowed for Service Methods
-  - handles only HTTP POST
+  - *args and **kwargs are not allowed for Service Methods
+  - HTTP GET is supported for safe methods only
   - JSON-RPC Version < 2.0 (same as 1.2) not supported
 
 TODOs:
   - more Comments
   - Examples (doctest?)
-  - Factor out handler methods to reuse in other frameworks
 """
 
 from google.appengine.ext import webapp
 from inspect import getargspec
+import base64
 import cgi
+import hashlib
+import itertools
+import json_rpc_codecs
+import json_rpc_params
 import logging
-import simplejson
+import os
+import random
 import sys
+import threading
+import time
 import traceback
+import types
+
+
+_MISSING = object()
+
+# The header of requests of the task queue in the WSGI environment
+QUEUE_ENVIRON = 'HTTP_X_APPENGINE_QUEUENAME'
+
+# Servers removing the header from external requests
+TRUSTED_SERVERS = ('Google App Engine/', 'Development/')
+
+# The name instruments and the profiler record calls of unknown methods under
+UNKNOWN_METHOD = '(unknown)'
+
 
+def ServiceMethod(fn=None, **options):
+    """Decorator to mark a method of a Dispatcher as ServiceMethod.
 
-JSON_RPC_KEYS = frozenset(['method', 'jsonrpc', 'params', 'id'])
+    This exposes methods to the RPC interface. The calling convention of the
+    method is inspected once and stored as `fn.service_spec`. Options are
+    passed to ServiceMethodSpec:
 
+        @ServiceMethod(cache=ResultCache(ttl=60))
+        def data(self, key_name):
+            ...
 
-def ServiceMethod(fn):
-    """Decorator to mark a method of a JsonRpcHandler as ServiceMethod.
+    Defaults of parameters are applied to calls omitting them. A schema
+    passed as `params` checks and converts parameter values; see
+    json_rpc_params:
 
-    This exposes methods to the RPC interface.
+        @ServiceMethod(params={'key_name': basestring, 'count': int})
+        def data(self, key_name, count=1):
+            ...
+
+    Service methods may return futures or be coroutines, see Task:
+
+        @ServiceMethod(coroutine=True)
+        def data(self, key_name):
+            entity = yield db.get_async(db.Key.from_path('MyData', key_name))
+            raise Return(entity.data)
 
     :param function fn: A function.
     :returns: A function.
@@ -54,10 +96,154 @@ def ServiceMethod(fn):
         - Warn when applied to underscore methods
     """
 
+    if fn is None:
+        def decorator(fn):
+            return ServiceMethod(fn, **options)
+        return decorator
     fn.IsServiceMethod = True
+    fn.service_spec = ServiceMethodSpec(fn, **options)
     return fn
 
 
+class ServiceMethodSpec(object):
+    """Precomputed calling convention of a service method.
+
+    Holds everything `Dispatcher.execute_method` needs to check the
+    parameters of a call without inspecting the function again.
+
+    :param function fn: A function.
+    :param cache: A json_rpc_cache.ResultCache for the results or None.
+    :param bool safe: Whether the method is free of side effects, so equal
+        calls may be answered with the same result.
+    :param string name: The name exposed via JSON-RPC; the function name by
+        default.
+    :param bool coroutine: Whether the method is a generator function whose
+        generators are run as a Task.
+    :param string cache_control: The Cache-Control header of responses to
+        HTTP GET requests; Dispatcher.cache_control by default.
+    :param dict params: A schema of the parameters, see json_rpc_params.
+    """
+
+    __slots__ = ('name', 'args', 'arg_set', 'arity', 'variable', 'cache',
+                 'safe', 'coroutine', 'cache_control', 'adapt')
+
+    def __init__(self, fn, cache=None, safe=False, name=None,
+                 coroutine=False, cache_control=None, params=None):
+        args, varargs, varkw, defaults = getargspec(fn)
+        self.name = name or fn.__name__
+        self.args = tuple(args[1:])
+        self.arg_set = frozenset(self.args)
+        self.arity = len(self.args)
+        self.variable = bool(varargs or varkw)
+        # Checks the params of a call and returns them in positional order
+        self.adapt = json_rpc_params.compile_adapter(
+            self.args, defaults, params)
+        self.cache = cache
+        self.safe = safe
+        self.coroutine = coroutine
+        self.cache_control = cache_control
+        if cache is not None:
+            cache.bind(self, '%s.%s' % (fn.__module__, fn.__name__))
+
+    def canonical_params(self, params):
+        """Encodes the parameters of a call to canonical JSON text.
+
+        Named parameters are brought into positional order and defaults are
+        applied, so all forms of a call result in the same text. Returns
+        None if the parameters do not match the method or cannot be encoded
+        as JSON, e.g. binary strings of MessagePack requests.
+
+        :param params: List, tuple or dictionary with JSON-RPC parameters.
+        """
+        try:
+            return json_rpc_codecs.canonical(self.adapt(params))
+        except (json_rpc_params.ParamsError, ValueError, TypeError):
+            return None
+
+
+class ServiceMethodRegistry(type):
+    """Metaclass collecting the service methods of a handler class.
+
+    The dispatch table maps method names to functions marked with
+    @ServiceMethod and is built once when the class is created. Methods
+    overridden by a subclass without the decorator are not exposed.
+
+    The methods of the Service classes in `services` are added under their
+    namespace, e.g. 'users.get', so `dispatch_table` maps every name to the
+    function and the Service class it is bound to, or None for methods of
+    the class itself.
+
+    The keys of the result caches of methods defined by the class are
+    qualified by module, class and method name.
+    """
+
+    def __init__(cls, name, bases, attrs):
+        super(ServiceMethodRegistry, cls).__init__(name, bases, attrs)
+        for value in attrs.itervalues():
+            if getattr(value, 'IsServiceMethod', False) == True:
+                cache = value.service_spec.cache
+                if cache is not None:
+                    cache.qualify('%s.%s.%s' % (
+                        cls.__module__, name, value.__name__))
+        exposed = {}
+        for klass in reversed(cls.__mro__):
+            for attr, value in klass.__dict__.iteritems():
+                if getattr(value, 'IsServiceMethod', False) == True:
+                    exposed[attr] = value
+                elif attr in exposed:
+                    del exposed[attr]
+        methods = dict(
+            (f.service_spec.name, f) for f in exposed.itervalues())
+        table = dict((name, (f, None)) for name, f in methods.iteritems())
+        services = getattr(cls, 'services', None) or {}
+        for namespace, service_class in services.iteritems():
+            if not issubclass(service_class, Service):
+                raise TypeError('%s mounted as %s is no Service' %
+                                (service_class.__name__, namespace))
+            for name, (f, owner) in service_class.dispatch_table.iteritems():
+                name = '%s.%s' % (namespace, name)
+                if name in table:
+                    raise ValueError('Method %s is defined twice' % name)
+                methods[name] = f
+                table[name] = (f, owner or service_class)
+        cls.service_methods = methods
+        cls.dispatch_table = table
+
+
+class Service(object):
+    """Base class of services mounted by a Dispatcher under a namespace.
+
+    A Dispatcher with `services` routes calls of namespaced methods to the
+    mounted Service classes, so one endpoint and one batch span several
+    services:
+
+        class UserService(Service):
+
+            @ServiceMethod
+            def get(self, user_id):
+                ...
+
+        class API(JsonRpcHandler):
+
+            services = {'users': UserService, 'data': DataService}
+
+    Services may mount services themselves. A service is instantiated once
+    per request when its first method is called.
+
+    :param dispatcher: The Dispatcher handling the request.
+    """
+
+    __metaclass__ = ServiceMethodRegistry
+
+    services = None
+
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+
+    loader = property(lambda self: self.dispatcher.loader,
+                      doc="The EntityLoader of the request.")
+
+
 class JsonRpcError(Exception):
     """Baseclass for all JSON-RPC Errors.
 
@@ -113,6 +299,13 @@ class MethodNotFoundError(JsonRpcError):
     status = 404
 
 
+class MethodNotAllowedError(InvalidRequestError):
+    """The method may not be called with the HTTP method of the request."""
+
+    message = 'Method not allowed'
+    status = 405
+
+
 class InvalidParamsError(JsonRpcError):
     """Invalid method parameter(s)."""
 
@@ -121,10 +314,28 @@ class InvalidParamsError(JsonRpcError):
 
 
 class InternalError(JsonRpcError):
-    """Internal JSON-RPC error."""
+    """Internal JSON-RPC error.
+
+    The traceback of the exception causing the error is kept as `exc_info`
+    and only formatted when `data` is accessed.
+    """
 
     code = -32603
     message = 'Internal error'
+    exc_info = None
+    _data = None
+
+    def _get_data(self):
+        if self.exc_info is not None:
+            self._data = ''.join(traceback.format_exception(*self.exc_info))
+            self.exc_info = None
+        return self._data
+
+    def _set_data(self, data):
+        self.exc_info = None
+        self._data = data
+
+    data = property(_get_data, _set_data)
 
 
 class ServerError(JsonRpcError):
@@ -137,109 +348,1382 @@ class ServerError(JsonRpcError):
     message = 'Server Error'
 
 
+class ExecutionTimeoutError(ServerError):
+    """The service method did not finish within the configured timeout."""
+
+    code = -32001
+    message = 'Execution timed out'
+
+
+class RequestTooLargeError(ServerError):
+    """The request body or batch exceeds the limits of the server."""
+
+    code = -32002
+    message = 'Request too large'
+    status = 413
+
+
+class RateLimitExceededError(ServerError):
+    """The client called a method more often than its rate limit allows."""
+
+    code = -32003
+    message = 'Rate limit exceeded'
+    status = 429
+
+
+class ServerBusyError(ServerError):
+    """The server handles the maximum number of concurrent requests."""
+
+    code = -32004
+    message = 'Server busy'
+    status = 503
+
+
+def join_body(body):
+    """Joins an encoded response given as iterator of strings."""
+    if isinstance(body, basestring):
+        return body
+    return ''.join(body)
+
+
+class Return(StopIteration):
+    """Raised by a coroutine service method to return its result.
+
+    :param value: The result.
+    """
+
+    def __init__(self, value=None):
+        StopIteration.__init__(self, value)
+        self.value = value
+
+
+def is_future(obj):
+    """Returns whether an object is a future, i.e. has a get_result method.
+
+    Datastore and URL fetch RPC objects are futures.
+    """
+    return callable(getattr(obj, 'get_result', None))
+
+
+def is_iterator(obj):
+    """Returns whether an object is an iterator, e.g. a generator.
+
+    Lists, dictionaries and strings are iterable but not iterators.
+    """
+    return (type(obj) is types.GeneratorType or
+            (hasattr(obj, 'next') and hasattr(obj, '__iter__')))
+
+
+class Page(object):
+    """A page of a result set returned by a service method.
+
+    Encoded as an object of the `items`, streamed like an iterator result,
+    and the `cursor` of the next page:
+
+        {"items": [...], "cursor": "..."}
+
+    :param items: An iterable of the items.
+    :param cursor: The cursor of the next page or a function returning it
+        once all items are consumed; None on the last page.
+    """
+
+    def __init__(self, items, cursor=None):
+        self.items = items
+        self.cursor = cursor
+
+    def get_cursor(self):
+        """Returns the cursor of the next page."""
+        if callable(self.cursor):
+            return self.cursor()
+        return self.cursor
+
+    def materialize(self):
+        """Reads all items into a list, so the page can be encoded twice."""
+        if not isinstance(self.items, list):
+            self.items = list(self.items)
+        return self
+
+
+def is_streamed(result):
+    """Returns whether a result is streamed, i.e. a Page or an iterator."""
+    return isinstance(result, Page) or is_iterator(result)
+
+
+class FutureList(object):
+    """A future for a list of futures.
+
+    :param list futures: Futures.
+    """
+
+    def __init__(self, futures):
+        self.futures = futures
+
+    def get_result(self):
+        return [future.get_result() for future in self.futures]
+
+
+class Task(object):
+    """A started asynchronous service call.
+
+    Wraps the future returned by a service method or the generator of a
+    coroutine service method. The coroutine runs until it yields a future, a
+    list of futures or the generator of another coroutine. It is resumed with
+    the result, or the exception is raised inside the coroutine, once the
+    task is stepped. The coroutine returns its result by raising Return.
+
+    The Dispatcher starts the tasks of all calls in a batch before it waits
+    for any of them, so their RPCs overlap. Tasks are futures themselves.
+
+    :param operation: A future or a generator.
+    """
+
+    def __init__(self, operation):
+        self.start = time.time()
+        self.elapsed = None
+        self.done = False
+        self.value = None
+        self.exc_info = None
+        self.callbacks = []
+        self.event = None
+        self.future = None
+        self.generator = None
+        if isinstance(operation, types.GeneratorType):
+            self.generator = operation
+            self._send(None)
+        else:
+            self.future = operation
+
+    def step(self):
+        """Waits for the current future and resumes the coroutine."""
+        if self.done:
+            return
+        try:
+            value = self.future.get_result()
+        except Exception:
+            if self.generator is None:
+                self._fail(sys.exc_info())
+            else:
+                self._send(None, sys.exc_info())
+        else:
+            if self.generator is None:
+                self._finish(value)
+            else:
+                self._send(value)
+
+    def get_result(self):
+        """Waits for the task to finish and returns its result."""
+        while not self.done:
+            self.step()
+        if self.exc_info is not None:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.value
+
+    def _send(self, value, exc_info=None):
+        try:
+            if exc_info is None:
+                yielded = self.generator.send(value)
+            else:
+                yielded = self.generator.throw(*exc_info)
+        except StopIteration, ex:
+            self._finish(getattr(ex, 'value', None))
+            return
+        except Exception:
+            self._fail(sys.exc_info())
+            return
+        if isinstance(yielded, types.GeneratorType):
+            yielded = Task(yielded)
+        elif isinstance(yielded, (list, tuple)):
+            yielded = FutureList([
+                isinstance(f, types.GeneratorType) and Task(f) or f
+                for f in yielded])
+        elif not is_future(yielded):
+            self._send(None, (TypeError, TypeError(
+                'Coroutines must yield futures, not %r' % (yielded,)), None))
+            return
+        self.future = yielded
+
+    def _finish(self, value):
+        self.done = True
+        self.value = value
+        self.elapsed = time.time() - self.start
+        self.future = self.generator = None
+        for callback in self.callbacks:
+            callback(value)
+
+    def _fail(self, exc_info):
+        self.done = True
+        self.exc_info = exc_info
+        self.elapsed = time.time() - self.start
+        self.future = self.generator = None
+
+
+def wait_all(tasks):
+    """Waits for all tasks to finish.
+
+    Tasks are stepped in turns, so the next futures of all coroutines are
+    started before any of them is waited for again.
+
+    :param list tasks: Tasks.
+    """
+    pending = [task for task in tasks if not task.done]
+    while pending:
+        for task in pending:
+            task.step()
+        pending = [task for task in pending if not task.done]
+
+
+class BatchExecutor(object):
+    """Executes the messages of a batch one after another.
+
+    This is the default behaviour of a JsonRpcHandler and the base class for
+    executors dispatching batch entries concurrently.
+    """
+
+    def imap(self, function, messages):
+        """Applies function to each message.
+
+        The function returns a tuple of result and error as
+        `Dispatcher.dispatch_message` does. Outcomes are yielded in the
+        order of the messages.
+
+        :param function function: A function taking one message.
+        :param list messages: JSON-RPC messages.
+        """
+        for msg in messages:
+            yield function(msg)
+
+
+class ThreadedBatchExecutor(BatchExecutor):
+    """Executes the messages of a batch concurrently in a pool of threads.
+
+    Service methods of the handler are called from several threads at once
+    and must not share unprotected state. Workers are started on demand and
+    exit as soon as the queue is empty, so none outlives the batch except to
+    finish an abandoned call; `max_workers` bounds the calls executed at once
+    by all requests sharing the executor.
+
+    App Engine requires the threads of a request to finish before it ends,
+    and the Python 2.5 runtime cannot start threads at all. If no worker can
+    be started, the calls are executed one after another in the calling
+    thread and the timeout is not enforced.
+
+    A call exceeding the timeout is answered with an ExecutionTimeoutError.
+    It is abandoned but keeps its worker until it returns, so abandoned calls
+    count against `max_workers`. While all workers are held by abandoned
+    calls, calls waiting for a worker are answered with an
+    ExecutionTimeoutError at once.
+
+    :param int max_workers: Maximum number of calls executed at once.
+    :param float timeout: Seconds a single call may take or None.
+    """
+
+    def __init__(self, max_workers=4, timeout=None):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.condition = threading.Condition()
+        self.queue = []
+        self.workers = 0
+        self.abandoned = 0
+
+    def imap(self, function, messages):
+        jobs = [self.submit(function, msg) for msg in messages]
+        try:
+            for job in jobs:
+                yield self.wait(job)
+        finally:
+            self.condition.acquire()
+            try:
+                for job in jobs:
+                    job.cancelled = job.started is None
+            finally:
+                self.condition.release()
+
+    def call(self, function, msg):
+        """Calls function for a single message, honouring the timeout.
+
+        :param function function: A function taking one message.
+        :param msg: A JSON-RPC message.
+        """
+        return self.wait(self.submit(function, msg))
+
+    def submit(self, function, msg):
+        """Queues a call for the next free worker.
+
+        A worker is started unless `max_workers` are running. The call is
+        executed right away if no worker is running and none can be started.
+
+        :param function function: A function taking one message.
+        :param msg: A JSON-RPC message.
+        :returns: The queued ExecutorJob.
+        """
+        job = ExecutorJob(function, msg)
+        inline = False
+        self.condition.acquire()
+        try:
+            self.queue.append(job)
+            if self.workers < self.max_workers:
+                try:
+                    self.start_worker()
+                    self.workers += 1
+                except (threading.ThreadError, RuntimeError,
+                        NotImplementedError), ex:
+                    if not self.workers:
+                        logging.warning('Executing sequentially: %s', ex)
+                        self.queue.remove(job)
+                        inline = True
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+        if inline:
+            job.started = time.time()
+            job.outcome = self._call(function, msg)
+            job.done = True
+        return job
+
+    def start_worker(self):
+        """Starts a worker thread running work()."""
+        worker = threading.Thread(target=self.work)
+        worker.setDaemon(True)
+        worker.start()
+
+    def wait(self, job):
+        """Waits for the outcome of a submitted call.
+
+        :param ExecutorJob job: A job returned by submit.
+        :returns: A tuple of result and error.
+        """
+        self.condition.acquire()
+        try:
+            while not job.done:
+                if self.timeout is None:
+                    self.condition.wait()
+                elif job.started is None:
+                    if self.abandoned >= self.max_workers:
+                        job.cancelled = True
+                        return self.timed_out(job.msg)
+                    self.condition.wait(self.timeout)
+                else:
+                    remaining = job.started + self.timeout - time.time()
+                    if remaining <= 0:
+                        job.abandoned = True
+                        self.abandoned += 1
+                        return self.timed_out(job.msg)
+                    self.condition.wait(remaining)
+            return job.outcome
+        finally:
+            self.condition.release()
+
+    def work(self):
+        """Runs queued calls until the queue is empty; a worker thread."""
+        while True:
+            self.condition.acquire()
+            try:
+                if not self.queue:
+                    self.workers -= 1
+                    return
+                job = self.queue.pop(0)
+                if job.cancelled:
+                    continue
+                job.started = time.time()
+            finally:
+                self.condition.release()
+            outcome = self._call(job.function, job.msg)
+            self.condition.acquire()
+            try:
+                job.outcome = outcome
+                job.done = True
+                if job.abandoned:
+                    self.abandoned -= 1
+                self.condition.notifyAll()
+            finally:
+                self.condition.release()
+
+    def timed_out(self, msg):
+        ex = ExecutionTimeoutError(
+            'Method %s timed out after %s seconds' %
+            (msg.method_name, self.timeout))
+        logging.error(ex)
+        return None, ex
+
+    def _call(self, function, msg):
+        try:
+            return function(msg)
+        except Exception, ex:
+            logging.error(ex)
+            return None, InternalError("Error executing service method")
+
+
+class ExecutorJob(object):
+    """A call queued in a ThreadedBatchExecutor.
+
+    :param function function: A function taking one message.
+    :param msg: A JSON-RPC message.
+    """
+
+    def __init__(self, function, msg):
+        self.function = function
+        self.msg = msg
+        self.started = None
+        self.done = False
+        self.outcome = None
+        self.cancelled = False
+        self.abandoned = False
+
+
+class DispatchEvent(object):
+    """Measurements of a single call passed to instruments.
+
+    Times are given in seconds. The parse time is the time it took to parse
+    the whole request the message was part of; the parameter size is the
+    number of parameters.
+
+    :param msg: A JSON-RPC message.
+    :param float parse_time: The time it took to parse the request.
+    :param string method: The name the call is recorded under, see
+        Dispatcher.recorded_name; the method name of the message by default.
+    """
+
+    __slots__ = ('method', 'message_id', 'notification', 'param_size',
+                 'parse_time', 'execution_time', 'serialization_time',
+                 'error')
+
+    def __init__(self, msg, parse_time, method=None):
+        self.method = method or msg.method_name
+        self.message_id = msg.message_id
+        self.notification = msg.notification
+        params = msg.params
+        self.param_size = params is not None and len(params) or 0
+        self.parse_time = parse_time
+        self.execution_time = 0.0
+        self.serialization_time = 0.0
+        self.error = None
+
+
 class JsonRpcMessage(object):
     """A single JSON-RPC message.
 
     :param dict json: The JSON-RPC message Python representation.
     """
 
+    __slots__ = ('method_name', 'params', 'message_id', 'notification',
+                 'error', 'result', 'event')
+
     def __init__(self, json=None):
-        super(JsonRpcMessage, self).__init__()
+        self.method_name = None
+        self.params = None
         self.message_id = None
         self.notification = False
         self.error = None
         self.result = None
+        self.event = None
         if json is not None:
             self.from_json(json)
 
     def from_json(self, json):
         """Parses a single JSON-RPC message.
 
+        All members are looked up once; unknown members are detected by
+        comparing their number with the number of known members found.
+        Invalid messages are answered without raising and catching an
+        exception.
+
         :param dict json: The JSON-RPC message Python representation.
         """
-        try:
-            if not isinstance(json, dict):
-                raise InvalidRequestError(
-                        'Invalid JSON-RPC Message; must be an object')
+        if not isinstance(json, dict):
+            return self.invalid('Invalid JSON-RPC Message; must be an object')
 
-            if not set(json.keys()) <= JSON_RPC_KEYS:
-                raise InvalidRequestError('Invalid members in request object')
+        get = json.get
+        version = get('jsonrpc', _MISSING)
+        method = get('method', _MISSING)
+        params = get('params', _MISSING)
+        message_id = get('id', _MISSING)
 
-            if not ('jsonrpc' in json and json['jsonrpc'] == '2.0'):
-                raise InvalidRequestError('Server supports JSON-RPC 2.0 only')
+        if len(json) != ((version is not _MISSING) +
+                         (method is not _MISSING) +
+                         (params is not _MISSING) +
+                         (message_id is not _MISSING)):
+            return self.invalid('Invalid members in request object')
 
-            if 'method' not in json:
-                raise InvalidRequestError('No method specified')
+        if version != '2.0':
+            return self.invalid('Server supports JSON-RPC 2.0 only')
 
-            if not isinstance(json['method'], basestring):
-                raise InvalidRequestError('Method must be a string')
+        if method is _MISSING:
+            return self.invalid('No method specified')
 
-            self.method_name = json['method']
+        if not isinstance(method, basestring):
+            return self.invalid('Method must be a string')
 
-            if 'params' in json:
-                params = json['params']
-                if not isinstance(params, (dict, list, tuple)):
-                    raise InvalidRequestError(
-                            "'params' must be an array or object")
-                self.params = params
+        self.method_name = method
 
-            if 'id' not in json:
-                self.notification = True
-            else:
-                self.message_id = json['id']
-        except InvalidRequestError, ex:
-            self.error = ex
-            logging.error('Encountered invalid json message')
+        if params is not _MISSING:
+            if not isinstance(params, (dict, list, tuple)):
+                return self.invalid("'params' must be an array or object")
+            self.params = params
 
+        if message_id is _MISSING:
+            self.notification = True
+        else:
+            self.message_id = message_id
+
+    def invalid(self, message):
+        """Marks the message as invalid.
+
+        :param string message: The message of the InvalidRequestError.
+        """
+        self.error = InvalidRequestError(message)
+        logging.error('Encountered invalid json message')
 
-class JsonRpcHandler(webapp.RequestHandler):
-    """Subclass this handler to implement a JSON-RPC handler.
+
+class Dispatcher(object):
+    """Framework independent JSON-RPC dispatcher.
+
+    Subclass this class to implement a JSON-RPC service and serve it with
+    JsonRpcApplication from any WSGI server, or subclass JsonRpcHandler for
+    a webapp handler; both share all the logic implemented here.
 
     Annotate methods with @ServiceMethod to expose them and make them callable
     via JSON-RPC. Currently methods with *args or **kwargs are not supported
     as service-methods. All parameters have to be named explicitly.
+
+    Service methods are collected into the class attribute `service_methods`
+    when the class is created; adding methods to the class afterwards does
+    not expose them. Service classes mounted by `services` under a namespace
+    are compiled into the same table, see Service.
+
+    Batch entries are executed one after another unless `batch_executor` is
+    set, e.g. to a ThreadedBatchExecutor. With `stream_batches` enabled each
+    batch response is serialized and written as soon as its message is
+    handled instead of encoding the whole batch at once. With
+    `deduplicate_batches` enabled, equal calls of safe service methods within
+    a batch are executed only once.
+
+    Service methods returning a future, or coroutine service methods, are
+    run as a Task. The calls of a batch are started one after another; once
+    the first task has been started, responses are held back until all calls
+    are started and all tasks are finished, so their RPCs overlap. The
+    `timeout` of a ThreadedBatchExecutor applies to starting a task only.
+    The `loader`, an instance of `loader_class` per request, batches the
+    datastore gets of all calls; see json_rpc_loader. The default None is a
+    json_rpc_loader.EntityLoader.
+
+    The modules of optional features are imported when they are used first,
+    so they stay off the cold start of instances not using them.
+
+    With `incremental_batches` enabled, JSON batches are read from the
+    request stream, decoded and executed one call at a time while the
+    response is streamed, so large batches are never held in memory as a
+    whole; see dispatch_incrementally. The batch executor and deduplication
+    do not apply to them, and their bodies are not logged.
+
+    With a `notification_queue`, e.g. a json_rpc_deferred.TaskQueue, valid
+    notifications are enqueued as one batch instead of being executed, so
+    the response is sent without waiting for them. Requests flagged as
+    `queued`, which the adapters do for requests of the App Engine task
+    queue, are executed as usual; rate limits do not apply to them again.
+    Notifications of incremental batches are not deferred. Any client can
+    send the header of the task queue, so it is trusted only if
+    `trust_queue_header` is True or, if None, when running on App Engine,
+    which removes it from external requests; see is_queued.
+
+    Results are encoded by the `model_serializer` if it handles them, e.g.
+    a json_rpc_models.ModelSerializer encoding datastore entities.
+
+    Service methods returning an iterator, e.g. a generator over a datastore
+    query, or a Page of a result set are streamed: the result array is
+    encoded one item at a time while the response body is written, so the
+    items never sit in memory as a whole. An error raised by the iterator
+    after the response has started aborts the response, since the status and
+    the first items have already been sent. Streamed results are not cached,
+    their serialization time is not measured, and they are read into a list
+    if a batch shares them among duplicate calls. Streamed responses to
+    batches are joined in memory unless `stream_batches` is enabled;
+    MessagePack buffers the encoded items since it frames arrays with their
+    length. See json_rpc_models.paginate for datastore cursor pagination.
+
+    Messages are decoded and encoded with `codec`; by default the fastest
+    codec available is selected, see json_rpc_codecs. Requests with one of
+    the `binary_content_types` are decoded with MessagePack instead, and
+    responses are encoded with MessagePack if the request was or if the
+    client prefers it by its Accept header; see json_rpc_msgpack. An empty
+    tuple disables MessagePack.
+
+    Responses of at least `compression_threshold` bytes are compressed with
+    gzip or deflate if the client accepts it; None disables compression.
+    Request bodies may be gzip or deflate encoded and must not exceed
+    `max_decompressed_size` bytes once decompressed; see
+    json_rpc_compression.
+
+    With `allow_get` enabled, safe service methods may also be called with
+    HTTP GET, passing the method, params and id in the query string as
+    described by the json-rpc-over-http proposal. Responses carry a weak
+    ETag of the serialized response, which is matched against If-None-Match
+    to answer 304 Not Modified, and the `cache_control` of the method or the
+    dispatcher.
+
+    The `admission` control, e.g. a json_rpc_admission.AdmissionControl,
+    bounds the body size before it is decoded, the batch size, the number of
+    concurrent requests and the rate of calls per client and method. The
+    client is identified by get_client_id(), the remote address set as
+    `client_id` by JsonRpcHandler and JsonRpcApplication by default.
+    Rejections are ServerErrors with HTTP status 413, 429 or 503.
+
+    With a `profiler`, e.g. a json_rpc_profile.SampledProfiler, a sample of
+    requests is profiled per phase and service method. Its aggregated
+    statistics are exposed to administrators via the reserved method
+    'rpc.profile'; JsonRpcHandler and JsonRpcApplication set `admin` for
+    requests of App Engine administrators.
+
+    Objects in `instruments` are notified about every call through their
+    methods before_dispatch(event) and after_dispatch(event), the latter
+    after the response was serialized; see DispatchEvent. They are called
+    from the threads of the batch executor and must be thread-safe.
+    Instruments providing a snapshot() method, like json_rpc_stats.MethodStats,
+    are exposed to administrators via the reserved method 'rpc.stats'. Calls
+    of methods missing from the dispatch table are recorded by instruments
+    and the profiler under UNKNOWN_METHOD, so clients cannot add entries.
+
+    Request bodies are logged at debug level for a sample of requests given
+    by `log_body_sample_rate`, truncated to `log_body_limit` characters.
+    Tracebacks of failing calls are formatted only if they are logged at
+    debug level or returned as error data with `include_tracebacks`; never
+    for notifications.
     """
-    
-    def __init__(self):
-        webapp.RequestHandler.__init__(self)
 
-    def post(self):
-        self.handle_request()
+    __metaclass__ = ServiceMethodRegistry
 
-    def handle_request(self):
-        """Handles POST request."""
+    batch_executor = None
+
+    stream_batches = False
+
+    deduplicate_batches = False
+
+    incremental_batches = False
+
+    notification_queue = None
+
+    model_serializer = None
+
+    queued = False
+
+    trust_queue_header = None
+
+    codec = None
+
+    binary_content_types = ('application/msgpack', 'application/x-msgpack')
+
+    instruments = ()
+
+    log_body_limit = 1024
+
+    log_body_sample_rate = 1.0
+
+    include_tracebacks = False
+
+    loader_class = None
+
+    compression_threshold = 1024
+
+    compression_level = 6
+
+    max_decompressed_size = 10 * 1024 * 1024
+
+    allow_get = False
+
+    cache_control = 'no-cache'
+
+    admission = None
+
+    client_id = None
+
+    services = None
+
+    profiler = None
+
+    admin = False
+
+    _loader = None
+
+    _services = None
+
+    _profile = None
+
+    _loader_lock = threading.Lock()
+
+    def get_codec(self):
+        """Returns the codec used for requests and responses."""
 
-        self.response.headers['Content-Type'] = 'application/json-rpc'
+        return self.codec or json_rpc_codecs.get_codec()
+
+    def negotiate_codecs(self, content_type=None, accept=None):
+        """Selects the codecs for a request and its response.
+
+        :param string content_type: The Content-Type of the request.
+        :param string accept: The Accept header of the request.
+        :returns: A tuple of the request and the response codec.
+        """
+
+        binary_types = self.binary_content_types
+        codec = self.get_codec()
+        if not binary_types:
+            return codec, codec
+        import json_rpc_msgpack
+        decoder = codec
+        if content_type:
+            media_type = content_type.split(';')[0].strip().lower()
+            if media_type in binary_types:
+                decoder = json_rpc_msgpack.get_codec()
+        encoder = decoder
+        if accept:
+            if decoder is codec:
+                offered = json_rpc_codecs.JSON_CONTENT_TYPES + binary_types
+            else:
+                offered = binary_types + json_rpc_codecs.JSON_CONTENT_TYPES
+            preferred = json_rpc_codecs.best_match(accept, offered)
+            if preferred in binary_types:
+                encoder = json_rpc_msgpack.get_codec()
+            elif preferred is not None:
+                encoder = codec
+        return decoder, encoder
+
+    def _get_loader(self):
+        if self._loader is None:
+            self._loader_lock.acquire()
+            try:
+                if self._loader is None:
+                    if self.loader_class is None:
+                        import json_rpc_loader
+                        self._loader = json_rpc_loader.EntityLoader()
+                    else:
+                        self._loader = self.loader_class()
+            finally:
+                self._loader_lock.release()
+        return self._loader
+
+    loader = property(_get_loader)
+
+    def is_queued(self, environ):
+        """Returns whether a request was sent by the App Engine task queue.
+
+        :param dict environ: The WSGI environment of the request.
+        """
+
+        if QUEUE_ENVIRON not in environ:
+            return False
+        trusted = self.trust_queue_header
+        if trusted is None:
+            software = (environ.get('SERVER_SOFTWARE') or
+                        os.environ.get('SERVER_SOFTWARE') or '')
+            trusted = software.startswith(TRUSTED_SERVERS)
+        return trusted
+
+    def get_client_id(self):
+        """Returns the identity of the client for rate limits."""
+
+        return self.client_id
+
+    def check_body_size(self, size):
+        """Raises RequestTooLargeError if a body is not admitted.
+
+        :param int size: The size of the body in bytes.
+        """
+
+        admission = self.admission
+        if admission is not None and not admission.body_allowed(size):
+            raise RequestTooLargeError(
+                'Request body exceeds %i bytes' % admission.max_body_size)
+
+    def admit_calls(self, messages):
+        """Fails the calls exceeding the rate limits of the client.
+
+        Calls of methods missing from the dispatch table are limited as one
+        method, so clients cannot create buckets with arbitrary names.
+
+        :param list messages: JSON-RPC messages.
+        """
+
+        admission = self.admission
+        if admission is None or not admission.rate_limits:
+            return
+        client_id = self.get_client_id()
+        table = self.dispatch_table
+        for msg in messages:
+            if msg.error is not None:
+                continue
+            method_name = msg.method_name
+            if method_name not in table:
+                method_name = None
+            if not admission.call_allowed(client_id, method_name):
+                msg.error = RateLimitExceededError(
+                    'Rate limit exceeded for %s' % msg.method_name)
+                logging.error(msg.error)
+
+    def error_response(self, error, codec=None):
+        """Returns the HTTP-status and body of a rejected request.
+
+        :param JsonRpcError error: The error.
+        :param codec: The codec of the response; the default codec if None.
+        """
+
+        logging.error(error)
+        codec = codec or self.get_codec()
+        return error.status, [codec.dumps(self._build_error(error))]
+
+    def dispatch(self, body, content_encoding=None, codecs=None):
+        """Dispatches a JSON-RPC request.
+
+        Parses and validates the body, executes the messages and encodes the
+        responses. Returns a tuple of the HTTP-status and an iterable of
+        strings forming the response body, which is empty for status 204.
+        Streamed batches are executed while the iterable is consumed; until
+        it is exhausted or closed the request counts against the concurrency
+        limit of `admission`.
+
+        :param body: The HTTP body; a string or, for incremental_batches, a
+            json_rpc_stream.BodyStream.
+        :param string content_encoding: The Content-Encoding of the body.
+        :param tuple codecs: The request and response codec as returned by
+            negotiate_codecs; the default codec by default.
+        """
+
+        if codecs is None:
+            codecs = (self.get_codec(),) * 2
+        profiler = self.profiler
+        session = profiler is not None and profiler.sample() or None
+        # Also discards the session of a previous request
+        self._profile = session
+        if session is None:
+            return self._admit(body, content_encoding, codecs)
         try:
-            logging.debug("Raw JSON-RPC: %s", self.request.body)
-            messages, batch_request = self.parse_body(self.request.body)
-        except (InvalidRequestError, ParseError), ex:
-            logging.error(ex)
-            self.error(ex.status)
-            body = self._build_error(ex)
-            self.response.out.write(simplejson.dumps(body))
-        else:
+            status, chunks = self._admit(body, content_encoding, codecs)
+        except:
+            profiler.add(session)
+            raise
+        if isinstance(chunks, list):
+            profiler.add(session)
+            return status, chunks
+        import json_rpc_stream
+        return status, json_rpc_stream.ClosingIterator(
+            chunks, lambda: profiler.add(session))
+
+    def _admit(self, body, content_encoding, codecs):
+        admission = self.admission
+        if admission is None:
+            return self._dispatch(body, content_encoding, codecs)
+        if not admission.enter():
+            return self.error_response(ServerBusyError(), codecs[1])
+        try:
+            status, chunks = self._dispatch(body, content_encoding, codecs)
+        except:
+            admission.leave()
+            raise
+        if isinstance(chunks, list):
+            admission.leave()
+            return status, chunks
+        import json_rpc_stream
+        return status, json_rpc_stream.ClosingIterator(
+            chunks, admission.leave)
+
+    def _dispatch(self, body, content_encoding, codecs):
+        decoder, encoder = codecs
+        self._loader = self._services = None
+        try:
+            self.check_body_size(len(body))
+            if not isinstance(body, basestring):
+                import json_rpc_stream
+                reader = json_rpc_stream.ArrayReader(body)
+                if (reader.peek() == '[' and not content_encoding and
+                        decoder is encoder and
+                        decoder is self.get_codec()):
+                    return self.dispatch_incrementally(reader, decoder)
+                body = reader.read_all()
+            if content_encoding:
+                body = self.decompress_body(body, content_encoding)
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                self.log_body(body)
+            start = time.time()
+            if self._profile is None:
+                messages, batch_request = self.parse_body(body, decoder)
+            else:
+                messages, batch_request = self._profile.run(
+                    'parse', None, self.parse_body, body, decoder)
+            parse_time = time.time() - start
+            admission = self.admission
+            if batch_request and admission is not None and \
+                    not admission.batch_allowed(len(messages)):
+                raise RequestTooLargeError(
+                    'Batch exceeds %i calls' % admission.max_batch_size)
+        except (InvalidRequestError, ParseError, ServerError), ex:
+            return self.error_response(ex, encoder)
+
+        if not self.queued:
+            self.admit_calls(messages)
+            if self.notification_queue is not None:
+                messages = self.defer_notifications(messages)
+                if not messages:
+                    return 204, []
+        if self.instruments:
             for msg in messages:
-                self.handle_message(msg)
+                if msg.error is None:
+                    msg.event = DispatchEvent(
+                        msg, parse_time, self.recorded_name(msg.method_name))
+
+        responses = self.encode_responses(messages, encoder)
+        if batch_request and self.stream_batches:
+            count = len([msg for msg in messages if not msg.notification])
+            if count:
+                return 200, self.stream_batch(responses, encoder, count)
+
+        responses = list(responses)
+        if len(responses) == 0:
+            # Only notifications were sent
+            return 204, []
+
+        if batch_request:
+            #TODO Which http_status to set for batches?
+            return 200, [encoder.join_array(
+                [join_body(r[1]) for r in responses])]
+        else:
+            if len(responses) != 1:
+                # This should never happen
+                raise InternalError()   # pragma: no cover
+            status, body = responses[0]
+            if not isinstance(body, basestring):
+                # A streamed result
+                return status, body
+            return status, [body]
+
+    def defer_notifications(self, messages):
+        """Hands the valid notifications to the `notification_queue`.
+
+        The notifications are encoded as one batch and enqueued at once.
+        Invalid notifications are dropped, since they are not answered.
+        If enqueueing fails, they are executed with the other messages.
+
+        :param list messages: JSON-RPC messages.
+        :returns: The messages to execute now.
+        """
+
+        remaining = []
+        deferred = []
+        for msg in messages:
+            if not msg.notification or msg.error is not None:
+                remaining.append(msg)
+                continue
+            f = self.service_methods.get(msg.method_name)
+            if f is None or f.service_spec.variable:
+                logging.error('Dropped notification of %s', msg.method_name)
+                continue
+            try:
+                f.service_spec.adapt(msg.params)
+            except json_rpc_params.ParamsError, ex:
+                logging.error('Dropped notification of %s: %s',
+                              msg.method_name, ex)
+                continue
+            notification = {'jsonrpc': '2.0', 'method': msg.method_name}
+            if msg.params is not None:
+                notification['params'] = msg.params
+            deferred.append((msg, notification))
+        if not deferred:
+            return remaining
+        try:
+            self.notification_queue.enqueue(
+                self.get_codec().dumps([n for m, n in deferred]), self)
+        except Exception:
+            logging.exception('Enqueueing notifications failed')
+            return messages
+        return remaining
+
+    def dispatch_incrementally(self, reader, codec):
+        """Dispatches a batch while it is read.
+
+        Returns a tuple of the HTTP-status and an iterable of strings like
+        dispatch. The first call is decoded before and every following call
+        while the iterable is consumed. Once the response is started, a
+        ParseError for malformed JSON or a RequestTooLargeError for
+        exceeding the maximum batch size is appended as last response with
+        id null and the rest of the batch is ignored.
+
+        :param reader: A json_rpc_stream.ArrayReader.
+        :param codec: The codec of the request and the response.
+        """
+
+        elements = reader.elements()
+        try:
+            start = time.time()
+            try:
+                msg = JsonRpcMessage(codec.loads(elements.next()))
+            except StopIteration:
+                raise InvalidRequestError('Recieved an empty batch message')
+            except ValueError:
+                raise ParseError()
+            parse_time = time.time() - start
+        except (InvalidRequestError, ParseError), ex:
+            return self.error_response(ex, codec)
+
+        messages = self.read_batch(msg, parse_time, elements, codec)
+        responses = self.encode_responses(messages, codec)
+        try:
+            first = responses.next()
+        except StopIteration:
+            # Only notifications were sent
+            return 204, []
+        return 200, self.stream_batch(
+            itertools.chain([first], responses), codec)
+
+    def read_batch(self, msg, parse_time, elements, codec):
+        """Yields the messages of a batch as they are decoded.
+
+        :param msg: The first JSON-RPC message.
+        :param float parse_time: The time taken to decode it.
+        :param elements: An iterator over the texts of the other messages.
+        :param codec: The codec of the request.
+        """
 
-            responses = self.get_responses(messages)
-            if len(responses) == 0:
-                # Only notifications were sent
-                self.error(204)
+        admission = self.admission
+        limit = admission is not None and admission.max_batch_size
+        count = 0
+        while True:
+            count += 1
+            if limit and count > limit:
+                msg = JsonRpcMessage()
+                msg.error = RequestTooLargeError(
+                    'Batch exceeds %i calls' % limit)
+                logging.error(msg.error)
+                yield msg
                 return
+            if not self.queued:
+                self.admit_calls([msg])
+            if self.instruments and msg.error is None:
+                msg.event = DispatchEvent(
+                    msg, parse_time, self.recorded_name(msg.method_name))
+            yield msg
+            start = time.time()
+            try:
+                msg = JsonRpcMessage(codec.loads(elements.next()))
+            except StopIteration:
+                return
+            except ValueError:
+                msg = JsonRpcMessage()
+                msg.error = ParseError()
+                logging.error(msg.error)
+                yield msg
+                return
+            parse_time = time.time() - start
 
-            if batch_request:
-                #TODO Which http_status to set for batches?
-                self.error(200)
-                body = [r[1] for r in responses]
-                self.response.out.write(simplejson.dumps(body))
+    def dispatch_get(self, query, if_none_match=None, codec=None):
+        """Dispatches a JSON-RPC request sent with HTTP GET.
+
+        Returns a tuple of the HTTP-status, an iterable of strings forming
+        the response body and a list of additional headers. Only safe
+        service methods may be called.
+
+        :param string query: The query string.
+        :param string if_none_match: The If-None-Match header.
+        :param codec: The codec of the response; the default codec if None.
+        """
+
+        codec = codec or self.get_codec()
+        profiler = self.profiler
+        session = profiler is not None and profiler.sample() or None
+        # Also discards the session of a previous request
+        self._profile = session
+        if session is None:
+            return self._admit_get(query, if_none_match, codec)
+        try:
+            return self._admit_get(query, if_none_match, codec)
+        finally:
+            profiler.add(session)
+
+    def _admit_get(self, query, if_none_match, codec):
+        admission = self.admission
+        if admission is None:
+            return self._dispatch_get(query, if_none_match, codec)
+        if not admission.enter():
+            status, body = self.error_response(ServerBusyError(), codec)
+            return status, body, [('Cache-Control', 'no-cache')]
+        try:
+            return self._dispatch_get(query, if_none_match, codec)
+        finally:
+            admission.leave()
+
+    def _dispatch_get(self, query, if_none_match, codec):
+        self._loader = self._services = None
+        try:
+            start = time.time()
+            if self._profile is None:
+                msg = self.parse_query(query)
             else:
-                if len(responses) != 1:
-                    # This should never happen
-                    raise InternalError()   # pragma: no cover
-                status, body = responses[0]
-                self.error(status)
-                self.response.out.write(simplejson.dumps(body))
+                msg = self._profile.run('parse', None, self.parse_query, query)
+            parse_time = time.time() - start
+        except (InvalidRequestError, ParseError), ex:
+            status, body = self.error_response(ex, codec)
+            return status, body, [('Cache-Control', 'no-cache')]
+
+        cache_control = self.cache_control
+        if msg.error is None:
+            f = self.service_methods.get(msg.method_name)
+            if f is not None:
+                spec = f.service_spec
+                if not spec.safe:
+                    msg.error = MethodNotAllowedError(
+                        'Method %s may not be called with GET' %
+                        msg.method_name)
+                    logging.error(msg.error)
+                elif spec.cache_control is not None:
+                    cache_control = spec.cache_control
+        self.admit_calls([msg])
+        if self.instruments and msg.error is None:
+            msg.event = DispatchEvent(
+                msg, parse_time, self.recorded_name(msg.method_name))
+
+        status, body = list(self.encode_responses([msg], codec))[0]
+        body = join_body(body)
+        if status != 200:
+            return status, [body], [('Cache-Control', 'no-cache')]
+        etag = 'W/"%s"' % hashlib.md5(body).hexdigest()
+        headers = [('ETag', etag), ('Cache-Control', cache_control)]
+        if if_none_match and self.etag_matches(etag, if_none_match):
+            return 304, [], headers
+        return 200, [body], headers
+
+    def parse_query(self, query):
+        """Parses the query string of a GET request into a message.
+
+        The params may be given as JSON text or as Base64 encoded JSON text.
+        Parameters other than jsonrpc, method, params and id are ignored, so
+        clients may add parameters to bypass caches.
+
+        :param string query: The query string.
+        :returns: A JsonRpcMessage.
+        """
+
+        fields = cgi.parse_qs(query, keep_blank_values=True)
+        json = {'jsonrpc': '2.0', 'id': None}
+        for name in ('jsonrpc', 'method', 'params', 'id'):
+            values = fields.get(name)
+            if values is None:
+                continue
+            if len(values) != 1:
+                raise InvalidRequestError(
+                    "Query parameter '%s' must be given once" % name)
+            json[name] = values[0]
+        if 'params' in json:
+            json['params'] = self.decode_query_params(json['params'])
+        if json['id'] is not None:
+            try:
+                message_id = self.get_codec().loads(json['id'])
+            except ValueError:
+                pass
+            else:
+                if isinstance(message_id, (basestring, int, long, float)):
+                    json['id'] = message_id
+        return JsonRpcMessage(json)
+
+    def decode_query_params(self, value):
+        """Decodes the params given in a query string.
+
+        :param string value: JSON text or Base64 encoded JSON text.
+        """
+
+        loads = self.get_codec().loads
+        try:
+            return loads(value)
+        except ValueError:
+            pass
+        try:
+            value = str(value)
+            return loads(base64.urlsafe_b64decode(
+                value + '=' * (-len(value) % 4)))
+        except (TypeError, ValueError):
+            raise ParseError()
+
+    def etag_matches(self, etag, if_none_match):
+        """Compares an ETag with an If-None-Match header.
+
+        Uses the weak comparison of HTTP.
+
+        :param string etag: The ETag of the response.
+        :param string if_none_match: The If-None-Match header.
+        """
+
+        if if_none_match.strip() == '*':
+            return True
+        opaque = etag.replace('W/', '', 1)
+        for candidate in if_none_match.split(','):
+            candidate = candidate.strip()
+            if candidate.startswith('W/'):
+                candidate = candidate[2:]
+            if candidate == opaque:
+                return True
+        return False
+
+    def decompress_body(self, body, content_encoding):
+        """Decodes a compressed request body.
+
+        :param string body: The HTTP body.
+        :param string content_encoding: The Content-Encoding of the body.
+        """
+
+        import json_rpc_compression
+        try:
+            return json_rpc_compression.decompress(
+                body, content_encoding, self.max_decompressed_size)
+        except json_rpc_compression.DecompressionError, ex:
+            raise InvalidRequestError(str(ex))
+
+    def get_vary(self):
+        """Returns the Vary header of responses or None.
+
+        Responses depend on the Accept header if they may be encoded with
+        MessagePack and on Accept-Encoding if they may be compressed, so
+        shared caches must keep their variants apart.
+        """
+
+        names = []
+        if self.binary_content_types:
+            names.append('Accept')
+        if self.compression_threshold is not None:
+            names.append('Accept-Encoding')
+        return ', '.join(names) or None
+
+    def compress_response(self, body, accept_encoding):
+        """Compresses a response body if the client accepts it.
+
+        Returns a tuple of the content coding or None and the body.
+
+        :param body: An iterable of strings as returned by dispatch.
+        :param string accept_encoding: The Accept-Encoding of the request.
+        """
+
+        threshold = self.compression_threshold
+        if threshold is None or not accept_encoding:
+            return None, body
+        import json_rpc_compression
+        return json_rpc_compression.compress_chunks(
+            body, json_rpc_compression.negotiate(accept_encoding),
+            threshold, self.compression_level)
+
+    def log_body(self, body):
+        """Logs a sample of request bodies, truncated to `log_body_limit`.
+
+        :param string body: The HTTP body.
+        """
+
+        rate = self.log_body_sample_rate
+        if rate < 1.0 and random.random() >= rate:
+            return
+        limit = self.log_body_limit
+        if limit is not None and len(body) > limit:
+            logging.debug("Raw JSON-RPC (%i of %i bytes): %s",
+                          limit, len(body), body[:limit])
+        else:
+            logging.debug("Raw JSON-RPC: %s", body)
+
+    def encode_responses(self, messages, codec):
+        """Handles messages and encodes their responses.
+
+        Yields a tuple of HTTP-status and encoded response for every message
+        that is not a notification. Results are released once they are
+        encoded. The response of a streamed result is an iterator of strings
+        encoding the result while it is consumed.
+
+        :param list messages: JSON-RPC messages.
+        :param codec: The codec of the responses.
+        """
+
+        session = self._profile
+        if session is None:
+            dumps = lambda response: self.encode_response(response, codec)
+        else:
+            dumps = lambda response: session.run(
+                'serialize', self.recorded_name(msg.method_name),
+                self.encode_response,
+                response, codec)
+        for msg in self.handle_messages(messages):
+            resp = self.get_response(msg)
+            msg.result = None
+            event = msg.event
+            if resp is not None:
+                if event is None:
+                    yield resp[0], dumps(resp[1])
+                    continue
+                start = time.time()
+                body = dumps(resp[1])
+                event.serialization_time = time.time() - start
+            if event is not None:
+                for instrument in self.instruments:
+                    instrument.after_dispatch(event)
+            if resp is not None:
+                yield resp[0], body
+
+    def encode_response(self, response, codec):
+        """Encodes a response object.
+
+        Results are encoded by the `model_serializer` if it handles them.
+        Streamed results are returned as an iterator of strings.
+
+        :param dict response: A JSON-RPC response object.
+        :param codec: The codec of the response.
+        """
+
+        result = response.get('result')
+        if result is not None:
+            if is_streamed(result):
+                return codec.stream_result(
+                    self.stream_result(result, codec), response['id'])
+            serializer = self.model_serializer
+            if serializer is not None:
+                encoded = serializer.encode(result, codec)
+                if encoded is not None:
+                    return codec.encode_result(encoded, response['id'])
+        return codec.dumps(response)
+
+    def stream_result(self, result, codec):
+        """Yields the encoding of a streamed result piece by piece.
+
+        Items are encoded one at a time, by the `model_serializer` if it
+        handles them.
+
+        :param result: An iterator or a Page.
+        :param codec: The codec of the response.
+        """
+
+        if isinstance(result, Page):
+            return codec.stream_page(
+                self.encode_items(result.items, codec), result.get_cursor)
+        return codec.stream_array(self.encode_items(result, codec), None)
+
+    def encode_items(self, items, codec):
+        """Encodes the items of a streamed result one at a time.
+
+        :param items: An iterable of result items.
+        :param codec: The codec of the response.
+        """
+
+        serializer = self.model_serializer
+        dumps = codec.dumps
+        for item in items:
+            if serializer is not None:
+                encoded = serializer.encode(item, codec)
+                if encoded is not None:
+                    yield encoded
+                    continue
+            yield dumps(item)
+
+    def stream_batch(self, responses, codec=None, count=None):
+        """Returns an iterator over the parts of a batch response.
+
+        The output is identical to encoding the list of all responses at
+        once, but each response is yielded as soon as it is encoded.
+
+        :param responses: Tuples of HTTP-status and encoded response.
+        :param codec: The codec of the responses; the default codec if None.
+        :param int count: The number of responses; required by codecs
+            framing arrays with their length.
+        """
+
+        codec = codec or self.get_codec()
+        return codec.stream_array((body for status, body in responses), count)
 
     def get_responses(self, messages):
         """Gets a list of responses from all 'messages'.
@@ -259,6 +1743,107 @@ class JsonRpcHandler(webapp.RequestHandler):
                 responses.append(resp)
         return responses
 
+    def handle_messages(self, messages):
+        """Executes all messages.
+
+        Batches are handed to the `batch_executor` if one is configured.
+        Messages are yielded in their original order once they are handled.
+        An iterator of messages is consumed while they are handled, without
+        the batch executor and deduplication.
+
+        :param list messages: JSON-RPC messages.
+        """
+
+        batch = isinstance(messages, list) and len(messages) > 1
+        originals = shared = None
+        if self.deduplicate_batches and batch:
+            originals = self.find_duplicates(messages)
+            shared = dict.fromkeys(i for i in originals if i is not None)
+
+        outcomes = None
+        executor = self.batch_executor
+        if executor is not None and batch:
+            pending = [msg for i, msg in enumerate(messages)
+                       if msg.error is None
+                       and not (originals and originals[i] is not None)]
+            outcomes = executor.imap(self.dispatch_message, pending)
+
+        started = None
+        for index, msg in enumerate(messages):
+            original = originals and originals[index]
+            if original is not None:
+                msg.result, msg.error = shared[original]
+            elif msg.error is None:
+                if outcomes is None:
+                    msg.result, msg.error = self.dispatch_message(msg)
+                else:
+                    msg.result, msg.error = outcomes.next()
+                if shared and index in shared:
+                    if isinstance(msg.result, Page):
+                        msg.result.materialize()
+                    elif is_iterator(msg.result):
+                        msg.result = list(msg.result)
+                    shared[index] = (msg.result, msg.error)
+            if started is None and isinstance(msg.result, Task):
+                started = []
+            if started is None:
+                yield msg
+            else:
+                started.append(msg)
+
+        if started:
+            self.wait_for(started)
+            for msg in started:
+                yield msg
+
+    def wait_for(self, messages):
+        """Waits for the tasks of messages and writes back their outcomes.
+
+        :param list messages: JSON-RPC messages.
+        """
+
+        wait_all([msg.result for msg in messages
+                  if isinstance(msg.result, Task)])
+        for msg in messages:
+            task = msg.result
+            if not isinstance(task, Task):
+                continue
+            try:
+                msg.result = task.get_result()
+            except Exception, ex:
+                msg.result, msg.error = None, self.get_error(msg, ex)
+            event = task.event
+            if event is not None:
+                event.execution_time = task.elapsed
+                event.error = msg.error
+
+    def find_duplicates(self, messages):
+        """Finds calls of safe methods repeating an earlier call.
+
+        Returns a list with the index of the earlier message with the same
+        method and parameters or None for each message.
+
+        :param list messages: JSON-RPC messages.
+        """
+
+        first = {}
+        originals = [None] * len(messages)
+        for index, msg in enumerate(messages):
+            if msg.error is not None:
+                continue
+            f = self.service_methods.get(msg.method_name)
+            if f is None or not f.service_spec.safe:
+                continue
+            canonical = f.service_spec.canonical_params(msg.params)
+            if canonical is None:
+                continue
+            key = (msg.method_name, canonical)
+            if key in first:
+                originals[index] = first[key]
+            else:
+                first[key] = index
+        return originals
+
     def handle_message(self, msg):
         """Executes a message.
 
@@ -268,23 +1853,71 @@ class JsonRpcHandler(webapp.RequestHandler):
         :param dict msg: A JSON-RPC message.
         """
 
-        if msg.error != None:
-            return
+        if msg.error is None:
+            msg.result, msg.error = self.dispatch_message(msg)
+            if isinstance(msg.result, Task):
+                self.wait_for([msg])
+
+    def dispatch_message(self, msg):
+        """Executes the method of a message without modifying it.
+
+        Returns a tuple of the result and a JsonRpcError or None. The result
+        is a Task if the call is asynchronous. The instruments are notified
+        before the method is executed.
+
+        :param dict msg: A JSON-RPC message.
+        """
+
+        event = msg.event
+        if event is None:
+            if self._profile is None:
+                return self._dispatch_message(msg)
+            return self._profile.run(
+                'execute', self.recorded_name(msg.method_name),
+                self._dispatch_message, msg)
+        for instrument in self.instruments:
+            instrument.before_dispatch(event)
+        start = time.time()
+        if self._profile is None:
+            outcome = self._dispatch_message(msg)
         else:
-            try:
-                method = self.get_service_method(msg.method_name)
-                params = getattr(msg, 'params', None)
-                msg.result = self.execute_method(method, params)
-            except (MethodNotFoundError, InvalidParamsError, ServerError), ex:
-                logging.error(ex)
-                msg.error = ex
-            except Exception, ex:
-                logging.error(ex)
-                ex = InternalError("Error executing service method")
-                ex.data = ''.join(traceback.format_exception(*sys.exc_info()))
-                msg.error = ex
+            outcome = self._profile.run(
+                'execute', event.method, self._dispatch_message, msg)
+        event.execution_time = time.time() - start
+        event.error = outcome[1]
+        if isinstance(outcome[0], Task):
+            outcome[0].event = event
+        return outcome
+
+    def _dispatch_message(self, msg):
+        try:
+            method = self.get_service_method(msg.method_name)
+            return self.execute_method(method, msg.params), None
+        except Exception, ex:
+            return None, self.get_error(msg, ex)
+
+    def get_error(self, msg, ex):
+        """Returns the JsonRpcError for an exception raised by a call.
+
+        Must be called while the exception is handled.
 
-    def parse_body(self, body):
+        :param msg: The JSON-RPC message.
+        :param Exception ex: The exception.
+        """
+
+        logging.error(ex)
+        if isinstance(ex, (MethodNotFoundError, InvalidParamsError,
+                           ServerError)):
+            return ex
+        error = InternalError("Error executing service method")
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            error.exc_info = sys.exc_info()
+            logging.debug(error.data)
+        elif self.include_tracebacks and not msg.notification:
+            error.exc_info = sys.exc_info()
+        return error
+
+    def parse_body(self, body, codec=None):
         """Parses the body of POST request.
 
         Validates for correct JSON and returns a tuple with a list of JSON-RPC
@@ -292,27 +1925,23 @@ class JsonRpcHandler(webapp.RequestHandler):
         Raises ParseError and InvalidRequestError.
 
         :param string body: The HTTP body.
+        :param codec: The codec of the body; the default codec if None.
         """
 
         try:
-            json = simplejson.loads(body)
+            json = (codec or self.get_codec()).loads(body)
         except ValueError:
             raise ParseError()
 
-        messages = []
+        if isinstance(json, dict):
+            return [JsonRpcMessage(json)], False
+
         if isinstance(json, (list, tuple)):
             if len(json) == 0:
                 raise InvalidRequestError('Recieved an empty batch message')
-            batch_request = True
-            for obj in json:
-                msg = JsonRpcMessage(obj)
-                messages.append(msg)
+            return [JsonRpcMessage(obj) for obj in json], True
 
-        if isinstance(json, (dict)):
-            batch_request = False
-            msg = JsonRpcMessage(json)
-            messages.append(msg)
-        return messages, batch_request
+        raise InvalidRequestError('Invalid JSON-RPC Message; must be an object')
 
     def get_response(self, msg):
         """Gets the response object for a message.
@@ -329,15 +1958,16 @@ class JsonRpcHandler(webapp.RequestHandler):
         elif msg.error:
             return (msg.error.status, 
                     self._build_error(msg.error, msg.message_id))
-        elif msg.result:
+        else:
+            # Falsy results like 0, [] or None are results, too
             return (200, self._build_result(msg))
-        else:   # pragma: no cover
-            # Should never be reached
-            logging.warn('Message neither contains an error nor a result')
 
     def _build_error(self, err, message_id=None):
+        error = err.getJsonData()
+        if self.include_tracebacks and getattr(err, 'data', None):
+            error['data'] = err.data
         return {'jsonrpc':'2.0',
-                'error':err.getJsonData(),
+                'error':error,
                 'id':message_id}
 
     def _build_result(self, msg):
@@ -348,60 +1978,305 @@ class JsonRpcHandler(webapp.RequestHandler):
     def execute_method(self, method, params):
         """Executes the RPC method.
 
+        Results of methods with a cache are looked up first and stored
+        afterwards. Futures and the generators of coroutine methods are
+        returned as a started Task. Streamed results are not cached.
+
         :param function method: A method object.
         :param params: List, tuple or dictionary with JSON-RPC parameters.
         """
-        args, varargs, varkw, defaults = getargspec(method)
-        if varargs or varkw:
+        spec = method.service_spec
+        cache = spec.cache
+        key = None
+        if cache is not None:
+            key = cache.key(params)
+            if key is not None:
+                cached = cache.get(key)
+                if cached is not None:
+                    return cached[0]
+        result = self.call_method(method, spec, params)
+        if spec.coroutine or is_future(result):
+            result = Task(result)
+            if key is not None:
+                result.callbacks.append(lambda value: cache.set(key, value))
+        elif key is not None and not is_streamed(result):
+            cache.set(key, result)
+        return result
+
+    def call_method(self, method, spec, params):
+        """Checks the parameters and calls the RPC method.
+
+        The parameters are checked and brought into positional order by the
+        adapter compiled for the method.
+
+        :param function method: A method object.
+        :param spec: The ServiceMethodSpec of the method.
+        :param params: List, tuple or dictionary with JSON-RPC parameters.
+        """
+        if spec.variable:
             raise InvalidParamsError(
                 "Service method definition must not have variable parameters")
-        args_set = set(args[1:])
-        if params is None:
-            if not len(args_set) == 0:
-                raise InvalidParamsError(
-                    "Wrong number of parameters; "
-                    "expected %i but 'params' was omitted "
-                    "from JSON-RPC message" % (len(args_set)))
-            return method()
-        elif isinstance(params, (list, tuple)):
-            if not len(args_set) == len(params):
-                raise InvalidParamsError(
-                    "Wrong number of parameters; "
-                    "expected %i got %i" % (len(args_set),len(params)))
-            return method(*params)
-        elif isinstance(params, dict):
-            paramset = set(params)
-            if not args_set == paramset:
-                raise InvalidParamsError(
-                    "Named parameters do not "
-                    "match method; expected %s" % (str(args_set)))
-            params = self.decode_dict_keys(params)
-            return method(**params)
+        try:
+            args = spec.adapt(params)
+        except json_rpc_params.ParamsError, ex:
+            raise InvalidParamsError(str(ex))
+        return method(*args)
 
     def get_service_method(self, meth_name):
-        # TODO use inspect.getmembers()?
-        f = getattr(self, meth_name, None)
-        if (f == None or not hasattr(f, 'IsServiceMethod')
-                or not getattr(f, 'IsServiceMethod') == True):
+        """Looks up a service method in the dispatch table.
+
+        :param string meth_name: The name of the method.
+        :returns: The bound method.
+        """
+        entry = self.dispatch_table.get(meth_name)
+        if entry is None:
             raise MethodNotFoundError('Method %s not found' % meth_name)
-        return f
+        f, owner = entry
+        if owner is None:
+            return f.__get__(self, self.__class__)
+        return f.__get__(self.get_service(owner), owner)
+
+    def get_service(self, service_class):
+        """Returns the instance of a mounted service for this request.
+
+        :param class service_class: A Service subclass.
+        """
+        if self._services is None:
+            self._loader_lock.acquire()
+            try:
+                if self._services is None:
+                    self._services = {}
+            finally:
+                self._loader_lock.release()
+        services = self._services
+        service = services.get(service_class)
+        if service is None:
+            service = services.setdefault(service_class, service_class(self))
+        return service
+
+    def recorded_name(self, method_name):
+        """Returns the name calls of a method are recorded under.
+
+        Method names are chosen by clients; names missing from the dispatch
+        table are mapped to UNKNOWN_METHOD.
+
+        :param string method_name: The method name of a message.
+        """
+        if method_name in self.dispatch_table:
+            return method_name
+        return UNKNOWN_METHOD
 
-    def decode_dict_keys(self, d):
-        """Convert all keys in dict d to str.
+    @ServiceMethod(name='rpc.stats')
+    def rpc_stats(self):
+        """Returns the statistics aggregated by the instruments.
 
-        Python does not allow unicode keys in dictionaries.
+        Only administrators may call it.
+        """
 
-        :param dict d: A JSON-RPC message.
+        providers = [i for i in self.instruments if hasattr(i, 'snapshot')]
+        if not providers or not self.admin:
+            raise MethodNotFoundError('Method rpc.stats not found')
+        stats = {}
+        for instrument in providers:
+            stats.update(instrument.snapshot())
+        return stats
+
+    @ServiceMethod(name='rpc.profile',
+                   params={'top': int, 'sort': basestring,
+                           'phase': basestring, 'method': basestring})
+    def rpc_profile(self, top=20, sort='cumulative', phase=None, method=None):
+        """Returns the statistics aggregated by the profiler.
+
+        Only administrators may call it.
         """
+
+        if self.profiler is None or not self.admin:
+            raise MethodNotFoundError('Method rpc.profile not found')
         try:
-            r = {}
-            for (k, v) in d.iteritems():
-                r[str(k)] = v
-            return r
-        except UnicodeEncodeError:  # pragma: no cover
-            # Unsure which error is the correct to raise here.
-            # Actually this code will probably never be reached
-            # because "wrong" parameters will be filtered out
-            # and returned as InvalidParamsError() and methods cant
-            # have non-ascii parameter names.
-            raise InvalidRequestError("Parameter-names must be ASCII")
+            return self.profiler.report(top, sort, phase, method)
+        except ValueError, ex:
+            raise InvalidParamsError(str(ex))
+
+    @classmethod
+    def warm_up(cls):
+        """Prepares the state shared by all requests of an instance.
+
+        The dispatch table is built when the class is created; this selects
+        the codecs, which probes the available JSON libraries, so the first
+        request served by a new instance does not pay for it. Call it from
+        the handler of warmup requests.
+        """
+        if cls.codec is None:
+            json_rpc_codecs.get_codec()
+        if cls.binary_content_types:
+            import json_rpc_msgpack
+            json_rpc_msgpack.get_codec()
+
+    @classmethod
+    def invalidate_cache(cls, meth_name, *args, **kwargs):
+        """Removes a cached result of a service method.
+
+        :param string meth_name: The name of the method.
+        """
+        f = cls.service_methods.get(meth_name)
+        if f is None or f.service_spec.cache is None:
+            raise ValueError('Method %s has no cache' % meth_name)
+        f.service_spec.cache.invalidate(*args, **kwargs)
+
+
+class JsonRpcHandler(webapp.RequestHandler, Dispatcher):
+    """Subclass this handler to implement a JSON-RPC handler.
+
+    A webapp.RequestHandler handling HTTP POST requests, and GET requests if
+    `allow_get` is enabled, with the Dispatcher; see there for the available
+    options.
+    """
+
+    def __init__(self):
+        webapp.RequestHandler.__init__(self)
+
+    def post(self):
+        self.handle_request()
+
+    def get(self):
+        if not self.allow_get:
+            self.response.headers['Allow'] = 'POST'
+            self.error(405)
+            return
+        self.handle_get_request()
+
+    def handle_request(self):
+        """Handles POST request."""
+
+        headers = self.request.headers
+        self.client_id = self.request.remote_addr
+        self.admin = self.request.environ.get('USER_IS_ADMIN') == '1'
+        self.queued = self.is_queued(self.request.environ)
+        codecs = self.negotiate_codecs(
+            headers.get('Content-Type'), headers.get('Accept'))
+        try:
+            length = int(headers.get('Content-Length'))
+        except (TypeError, ValueError):
+            length = None
+        try:
+            # Reject oversized bodies before they are read
+            if length is not None:
+                self.check_body_size(length)
+        except RequestTooLargeError, ex:
+            status, body = self.error_response(ex, codecs[1])
+        else:
+            if self.incremental_batches and length is not None:
+                import json_rpc_stream
+                body = json_rpc_stream.BodyStream(
+                    self.request.body_file, length)
+            else:
+                body = self.request.body
+            status, body = self.dispatch(
+                body, headers.get('Content-Encoding'), codecs)
+        self.write_response(status, body, codecs[1])
+
+    def handle_get_request(self):
+        """Handles GET request."""
+
+        headers = self.request.headers
+        self.client_id = self.request.remote_addr
+        self.admin = self.request.environ.get('USER_IS_ADMIN') == '1'
+        codec = self.negotiate_codecs(None, headers.get('Accept'))[1]
+        status, body, extra_headers = self.dispatch_get(
+            self.request.query_string, headers.get('If-None-Match'), codec)
+        self.write_response(status, body, codec, extra_headers)
+
+    def write_response(self, status, body, codec, extra_headers=()):
+        """Writes a response, compressed if the client accepts it.
+
+        :param int status: The HTTP-status.
+        :param body: An iterable of strings.
+        :param codec: The codec of the response.
+        :param list extra_headers: Tuples of header name and value.
+        """
+
+        headers = self.response.headers
+        self.error(status)
+        headers['Content-Type'] = codec.content_type
+        for name, value in extra_headers:
+            headers[name] = value
+        vary = self.get_vary()
+        if vary is not None:
+            headers['Vary'] = vary
+        if self.compression_threshold is not None:
+            coding, body = self.compress_response(
+                body, self.request.headers.get('Accept-Encoding'))
+            if coding is not None:
+                headers['Content-Encoding'] = coding
+        out = self.response.out
+        for chunk in body:
+            out.write(chunk)
+
+
+class JsonRpcApplication(object):
+    """Serves a Dispatcher subclass as plain WSGI application.
+
+    A new instance of the dispatcher class is created for every request.
+    Usage:
+
+        application = JsonRpcApplication(MyService)
+
+    :param class dispatcher_class: A Dispatcher subclass.
+    """
+
+    def __init__(self, dispatcher_class):
+        self.dispatcher_class = dispatcher_class
+
+    def __call__(self, environ, start_response):
+        method = environ['REQUEST_METHOD']
+        dispatcher = self.dispatcher_class()
+        dispatcher.client_id = environ.get('REMOTE_ADDR')
+        dispatcher.admin = environ.get('USER_IS_ADMIN') == '1'
+        if method == 'GET' and dispatcher.allow_get:
+            codec = dispatcher.negotiate_codecs(
+                None, environ.get('HTTP_ACCEPT'))[1]
+            status, body, headers = dispatcher.dispatch_get(
+                environ.get('QUERY_STRING', ''),
+                environ.get('HTTP_IF_NONE_MATCH'), codec)
+            if status != 304:
+                headers.insert(0, ('Content-Type', codec.content_type))
+        elif method != 'POST':
+            allow = dispatcher.allow_get and 'GET, POST' or 'POST'
+            start_response('405 Method Not Allowed',
+                           [('Allow', allow), ('Content-Length', '0')])
+            return []
+        else:
+            dispatcher.queued = dispatcher.is_queued(environ)
+            try:
+                length = int(environ.get('CONTENT_LENGTH') or 0)
+            except ValueError:
+                length = 0
+            codecs = dispatcher.negotiate_codecs(
+                environ.get('CONTENT_TYPE'), environ.get('HTTP_ACCEPT'))
+            try:
+                dispatcher.check_body_size(length)
+            except RequestTooLargeError, ex:
+                status, body = dispatcher.error_response(ex, codecs[1])
+            else:
+                if dispatcher.incremental_batches:
+                    import json_rpc_stream
+                    body = json_rpc_stream.BodyStream(
+                        environ['wsgi.input'], length)
+                else:
+                    body = environ['wsgi.input'].read(length)
+                status, body = dispatcher.dispatch(
+                    body, environ.get('HTTP_CONTENT_ENCODING'), codecs)
+            headers = [('Content-Type', codecs[1].content_type)]
+        vary = dispatcher.get_vary()
+        if vary is not None:
+            headers.append(('Vary', vary))
+        if dispatcher.compression_threshold is not None:
+            coding, body = dispatcher.compress_response(
+                body, environ.get('HTTP_ACCEPT_ENCODING'))
+            if coding is not None:
+                headers.append(('Content-Encoding', coding))
+        if isinstance(body, list):
+            headers.append(('Content-Length', str(sum(map(len, body)))))
+        start_response('%i %s' % (
+            status, webapp.Response.http_status_message(status)), headers)
+        return body
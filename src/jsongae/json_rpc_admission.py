@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Admission control for the JSON-RPC Dispatcher.
+
+Usage:
+
+    class RPCHandler(JsonRpcHandler):
+
+        admission = AdmissionControl(
+            max_body_size=64 * 1024,
+            max_batch_size=50,
+            rate_limits={'data': (5, 20), None: (50, 100)},
+            max_concurrent_requests=8)
+
+Requests exceeding the body or batch size and requests arriving while the
+maximum number of requests is being handled are rejected as a whole. Rate
+limits are token buckets per client and method, given as a tuple of the
+sustained rate in calls per second and the burst size; the limit of the key
+None applies to all other methods. Calls of unknown methods share one bucket
+per client. Calls exceeding their limit fail one by one, so the other calls
+of a batch are still executed.
+
+Buckets are kept in process by a LocalRateStore; a MemcacheRateStore shares
+them between instances.
+"""
+
+import math
+import threading
+import time
+
+
+class LocalRateStore(object):
+    """In-process token buckets.
+
+    Full buckets are dropped when the store reaches max_size, since they are
+    equivalent to missing ones. If that is not enough, the least recently
+    used buckets are dropped as well, so the store never exceeds max_size.
+
+    :param int max_size: Maximum number of buckets.
+    :param function clock: Returns the current time in seconds.
+    """
+
+    def __init__(self, max_size=10000, clock=time.time):
+        self.max_size = max_size
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def consume(self, key, rate, burst, tokens=1):
+        """Takes tokens from a bucket.
+
+        :param string key: The key of the bucket.
+        :param float rate: Tokens added per second.
+        :param int burst: The capacity of the bucket.
+        :param int tokens: The number of tokens to take.
+        :returns: True if the bucket held enough tokens.
+        """
+        now = self.clock()
+        self._lock.acquire()
+        try:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_size:
+                    self._prune(now)
+                bucket = self._buckets[key] = [float(burst), now]
+            else:
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] < tokens:
+                return False
+            bucket[0] -= tokens
+            return True
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """Removes all buckets."""
+        self._lock.acquire()
+        try:
+            self._buckets.clear()
+        finally:
+            self._lock.release()
+
+    def _prune(self, now):
+        # Buckets idle for a minute or longer are considered full
+        buckets = self._buckets
+        for key, bucket in buckets.items():
+            if now - bucket[1] >= 60:
+                del buckets[key]
+        if len(buckets) < self.max_size:
+            return
+        # Evicts a tenth more than needed, so pruning is not repeated for
+        # every new bucket
+        excess = len(buckets) - self.max_size + 1 + self.max_size // 10
+        oldest = sorted(buckets.iteritems(), key=lambda item: item[1][1])
+        for key, bucket in oldest[:excess]:
+            del buckets[key]
+
+
+class MemcacheRateStore(object):
+    """Token buckets shared through a memcache compatible client.
+
+    Memcache offers no atomic read-modify-write of a bucket, so the bucket
+    is approximated by a counter per fixed window of burst / rate seconds,
+    which admits up to burst calls per window. The store fails open: calls
+    are admitted while memcache is unavailable.
+
+    :param client: An object with add and incr methods like
+        google.appengine.api.memcache; the App Engine API by default.
+    :param function clock: Returns the current time in seconds.
+    """
+
+    def __init__(self, client=None, clock=time.time):
+        if client is None:
+            from google.appengine.api import memcache
+            client = memcache
+        self.client = client
+        self.clock = clock
+
+    def consume(self, key, rate, burst, tokens=1):
+        """Takes tokens from a bucket.
+
+        :param string key: The key of the bucket.
+        :param float rate: Tokens added per second.
+        :param int burst: The capacity of the bucket.
+        :param int tokens: The number of tokens to take.
+        :returns: True if the bucket held enough tokens.
+        """
+        window = float(burst) / rate
+        key = 'jsonrpc:rate:%s:%i' % (key, self.clock() // window)
+        client = self.client
+        count = client.incr(key, tokens)
+        if count is None:
+            if client.add(key, tokens, time=int(math.ceil(window)) + 1):
+                count = tokens
+            else:
+                count = client.incr(key, tokens)
+        return count is None or count <= burst
+
+
+class AdmissionControl(object):
+    """Limits the work done per request and per client.
+
+    Each limit is disabled if None.
+
+    :param int max_body_size: Maximum size of a request body in bytes,
+        checked before the body is decoded.
+    :param int max_batch_size: Maximum number of calls in a batch.
+    :param dict rate_limits: Maps method names to tuples of a rate in calls
+        per second and a burst size; the limit of the key None applies to
+        all other methods.
+    :param int max_concurrent_requests: Maximum number of requests handled
+        at the same time by the instance.
+    :param store: Keeps the token buckets; a LocalRateStore by default.
+    """
+
+    def __init__(self, max_body_size=None, max_batch_size=None,
+                 rate_limits=None, max_concurrent_requests=None, store=None):
+        self.max_body_size = max_body_size
+        self.max_batch_size = max_batch_size
+        self.rate_limits = rate_limits or {}
+        self.max_concurrent_requests = max_concurrent_requests
+        if store is None:
+            store = LocalRateStore()
+        self.store = store
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def body_allowed(self, size):
+        """Returns whether a request body of size bytes is admitted."""
+        return self.max_body_size is None or size <= self.max_body_size
+
+    def batch_allowed(self, size):
+        """Returns whether a batch of size calls is admitted."""
+        return self.max_batch_size is None or size <= self.max_batch_size
+
+    def call_allowed(self, client_id, method_name):
+        """Takes a token from the bucket of a client and method.
+
+        :param string client_id: Identifies the client, e.g. its address.
+        :param string method_name: The name of the called method or None
+            for unknown methods, which share one bucket.
+        :returns: True if the call is admitted.
+        """
+        limit = None
+        if method_name is not None:
+            limit = self.rate_limits.get(method_name)
+        if limit is None:
+            limit = self.rate_limits.get(None)
+            if limit is None:
+                return True
+        rate, burst = limit
+        return self.store.consume(
+            '%s:%s' % (client_id, method_name or ''), rate, burst)
+
+    def enter(self):
+        """Registers a request being handled.
+
+        :returns: False if the maximum number of concurrent requests is
+            reached; leave() must be called otherwise.
+        """
+        self._lock.acquire()
+        try:
+            limit = self.max_concurrent_requests
+            if limit is not None and self.active >= limit:
+                return False
+            self.active += 1
+            return True
+        finally:
+            self._lock.release()
+
+    def leave(self):
+        """Registers a request being finished."""
+        self._lock.acquire()
+        try:
+            self.active -= 1
+        finally:
+            self._lock.release()
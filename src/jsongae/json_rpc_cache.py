@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Result cache for read-only service methods.
+
+Usage:
+
+    class RPCHandler(JsonRpcHandler):
+
+        @ServiceMethod(cache=ResultCache(ttl=60, max_size=500))
+        def data(self, key_name):
+            ...
+
+    RPCHandler.invalidate_cache('data', 'foobar')
+
+Results are keyed on the method and its parameters in positional order, so
+positional and named calls share their entries. Only successful results are
+cached. The in-process LocalCache returns the cached objects themselves;
+service methods must not modify their results afterwards.
+"""
+
+import hashlib
+import threading
+import time
+
+
+class LocalCache(object):
+    """In-process cache backend with LRU eviction.
+
+    :param int max_size: Maximum number of entries.
+    :param function clock: Returns the current time in seconds.
+    """
+
+    def __init__(self, max_size=1000, clock=time.time):
+        self.max_size = max_size
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Returns the value for key or None.
+
+        :param string key: The key.
+        """
+        self._lock.acquire()
+        try:
+            link = self._entries.get(key)
+            if link is None:
+                return None
+            if link[4] is not None and link[4] <= self.clock():
+                self._unlink(link)
+                return None
+            # Move to the front of the LRU list
+            self._unlink(link)
+            self._link(link)
+            return link[3]
+        finally:
+            self._lock.release()
+
+    def set(self, key, value, ttl=None):
+        """Stores a value.
+
+        :param string key: The key.
+        :param value: The value.
+        :param float ttl: Seconds until the entry expires or None.
+        """
+        expires = None
+        if ttl:
+            expires = self.clock() + ttl
+        self._lock.acquire()
+        try:
+            link = self._entries.get(key)
+            if link is not None:
+                self._unlink(link)
+            self._link([None, None, key, value, expires])
+            while len(self._entries) > self.max_size:
+                self._unlink(self._root[0])
+        finally:
+            self._lock.release()
+
+    def delete(self, key):
+        """Removes an entry.
+
+        :param string key: The key.
+        """
+        self._lock.acquire()
+        try:
+            link = self._entries.get(key)
+            if link is not None:
+                self._unlink(link)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """Removes all entries."""
+        # Circular doubly linked list of [prev, next, key, value, expires]
+        root = []
+        root[:] = [root, root, None, None, None]
+        self._root = root
+        self._entries = {}
+
+    def _link(self, link):
+        root = self._root
+        link[0] = root
+        link[1] = root[1]
+        root[1][0] = link
+        root[1] = link
+        self._entries[link[2]] = link
+
+    def _unlink(self, link):
+        link[0][1] = link[1]
+        link[1][0] = link[0]
+        del self._entries[link[2]]
+
+
+class MemcacheCache(object):
+    """Cache backend storing entries with a memcache compatible client.
+
+    Entries are shared between instances and cannot be enumerated, so there
+    is no clear method; they expire through their TTL or are invalidated one
+    by one.
+
+    :param client: An object with get, set and delete methods like
+        google.appengine.api.memcache; the App Engine API by default.
+    """
+
+    def __init__(self, client=None):
+        if client is None:
+            from google.appengine.api import memcache
+            client = memcache
+        self.client = client
+
+    def get(self, key):
+        """Returns the value for key or None.
+
+        :param string key: The key.
+        """
+        return self.client.get(key)
+
+    def set(self, key, value, ttl=None):
+        """Stores a value.
+
+        :param string key: The key.
+        :param value: The value.
+        :param float ttl: Seconds until the entry expires or None.
+        """
+        self.client.set(key, value, time=ttl or 0)
+
+    def delete(self, key):
+        """Removes an entry.
+
+        :param string key: The key.
+        """
+        self.client.delete(key)
+
+
+class FakeMemcacheClient(object):
+    """Local stand-in for the App Engine memcache API.
+
+    :param function clock: Returns the current time in seconds.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.flush_all()
+
+    def get(self, key):
+        self._lock.acquire()
+        try:
+            return self._get(key)
+        finally:
+            self._lock.release()
+
+    def set(self, key, value, time=0):
+        self._lock.acquire()
+        try:
+            return self._set(key, value, time)
+        finally:
+            self._lock.release()
+
+    def add(self, key, value, time=0):
+        self._lock.acquire()
+        try:
+            if self._get(key) is not None:
+                return False
+            return self._set(key, value, time)
+        finally:
+            self._lock.release()
+
+    def incr(self, key, delta=1, initial_value=None):
+        self._lock.acquire()
+        try:
+            value = self._get(key)
+            if value is None:
+                if initial_value is None:
+                    return None
+                value, expires = initial_value, 0
+            else:
+                expires = self._data[key][1]
+            value = max(0, value + delta)
+            self._data[key] = (value, expires)
+            return value
+        finally:
+            self._lock.release()
+
+    def delete(self, key):
+        self._lock.acquire()
+        try:
+            if self._data.pop(key, None) is None:
+                return 1
+            return 2
+        finally:
+            self._lock.release()
+
+    def flush_all(self):
+        self._lock.acquire()
+        try:
+            self._data = {}
+            return True
+        finally:
+            self._lock.release()
+
+    def _get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires and expires <= self.clock():
+            del self._data[key]
+            return None
+        return value
+
+    def _set(self, key, value, time):
+        expires = 0
+        if time:
+            expires = self.clock() + time
+        self._data[key] = (value, expires)
+        return True
+
+
+class ResultCache(object):
+    """Caches the results of a service method.
+
+    Keys are prefixed with the name of the method qualified by its module
+    and class, which changes when the class is renamed or moved; pass a
+    name to keep the keys of a shared backend stable.
+
+    :param float ttl: Seconds a result is cached; None caches until evicted.
+    :param int max_size: Maximum number of entries of the default backend.
+    :param backend: A cache backend; a LocalCache by default.
+    :param string name: A name unique among the cached methods.
+    """
+
+    def __init__(self, ttl=60, max_size=1000, backend=None, name=None):
+        self.ttl = ttl
+        if backend is None:
+            backend = LocalCache(max_size)
+        self.backend = backend
+        self.spec = None
+        self.named = name is not None
+        self.name = name
+        self.prefix = None
+
+    def bind(self, spec, name):
+        """Binds the cache to a service method.
+
+        Called by the ServiceMethod decorator.
+
+        :param spec: The ServiceMethodSpec of the method.
+        :param string name: A qualified name of the method.
+        """
+        if self.spec is not None:
+            raise ValueError('ResultCache is already used for %s' % self.name)
+        self.spec = spec
+        self.qualify(name)
+
+    def qualify(self, name):
+        """Sets the name of the method the keys are prefixed with.
+
+        Called again with the class of the method once it is created. The
+        name given to the cache takes precedence.
+
+        :param string name: A qualified name of the method.
+        """
+        if not self.named:
+            self.name = name
+        self.prefix = 'jsonrpc:%s:' % self.name
+
+    def key(self, params):
+        """Returns the cache key for a call or None.
+
+        :param params: List, tuple or dictionary with JSON-RPC parameters.
+        """
+        canonical = self.spec.canonical_params(params)
+        if canonical is None:
+            return None
+        return self.prefix + hashlib.md5(canonical).hexdigest()
+
+    def get(self, key):
+        """Looks up a result.
+
+        :param string key: The cache key.
+        :returns: A tuple containing the result or None.
+        """
+        return self.backend.get(key)
+
+    def set(self, key, result):
+        """Stores a result.
+
+        :param string key: The cache key.
+        :param result: The result.
+        """
+        self.backend.set(key, (result,), self.ttl)
+
+    def invalidate(self, *args, **kwargs):
+        """Removes the result of a call with the given parameters."""
+        if args and kwargs:
+            raise ValueError('Use either positional or named parameters')
+        key = self.key(kwargs or list(args))
+        if key is not None:
+            self.backend.delete(key)
+
+    def clear(self):
+        """Removes all results of the backend.
+
+        Only backends which can enumerate their entries, like LocalCache,
+        are cleared. Entries of a MemcacheCache are only removed by
+        invalidate or when their TTL expires; ValueError is raised for it.
+        """
+        clear = getattr(self.backend, 'clear', None)
+        if clear is None:
+            raise ValueError('%s entries cannot be cleared; invalidate them '
+                             'or let them expire'
+                             % self.backend.__class__.__name__)
+        clear()
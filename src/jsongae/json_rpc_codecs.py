@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""JSON codecs for the JSON-RPC Dispatcher.
+
+A codec pairs a decoder and an encoder taken from one of the JSON libraries
+available at runtime. The default codec uses the fastest decoder returning the
+same objects as simplejson, also for 17-digit floats, big integers and lone
+surrogates, and the fastest encoder whose output is byte-identical to
+simplejson, so the wire format never depends on the installed libraries.
+Lossy libraries like ujson are used only if selected by name.
+
+Usage:
+
+    codec = get_codec()
+    obj = codec.loads('{"jsonrpc": "2.0", "method": "test", "id": 1}')
+    text = codec.dumps(obj)
+"""
+
+import logging
+
+
+REFERENCE = 'simplejson'
+
+PROBES = [
+    {'jsonrpc': '2.0', 'result': u'foobar', 'id': 42},
+    {'jsonrpc': '2.0', 'result': None, 'id': u'1'},
+    {'jsonrpc': '2.0', 'id': None,
+     'error': {'code': -32601, 'message': 'MethodNotFoundError: foo'}},
+    {'jsonrpc': '2.0', 'id': 7,
+     'result': [1, -2, 3.5, 0.1, 1e100, True, False, None, 2 ** 62,
+                u'ä€', u'tab\tquote"slash\\/', {}, [], {'a': [{}]}]},
+]
+
+# Texts that lossy decoders get wrong: floats needing 17 digits, integers
+# beyond 64 bits and lone surrogates.
+DECODING_PROBES = [
+    '[1.0000000000000002, 0.30000000000000004, 5e-324]',
+    '[123456789012345678901234567890, -18446744073709551617]',
+    '["\\ud800", "x\\udfff"]',
+]
+
+
+JSON_CONTENT_TYPES = ('application/json-rpc', 'application/json',
+                      'application/jsonrequest')
+
+
+class Codec(object):
+    """A JSON decoder and encoder.
+
+    Besides single messages a codec frames the encoded responses of a batch
+    as array.
+
+    :param string name: The name of the codec.
+    :param function loads: Decodes a JSON string; raises ValueError.
+    :param function dumps: Encodes an object to a JSON string.
+    """
+
+    content_type = JSON_CONTENT_TYPES[0]
+
+    def __init__(self, name, loads, dumps):
+        self.name = name
+        self._loads = loads
+        self.dumps = dumps
+
+    def __repr__(self):
+        return 'Codec("%s")' % self.name
+
+    def loads(self, text):
+        """Decodes a JSON string.
+
+        :param string text: The JSON text.
+        :returns: The Python representation.
+        """
+        try:
+            return self._loads(text)
+        except ValueError:
+            raise
+        except Exception, ex:
+            raise ValueError(str(ex))
+
+    def encode_result(self, result, message_id):
+        """Returns a result response around an encoded result.
+
+        The output is identical to encoding the whole response.
+
+        :param string result: The encoded result.
+        :param message_id: The id of the call.
+        """
+        return '{"jsonrpc": "2.0", "result": %s, "id": %s}' % (
+            result, self.dumps(message_id))
+
+    def join_array(self, parts):
+        """Returns an array of encoded objects.
+
+        :param list parts: Encoded objects.
+        """
+        return '[%s]' % ', '.join(parts)
+
+    def stream_array(self, parts, count):
+        """Yields an array of encoded objects piece by piece.
+
+        The output is identical to join_array.
+
+        :param parts: An iterable of encoded objects, each a string or an
+            iterable of strings.
+        :param int count: The number of objects or None if unknown.
+        """
+        separator = '['
+        for part in parts:
+            if isinstance(part, basestring):
+                yield separator + part
+            else:
+                yield separator
+                for chunk in part:
+                    yield chunk
+            separator = ', '
+        if separator == '[':
+            yield '['
+        yield ']'
+
+    def stream_result(self, chunks, message_id):
+        """Yields a result response around a result encoded piece by piece.
+
+        The output is identical to encode_result.
+
+        :param chunks: An iterable of strings forming the encoded result.
+        :param message_id: The id of the call.
+        """
+        yield '{"jsonrpc": "2.0", "result": '
+        for chunk in chunks:
+            yield chunk
+        yield ', "id": %s}' % self.dumps(message_id)
+
+    def stream_page(self, parts, cursor):
+        """Yields a page of results piece by piece.
+
+        A page is encoded as an object of the items and the cursor of the
+        next page.
+
+        :param parts: An iterable of encoded items.
+        :param function cursor: Returns the cursor once all parts are
+            consumed.
+        """
+        yield '{"items": '
+        for chunk in self.stream_array(parts, None):
+            yield chunk
+        yield ', "cursor": %s}' % self.dumps(cursor())
+
+
+def _simplejson_speedups():
+    import simplejson
+    from simplejson import _speedups
+    return simplejson.loads, simplejson.dumps
+
+
+def _json():
+    import json
+    return json.loads, json.dumps
+
+
+def _simplejson():
+    import simplejson
+    return simplejson.loads, simplejson.dumps
+
+
+def _ujson():
+    import ujson
+    return ujson.loads, ujson.dumps
+
+
+def _orjson():
+    import orjson
+    def dumps(obj):
+        return orjson.dumps(obj).decode('utf-8')
+    return orjson.loads, dumps
+
+
+# Backends in order of preference; the first importable one wins.
+BACKENDS = [
+    ('orjson', _orjson),
+    ('ujson', _ujson),
+    ('simplejson.speedups', _simplejson_speedups),
+    ('json', _json),
+    ('simplejson', _simplejson),
+]
+
+_functions = {}
+
+_default = None
+
+
+def register_backend(name, factory, position=0):
+    """Registers a JSON library.
+
+    :param string name: The name of the backend.
+    :param function factory: Returns a tuple of loads and dumps functions or
+        raises ImportError when the library is not available.
+    :param int position: Preference of the backend; 0 is tried first.
+    """
+    global _default
+    unregister_backend(name)
+    BACKENDS.insert(position, (name, factory))
+    _default = None
+
+
+def unregister_backend(name):
+    """Removes a JSON library registered before.
+
+    :param string name: The name of the backend.
+    """
+    global _default
+    BACKENDS[:] = [b for b in BACKENDS if b[0] != name]
+    _functions.pop(name, None)
+    _default = None
+
+
+def _load(name):
+    if name not in _functions:
+        factory = dict(BACKENDS).get(name)
+        if factory is None:
+            raise ValueError('Unknown JSON backend %s' % name)
+        try:
+            _functions[name] = factory()
+        except ImportError:
+            _functions[name] = None
+    return _functions[name]
+
+
+def available_backends():
+    """Returns the names of all importable backends in order of preference.
+
+    :returns: List of names.
+    """
+    return [name for name, factory in BACKENDS if _load(name) is not None]
+
+
+def _reference():
+    functions = _load(REFERENCE)
+    if functions is None:
+        # Python 2.6+ without simplejson; its json module is simplejson
+        functions = _load('json')
+    return functions
+
+
+def canonical(obj):
+    """Encodes an object to canonical JSON text.
+
+    Keys are sorted and no whitespace is used, so equal objects always
+    result in equal text.
+
+    :param obj: A JSON serializable object.
+    :returns: A string.
+    """
+    return _reference()[1](obj, sort_keys=True, separators=(',', ':'))
+
+
+def is_conforming(name, encoding=True, decoding=True):
+    """Checks whether a backend conforms to the reference wire format.
+
+    The backend must decode the reference encoding of the probe messages to
+    equal objects and, if encoding is True, encode them to exactly the same
+    text. If decoding is True, it must also decode the decoding probes to
+    the same objects as the reference.
+
+    :param string name: The name of the backend.
+    :param bool encoding: Whether to check the encoder too.
+    :param bool decoding: Whether to check the decoder strictly.
+    :returns: True or False.
+    """
+    functions = _load(name)
+    if functions is None:
+        return False
+    loads, dumps = functions
+    reference_loads, reference_dumps = _reference()
+    try:
+        for text in decoding and DECODING_PROBES or ():
+            if repr(loads(text)) != repr(reference_loads(text)):
+                return False
+        for probe in PROBES:
+            text = reference_dumps(probe)
+            if loads(text) != probe:
+                return False
+            if encoding and dumps(probe) != text:
+                return False
+    except Exception:
+        return False
+    return True
+
+
+def get_codec(name=None):
+    """Returns a codec.
+
+    Without a name the fastest available conforming decoder and encoder are
+    selected once and cached. A named backend is used for decoding and, if
+    its output conforms to the reference wire format, for encoding too.
+
+    :param string name: The name of a backend or None.
+    :returns: A Codec.
+    """
+    global _default
+    if name is None:
+        if _default is None:
+            _default = _select()
+        return _default
+    functions = _load(name)
+    if functions is None:
+        raise ValueError('JSON backend %s is not available' % name)
+    if is_conforming(name, decoding=False):
+        return Codec(name, *functions)
+    logging.info('JSON backend %s does not produce the reference wire '
+                 'format; encoding with %s', name, REFERENCE)
+    return Codec('%s/%s' % (name, REFERENCE), functions[0], _reference()[1])
+
+
+def best_match(accept, offered):
+    """Selects a media type according to an Accept header.
+
+    Returns the offered type with the highest quality, the first one on
+    ties, or None if none is acceptable.
+
+    :param string accept: The value of the Accept header.
+    :param list offered: Media types in order of preference.
+    """
+    ranges = []
+    for item in accept.split(','):
+        parts = item.split(';')
+        media_range = parts[0].strip().lower()
+        quality = 1.0
+        for param in parts[1:]:
+            name, sep, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        ranges.append((media_range, quality))
+    best, best_quality = None, 0.0
+    for media_type in offered:
+        major = media_type.split('/')[0] + '/*'
+        quality = specificity = None
+        for media_range, q in ranges:
+            if media_range == media_type:
+                rank = 2
+            elif media_range == major:
+                rank = 1
+            elif media_range == '*/*':
+                rank = 0
+            else:
+                continue
+            if specificity is None or rank > specificity:
+                quality, specificity = q, rank
+        if quality is not None and quality > best_quality:
+            best, best_quality = media_type, quality
+    return best
+
+
+def _select():
+    names = available_backends()
+    decoder = encoder = None
+    for name in names:
+        if decoder is None and is_conforming(name, encoding=False):
+            decoder = name
+        if encoder is None and is_conforming(name, decoding=False):
+            encoder = name
+    if decoder == encoder:
+        name = decoder
+    else:
+        name = '%s/%s' % (decoder, encoder)
+    return Codec(name, _load(decoder)[0], _load(encoder)[1])
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Content-Encoding negotiation for JSON-RPC over HTTP.
+
+Responses are compressed with gzip or deflate if the client accepts it and
+the body is at least as large as a threshold. Bodies produced piecewise, like
+streamed batches, are compressed while they are produced. Request bodies may
+be gzip or deflate encoded.
+
+Usage:
+
+    coding = negotiate('gzip;q=1.0, deflate;q=0.5')
+    coding, chunks = compress_chunks(chunks, coding, threshold=1024)
+    body = decompress(body, coding)
+"""
+
+from json_rpc_stream import ClosingIterator
+import itertools
+import zlib
+
+
+CODINGS = ('gzip', 'deflate')
+
+# Window sizes of zlib selecting the gzip and zlib container formats
+WBITS = {'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+
+
+class DecompressionError(ValueError):
+    """A request body could not be decompressed."""
+
+
+def negotiate(accept_encoding):
+    """Selects the content coding for a response.
+
+    Returns the accepted coding with the highest quality, preferring gzip on
+    ties, or None if no compression is accepted.
+
+    :param string accept_encoding: The value of the Accept-Encoding header.
+    """
+    if not accept_encoding:
+        return None
+    qualities = {}
+    for item in accept_encoding.split(','):
+        parts = item.split(';')
+        coding = parts[0].strip().lower()
+        quality = 1.0
+        for param in parts[1:]:
+            name, sep, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding == 'x-gzip':
+            coding = 'gzip'
+        qualities[coding] = quality
+    best, best_quality = None, 0.0
+    for coding in CODINGS:
+        quality = qualities.get(coding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def compress_chunks(chunks, coding, threshold=0, level=6):
+    """Compresses the chunks of a body if it reaches the threshold.
+
+    Chunks are consumed until the threshold is reached; smaller bodies are
+    returned as list without compression. Larger bodies are compressed as
+    the remaining chunks are consumed. A list of chunks results in a list;
+    closing the compressed chunks closes the original ones.
+
+    :param chunks: An iterable of strings.
+    :param string coding: 'gzip', 'deflate' or None.
+    :param int threshold: The minimum size of a compressed body in bytes.
+    :param int level: The zlib compression level.
+    :returns: A tuple of the coding used or None and the chunks.
+    """
+    if coding is None:
+        return None, chunks
+    is_list = isinstance(chunks, list)
+    iterator = iter(chunks)
+    head = []
+    size = 0
+    for chunk in iterator:
+        head.append(chunk)
+        size += len(chunk)
+        if size >= threshold:
+            break
+    else:
+        return None, head
+    compressed = _compress(itertools.chain(head, iterator), coding, level)
+    if is_list:
+        compressed = list(compressed)
+    elif hasattr(chunks, 'close'):
+        compressed = ClosingIterator(compressed, chunks.close)
+    return coding, compressed
+
+
+def _compress(chunks, coding, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, WBITS[coding])
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def decompress(body, coding, max_size=None):
+    """Decompresses a request body.
+
+    :param string body: The encoded body.
+    :param string coding: The value of the Content-Encoding header.
+    :param int max_size: The maximum size of the decompressed body or None.
+    :returns: The decoded body.
+    """
+    coding = (coding or 'identity').strip().lower()
+    if coding == 'identity':
+        return body
+    if coding == 'x-gzip':
+        coding = 'gzip'
+    if coding not in WBITS:
+        raise DecompressionError('Unsupported Content-Encoding %s' % coding)
+    attempts = [WBITS[coding]]
+    if coding == 'deflate':
+        # Some clients send raw deflate data without the zlib container
+        attempts.append(-zlib.MAX_WBITS)
+    for wbits in attempts:
+        decompressor = zlib.decompressobj(wbits)
+        try:
+            if max_size is None:
+                data = decompressor.decompress(body) + decompressor.flush()
+            else:
+                data = decompressor.decompress(body, max_size + 1)
+                if len(data) > max_size:
+                    raise DecompressionError(
+                        'Request body exceeds %i bytes' % max_size)
+        except zlib.error:
+            continue
+        return data
+    raise DecompressionError('Invalid %s encoded request body' % coding)
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Queues for deferring the execution of notifications.
+
+Usage:
+
+    class RPCHandler(JsonRpcHandler):
+
+        notification_queue = TaskQueue(url='/rpc')
+
+Valid notifications of a request are encoded as one JSON-RPC batch and
+enqueued with a single queue write; the response is sent without waiting
+for them. A TaskQueue posts the batch back to the endpoint with the App
+Engine task queue, which marks the request with the X-AppEngine-QueueName
+header so the notifications are executed then. An InProcessQueue executes
+them in a background thread of the instance instead, for WSGI servers
+allowing threads.
+"""
+
+import Queue
+import logging
+import threading
+
+
+QUEUE_HEADER = 'X-AppEngine-QueueName'
+
+
+class TaskQueue(object):
+    """Defers notifications with the App Engine task queue.
+
+    :param string url: The URL of the JSON-RPC endpoint the tasks are posted
+        to.
+    :param string queue_name: The name of the queue.
+    :param taskqueue: An object with an add method like
+        google.appengine.api.taskqueue; the App Engine API by default.
+    """
+
+    def __init__(self, url='/rpc', queue_name='default', taskqueue=None):
+        self.url = url
+        self.queue_name = queue_name
+        self.taskqueue = taskqueue
+
+    def enqueue(self, body, dispatcher):
+        """Adds a task posting a batch of notifications.
+
+        :param string body: The encoded batch.
+        :param dispatcher: The Dispatcher which received the notifications.
+        """
+        if self.taskqueue is None:
+            # Imported on first use to keep it out of cold starts
+            from google.appengine.api import taskqueue
+            self.taskqueue = taskqueue
+        self.taskqueue.add(
+            url=self.url, payload=body, queue_name=self.queue_name,
+            headers={'Content-Type': dispatcher.get_codec().content_type})
+
+
+class FakeTaskQueue(object):
+    """Local stand-in for the App Engine task queue API.
+
+    Added tasks are kept in `tasks` as dictionaries of their arguments.
+    """
+
+    def __init__(self):
+        self.tasks = []
+
+    def add(self, url=None, payload=None, queue_name='default', headers=None,
+            **kwargs):
+        task = dict(kwargs, url=url, payload=payload, queue_name=queue_name,
+                    headers=headers or {})
+        self.tasks.append(task)
+        return task
+
+
+class InProcessQueue(object):
+    """Executes deferred notifications in a background thread.
+
+    A new instance of the dispatcher class executes every batch. Batches
+    still queued are lost when the instance shuts down.
+
+    :param int max_size: Maximum number of queued batches; 0 is unbounded.
+    """
+
+    def __init__(self, max_size=1000):
+        self.queue = Queue.Queue(max_size)
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def enqueue(self, body, dispatcher):
+        """Queues a batch of notifications.
+
+        Raises Queue.Full if the queue is full.
+
+        :param string body: The encoded batch.
+        :param dispatcher: The Dispatcher which received the notifications.
+        """
+        self._start()
+        self.queue.put_nowait((dispatcher.__class__, body))
+
+    def join(self):
+        """Blocks until all queued batches are executed."""
+        self.queue.join()
+
+    def _start(self):
+        if self._worker is not None:
+            return
+        self._lock.acquire()
+        try:
+            if self._worker is None:
+                worker = threading.Thread(target=self._work)
+                worker.setDaemon(True)
+                worker.start()
+                self._worker = worker
+        finally:
+            self._lock.release()
+
+    def _work(self):
+        while True:
+            dispatcher_class, body = self.queue.get()
+            try:
+                try:
+                    dispatcher = dispatcher_class()
+                    dispatcher.queued = True
+                    status, chunks = dispatcher.dispatch(body)
+                    list(chunks)
+                except Exception:
+                    logging.exception('Deferred notifications failed')
+            finally:
+                self.queue.task_done()
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Request scoped batching of datastore gets.
+
+Usage:
+
+    class RPCHandler(JsonRpcHandler):
+
+        @ServiceMethod(coroutine=True)
+        def data(self, key_name):
+            entity = yield self.loader.get_by_key_name(MyData, key_name)
+            raise Return(entity.json())
+
+Every Dispatcher has a `loader` for the request it handles. Keys requested
+by the calls of a batch are collected until the first entity is needed and
+then fetched with a single bulk db.get. Entities are kept for the rest of
+the request, so repeated keys are fetched once and yield the same object.
+"""
+
+import sys
+import threading
+
+
+class EntityFuture(object):
+    """The future entity of a key.
+
+    :param loader: The EntityLoader.
+    :param key: A db.Key.
+    """
+
+    __slots__ = ('loader', 'key')
+
+    def __init__(self, loader, key):
+        self.loader = loader
+        self.key = key
+
+    def get_result(self):
+        """Returns the entity or None if it does not exist."""
+        return self.loader.result(self.key)
+
+
+class EntityListFuture(object):
+    """The future entities of a list of keys.
+
+    :param list futures: EntityFutures.
+    """
+
+    def __init__(self, futures):
+        self.futures = futures
+
+    def get_result(self):
+        """Returns a list of entities or None for missing entities."""
+        return [future.get_result() for future in self.futures]
+
+
+class EntityLoader(object):
+    """Collects datastore gets and resolves them with one bulk get.
+
+    :param function get: Fetches a list of keys like db.get, which is used
+        by default.
+    """
+
+    def __init__(self, get=None):
+        if get is None:
+            from google.appengine.ext import db
+            get = db.get
+        self._get = get
+        self._lock = threading.Lock()
+        self.entities = {}
+        self.errors = {}
+        self.pending = set()
+
+    def get(self, key):
+        """Requests an entity.
+
+        :param key: A db.Key.
+        :returns: An EntityFuture.
+        """
+        self._lock.acquire()
+        try:
+            if key not in self.entities and key not in self.errors:
+                self.pending.add(key)
+        finally:
+            self._lock.release()
+        return EntityFuture(self, key)
+
+    def get_many(self, keys):
+        """Requests several entities.
+
+        :param list keys: db.Keys.
+        :returns: An EntityListFuture.
+        """
+        return EntityListFuture([self.get(key) for key in keys])
+
+    def get_by_key_name(self, model_class, key_name, parent=None):
+        """Requests an entity by its key name like Model.get_by_key_name.
+
+        :param class model_class: A db.Model subclass.
+        :param string key_name: The key name.
+        :param parent: The db.Key of the parent entity or None.
+        :returns: An EntityFuture.
+        """
+        from google.appengine.ext import db
+        return self.get(
+            db.Key.from_path(model_class.kind(), key_name, parent=parent))
+
+    def result(self, key):
+        """Returns a requested entity, fetching all pending keys if needed.
+
+        :param key: A db.Key.
+        """
+        self._lock.acquire()
+        try:
+            if key not in self.entities and key not in self.errors:
+                self.flush()
+            exc_info = self.errors.get(key)
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            return self.entities[key]
+        finally:
+            self._lock.release()
+
+    def flush(self):
+        """Fetches all pending keys with one bulk get.
+
+        A failing get is raised for every key that was pending.
+        """
+        keys = list(self.pending)
+        self.pending.clear()
+        if not keys:
+            return
+        try:
+            entities = self._get(keys)
+        except Exception:
+            exc_info = sys.exc_info()
+            for key in keys:
+                self.errors[key] = exc_info
+            return
+        for key, entity in zip(keys, entities):
+            self.entities[key] = entity
+
+    def prime(self, entity):
+        """Adds an entity to the cache, e.g. after it has been stored.
+
+        :param entity: A db.Model instance.
+        """
+        self._lock.acquire()
+        try:
+            self.entities[entity.key()] = entity
+            self.errors.pop(entity.key(), None)
+        finally:
+            self._lock.release()
@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Encoding of datastore entities returned by service methods.
+
+Usage:
+
+    class RPCHandler(JsonRpcHandler):
+
+        model_serializer = ModelSerializer(version_property='updated')
+
+        @ServiceMethod(params={'fields': list})
+        def recent(self, limit=20, fields=None):
+            return Projection(Story.all().order('-updated').fetch(limit),
+                              fields)
+
+Results being an entity, a list of entities or a Projection of them are
+encoded by the serializer; missing entities in lists are encoded as null.
+Entities are encoded as objects of their key and properties. Dates and
+times are given in ISO 8601, keys and references as key strings, users as
+their email address, blobs in Base64 and geo points as objects of lat and
+lon. A Projection restricts the properties to the fields requested by the
+client; the key is always included.
+
+The property encoders of every model class are compiled once. With a
+version_property, encoded entities are cached per codec, key, version and
+projection. The property must change whenever the entity changes, e.g. a
+DateTimeProperty with auto_now.
+
+Large result sets are returned page by page with paginate; the entities of
+a page are streamed while the response is written:
+
+        @ServiceMethod(params={'cursor': basestring})
+        def stories(self, cursor=None):
+            return paginate(Story.all().order('-updated'), 100, cursor)
+"""
+
+from google.appengine.ext import db
+from json_rpc import InvalidParamsError, Page
+from json_rpc_cache import LocalCache
+import base64
+import datetime
+import operator
+
+
+def encode_datetime(value):
+    return value.isoformat()
+
+
+def encode_key(value):
+    return str(value)
+
+
+def encode_user(value):
+    return value.email()
+
+
+def is_user_type(value_type):
+    """Tells whether a type is users.User.
+
+    The users API is imported on first use to keep it off the cold start.
+    """
+    from google.appengine.api import users
+    return issubclass(value_type, users.User)
+
+
+def encode_blob(value):
+    return base64.b64encode(value)
+
+
+def encode_geopt(value):
+    return {'lat': value.lat, 'lon': value.lon}
+
+
+# Encoders of non-JSON values by type
+VALUE_ENCODERS = [
+    ((datetime.datetime, datetime.date, datetime.time), encode_datetime),
+    (db.Key, encode_key),
+    ((db.Blob, db.ByteString), encode_blob),
+    (db.GeoPt, encode_geopt),
+]
+
+# Encoders of property values by property class
+PROPERTY_ENCODERS = [
+    (db.DateTimeProperty, encode_datetime),
+    (db.UserProperty, encode_user),
+    ((db.BlobProperty, db.ByteStringProperty), encode_blob),
+    (db.GeoPtProperty, encode_geopt),
+]
+
+
+def encode_value(value):
+    """Encodes a property value of any type."""
+    for value_types, encoder in VALUE_ENCODERS:
+        if isinstance(value, value_types):
+            return encoder(value)
+    if isinstance(value, list):
+        return [encode_value(v) for v in value]
+    if is_user_type(value.__class__):
+        return encode_user(value)
+    return value
+
+
+def _list_encoder(item_type):
+    for value_types, encoder in VALUE_ENCODERS:
+        if issubclass(item_type, value_types):
+            return lambda values: [encoder(v) for v in values]
+    if is_user_type(item_type):
+        return lambda values: [encode_user(v) for v in values]
+    return list
+
+
+def compile_encoders(model_class):
+    """Compiles the encoders of the properties of a model class.
+
+    :param class model_class: A db.Model subclass.
+    :returns: A list of tuples of a property name, a function getting the
+        value from an entity and a function encoding values other than None.
+    """
+    encoders = []
+    for name, prop in sorted(model_class.properties().iteritems()):
+        if isinstance(prop, db.ReferenceProperty):
+            # The key of the referenced entity; it is not fetched
+            get, encoder = prop.get_value_for_datastore, encode_key
+        else:
+            get, encoder = operator.attrgetter(name), None
+            if isinstance(prop, db.ListProperty):
+                encoder = _list_encoder(prop.item_type)
+            for prop_types, property_encoder in PROPERTY_ENCODERS:
+                if isinstance(prop, prop_types):
+                    encoder = property_encoder
+                    break
+        encoders.append((name, get, encoder))
+    return encoders
+
+
+class Projection(object):
+    """Restricts the properties of encoded entities.
+
+    Raises InvalidParamsError for fields which are no properties of the
+    model class.
+
+    :param value: An entity or a list of entities.
+    :param list fields: The names of the properties to encode or None for
+        all properties.
+    """
+
+    def __init__(self, value, fields=None):
+        self.value = value
+        if fields is not None:
+            fields = tuple(fields)
+            model_class = None
+            if isinstance(value, db.Model):
+                model_class = value.__class__
+            elif isinstance(value, (list, tuple)):
+                for entity in value:
+                    if entity is not None:
+                        model_class = entity.__class__
+                        break
+            if model_class is not None:
+                check_fields(model_class, fields)
+        self.fields = fields
+
+
+def check_fields(model_class, fields):
+    """Raises InvalidParamsError for fields which are no properties.
+
+    :param class model_class: A db.Model subclass.
+    :param fields: The names of properties.
+    """
+    if issubclass(model_class, db.Expando):
+        return
+    properties = model_class.properties()
+    for name in fields:
+        if not isinstance(name, basestring) or name not in properties:
+            raise InvalidParamsError("Unknown field %r of %s" %
+                                     (name, model_class.kind()))
+
+
+class ModelSerializer(object):
+    """Encodes results consisting of datastore entities.
+
+    :param string version_property: The name of a property versioning the
+        entities; enables the cache of encoded entities.
+    :param int max_size: Maximum number of cached entities.
+    :param int max_projections: Maximum number of cached encoders of
+        projected properties.
+    """
+
+    def __init__(self, version_property=None, max_size=1000,
+                 max_projections=100):
+        self.version_property = version_property
+        self.cache = None
+        if version_property is not None:
+            self.cache = LocalCache(max_size)
+        self._encoders = {}
+        self._projections = LocalCache(max_projections)
+
+    def encoders(self, model_class, fields=None):
+        """Returns the compiled property encoders of a model class.
+
+        :param class model_class: A db.Model subclass.
+        :param tuple fields: The names of the properties to encode or None.
+        """
+        encoders = self._encoders.get(model_class)
+        if encoders is None:
+            encoders = compile_encoders(model_class)
+            self._encoders[model_class] = encoders
+        if fields is None:
+            return encoders
+        # Fields are chosen by clients; the key is limited to the properties
+        names = tuple(e[0] for e in encoders if e[0] in fields)
+        key = (model_class, names)
+        projected = self._projections.get(key)
+        if projected is None:
+            projected = [e for e in encoders if e[0] in names]
+            self._projections.set(key, projected)
+        return projected
+
+    def to_python(self, entity, fields=None):
+        """Returns the JSON representation of an entity.
+
+        :param entity: A db.Model instance.
+        :param tuple fields: The names of the properties to encode or None.
+        """
+        obj = {'key': entity.has_key() and str(entity.key()) or None}
+        for name, get, encoder in self.encoders(entity.__class__, fields):
+            value = get(entity)
+            if value is not None and encoder is not None:
+                value = encoder(value)
+            obj[name] = value
+        if isinstance(entity, db.Expando):
+            for name in entity.dynamic_properties():
+                if fields is None or name in fields:
+                    obj[name] = encode_value(getattr(entity, name))
+        return obj
+
+    def encode_entity(self, entity, codec, fields=None):
+        """Encodes an entity, using the cache if possible.
+
+        :param entity: A db.Model instance.
+        :param codec: The codec of the response.
+        :param tuple fields: The names of the properties to encode or None.
+        """
+        key = None
+        if self.cache is not None and entity.has_key():
+            version = getattr(entity, self.version_property, None)
+            if version is not None:
+                key = '%s:%s:%s:%s' % (codec.name, entity.key(), version,
+                                       fields and ','.join(fields) or '')
+                encoded = self.cache.get(key)
+                if encoded is not None:
+                    return encoded
+        encoded = codec.dumps(self.to_python(entity, fields))
+        if key is not None:
+            self.cache.set(key, encoded)
+        return encoded
+
+    def encode(self, value, codec):
+        """Encodes a result consisting of entities.
+
+        :param value: The result of a service method.
+        :param codec: The codec of the response.
+        :returns: The encoded result or None if it does not consist of
+            entities.
+        """
+        fields = None
+        projection = isinstance(value, Projection)
+        if projection:
+            value, fields = value.value, value.fields
+        if isinstance(value, db.Model):
+            return self.encode_entity(value, codec, fields)
+        if isinstance(value, (list, tuple)) and value:
+            parts = []
+            for entity in value:
+                if entity is None:
+                    parts.append(codec.dumps(None))
+                elif isinstance(entity, db.Model):
+                    parts.append(self.encode_entity(entity, codec, fields))
+                else:
+                    break
+            else:
+                return codec.join_array(parts)
+        if projection:
+            return codec.dumps(value)
+        return None
+
+
+def paginate(query, limit, cursor=None, fields=None):
+    """Returns a page of the results of a datastore query.
+
+    The entities are fetched in batches while the page is encoded. The
+    cursor of the next page is None once a page has less than limit
+    entities. Raises InvalidParamsError for invalid cursors and fields.
+
+    :param query: A db.Query.
+    :param int limit: The maximum number of entities of the page.
+    :param string cursor: The cursor of the page or None for the first one.
+    :param list fields: The names of the properties to encode or None for
+        all properties; see Projection.
+    :returns: A json_rpc.Page.
+    """
+    if cursor:
+        try:
+            query.with_cursor(cursor)
+        except (db.BadValueError, db.BadRequestError):
+            raise InvalidParamsError('Invalid cursor %r' % cursor)
+    if fields is not None:
+        # Checked before the response is started
+        fields = tuple(fields)
+        check_fields(query._model_class, fields)
+    count = [0]
+
+    def items():
+        for entity in query.run(limit=limit):
+            count[0] += 1
+            if fields is not None:
+                entity = Projection(entity, fields)
+            yield entity
+
+    def next_cursor():
+        if count[0] < limit:
+            return None
+        return query.cursor()
+
+    return Page(items(), next_cursor)
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""MessagePack codec for the JSON-RPC Dispatcher.
+
+Clients sending or accepting the media type application/msgpack exchange the
+same JSON-RPC 2.0 envelope encoded with MessagePack instead of JSON. The
+msgpack library is used if it is installed; otherwise the pure Python
+implementation of this module.
+
+Strings are encoded with the str family and decoded to unicode, binary data
+is decoded to str, so the Python representation equals the one of JSON. The
+str 8 type is not written, as by the msgpack library without bin types, so
+both implementations produce the same bytes and older decoders read them.
+Extension types are not supported.
+"""
+
+from json_rpc_codecs import Codec
+import struct
+
+
+CONTENT_TYPE = 'application/msgpack'
+
+_default = None
+
+
+def packb(obj):
+    """Encodes an object with MessagePack.
+
+    :param obj: None, bool, int, long, float, string, list, tuple or dict.
+    :returns: A string.
+    """
+    parts = []
+    _pack(obj, parts.append)
+    return ''.join(parts)
+
+
+def _pack(obj, write):
+    t = type(obj)
+    if obj is None:
+        write('\xc0')
+    elif t is bool:
+        write(obj and '\xc3' or '\xc2')
+    elif t is int or t is long:
+        if 0 <= obj < 0x80:
+            write(chr(obj))
+        elif -0x20 <= obj < 0:
+            write(chr(obj & 0xff))
+        elif obj > 0:
+            if obj <= 0xff:
+                write('\xcc' + chr(obj))
+            elif obj <= 0xffff:
+                write(struct.pack('>BH', 0xcd, obj))
+            elif obj <= 0xffffffff:
+                write(struct.pack('>BI', 0xce, obj))
+            elif obj <= 0xffffffffffffffff:
+                write(struct.pack('>BQ', 0xcf, obj))
+            else:
+                raise ValueError('Integer %i out of range' % obj)
+        else:
+            if obj >= -0x80:
+                write(struct.pack('>Bb', 0xd0, obj))
+            elif obj >= -0x8000:
+                write(struct.pack('>Bh', 0xd1, obj))
+            elif obj >= -0x80000000:
+                write(struct.pack('>Bi', 0xd2, obj))
+            elif obj >= -0x8000000000000000:
+                write(struct.pack('>Bq', 0xd3, obj))
+            else:
+                raise ValueError('Integer %i out of range' % obj)
+    elif t is float:
+        write(struct.pack('>Bd', 0xcb, obj))
+    elif isinstance(obj, basestring):
+        if isinstance(obj, unicode):
+            obj = obj.encode('utf-8')
+        n = len(obj)
+        if n < 0x20:
+            write(chr(0xa0 | n))
+        elif n <= 0xffff:
+            write(struct.pack('>BH', 0xda, n))
+        else:
+            write(struct.pack('>BI', 0xdb, n))
+        write(obj)
+    elif isinstance(obj, (list, tuple)):
+        n = len(obj)
+        write(array_header(n))
+        for item in obj:
+            _pack(item, write)
+    elif isinstance(obj, dict):
+        n = len(obj)
+        if n < 0x10:
+            write(chr(0x80 | n))
+        elif n <= 0xffff:
+            write(struct.pack('>BH', 0xde, n))
+        else:
+            write(struct.pack('>BI', 0xdf, n))
+        for key, value in obj.iteritems():
+            _pack(key, write)
+            _pack(value, write)
+    else:
+        raise TypeError('%r is not MessagePack serializable' % (obj,))
+
+
+def array_header(n):
+    """Returns the header of an array with n items.
+
+    :param int n: The number of items.
+    """
+    if n < 0x10:
+        return chr(0x90 | n)
+    elif n <= 0xffff:
+        return struct.pack('>BH', 0xdc, n)
+    return struct.pack('>BI', 0xdd, n)
+
+
+# Format and size of fixed size values by type byte
+_FIXED = {
+    0xca: ('>f', 4), 0xcb: ('>d', 8),
+    0xcc: ('>B', 1), 0xcd: ('>H', 2), 0xce: ('>I', 4), 0xcf: ('>Q', 8),
+    0xd0: ('>b', 1), 0xd1: ('>h', 2), 0xd2: ('>i', 4), 0xd3: ('>q', 8),
+}
+
+# Format and size of the length of strings, binary data, arrays and maps
+_LENGTH = {
+    0xc4: ('>B', 1), 0xc5: ('>H', 2), 0xc6: ('>I', 4),
+    0xd9: ('>B', 1), 0xda: ('>H', 2), 0xdb: ('>I', 4),
+    0xdc: ('>H', 2), 0xdd: ('>I', 4),
+    0xde: ('>H', 2), 0xdf: ('>I', 4),
+}
+
+
+def unpackb(data):
+    """Decodes a MessagePack encoded object.
+
+    Raises ValueError for invalid or truncated data.
+
+    :param string data: The encoded object.
+    """
+    try:
+        obj, pos = _unpack(data, 0)
+    except (IndexError, struct.error, UnicodeDecodeError), ex:
+        raise ValueError('Invalid MessagePack data: %s' % ex)
+    if pos != len(data):
+        raise ValueError('Extra data after MessagePack object')
+    return obj
+
+
+def _unpack(data, pos):
+    b = ord(data[pos])
+    pos += 1
+    if b < 0x80:
+        return b, pos
+    if b >= 0xe0:
+        return b - 0x100, pos
+    if 0xa0 <= b < 0xc0:
+        return _string(data, pos, b & 0x1f, True)
+    if 0x90 <= b < 0xa0:
+        return _array(data, pos, b & 0x0f)
+    if 0x80 <= b < 0x90:
+        return _map(data, pos, b & 0x0f)
+    if b == 0xc0:
+        return None, pos
+    if b == 0xc2:
+        return False, pos
+    if b == 0xc3:
+        return True, pos
+    fixed = _FIXED.get(b)
+    if fixed is not None:
+        return struct.unpack(fixed[0], data[pos:pos + fixed[1]])[0], \
+            pos + fixed[1]
+    length = _LENGTH.get(b)
+    if length is None:
+        raise ValueError('Unsupported MessagePack type 0x%02x' % b)
+    n = struct.unpack(length[0], data[pos:pos + length[1]])[0]
+    pos += length[1]
+    if b <= 0xc6:
+        return _string(data, pos, n, False)
+    if b <= 0xdb:
+        return _string(data, pos, n, True)
+    if b <= 0xdd:
+        return _array(data, pos, n)
+    return _map(data, pos, n)
+
+
+def _string(data, pos, n, text):
+    end = pos + n
+    if end > len(data):
+        raise IndexError('truncated string')
+    value = data[pos:end]
+    if text:
+        value = value.decode('utf-8')
+    return value, end
+
+
+def _array(data, pos, n):
+    items = []
+    append = items.append
+    for i in xrange(n):
+        item, pos = _unpack(data, pos)
+        append(item)
+    return items, pos
+
+
+def _map(data, pos, n):
+    items = {}
+    for i in xrange(n):
+        key, pos = _unpack(data, pos)
+        value, pos = _unpack(data, pos)
+        items[key] = value
+    return items, pos
+
+
+class MessagePackCodec(Codec):
+    """Codec encoding JSON-RPC messages with MessagePack.
+
+    Batches are framed as MessagePack arrays. Arrays are prefixed with their
+    length, so streamed arrays of unknown length are buffered as encoded
+    parts before they are written.
+    """
+
+    content_type = CONTENT_TYPE
+
+    def encode_result(self, result, message_id):
+        dumps = self.dumps
+        # A fixmap of the three members of a response
+        return ''.join(['\x83', dumps('jsonrpc'), dumps('2.0'),
+                        dumps('result'), result, dumps('id'),
+                        dumps(message_id)])
+
+    def join_array(self, parts):
+        return array_header(len(parts)) + ''.join(parts)
+
+    def stream_array(self, parts, count):
+        if count is None:
+            parts = [isinstance(part, basestring) and part or ''.join(part)
+                     for part in parts]
+            count = len(parts)
+        yield array_header(count)
+        for part in parts:
+            if isinstance(part, basestring):
+                yield part
+            else:
+                for chunk in part:
+                    yield chunk
+
+    def stream_result(self, chunks, message_id):
+        yield self.encode_result(''.join(chunks), message_id)
+
+    def stream_page(self, parts, cursor):
+        chunks = list(self.stream_array(parts, None))
+        # A fixmap of the items and the cursor
+        yield ''.join(['\x82', self.dumps('items')] + chunks +
+                      [self.dumps('cursor'), self.dumps(cursor())])
+
+
+def _msgpack():
+    import msgpack
+    def dumps(obj):
+        # Strings of both types are packed with the str family, like packb
+        return msgpack.packb(obj, use_bin_type=False)
+    def loads(data):
+        return msgpack.unpackb(data, raw=False)
+    return loads, dumps
+
+
+def get_codec():
+    """Returns the MessagePack codec.
+
+    The msgpack library is used if it is available, the pure Python
+    implementation otherwise.
+    """
+    global _default
+    if _default is None:
+        try:
+            _default = MessagePackCodec('msgpack', *_msgpack())
+        except ImportError:
+            _default = MessagePackCodec('msgpack.pure', unpackb, packb)
+    return _default
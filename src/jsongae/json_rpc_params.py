@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Parameter adapters for service methods.
+
+An adapter is compiled once per service method from its arguments, their
+defaults and an optional schema. It checks the parameters of a call and
+returns them as a list in positional order:
+
+    @ServiceMethod(params={'key_name': basestring, 'count': int})
+    def data(self, key_name, count=1):
+        ...
+
+A schema maps parameter names to JSON types given as Python types (bool,
+int, float, basestring, list or dict), tuples of them, or functions
+converting a value and raising ValueError or TypeError if it is invalid.
+Integers are accepted and converted for float parameters; booleans are not
+accepted as integers. None is accepted for parameters defaulting to None.
+"""
+
+import types
+
+
+class ParamsError(ValueError):
+    """The parameters of a call do not match the service method."""
+
+
+_MISSING = object()
+
+# JSON types in order of precedence; bool is a subclass of int
+JSON_TYPES = [
+    (bool, 'boolean'),
+    ((int, long), 'integer'),
+    (float, 'number'),
+    (basestring, 'string'),
+    ((list, tuple), 'array'),
+    (dict, 'object'),
+    (types.NoneType, 'null'),
+]
+
+
+def json_type(value):
+    """Returns the name of the JSON type of a value."""
+    for python_types, name in JSON_TYPES:
+        if isinstance(value, python_types):
+            return name
+    return type(value).__name__
+
+
+def _check_type(name, python_types, type_name, coerce=None):
+    def check(value):
+        if not isinstance(value, python_types) or isinstance(value, bool):
+            raise ParamsError("Parameter '%s' must be %s, got %s" %
+                              (name, type_name, json_type(value)))
+        if coerce is not None:
+            return coerce(value)
+        return value
+    return check
+
+
+def _check_bool(name):
+    def check(value):
+        if not isinstance(value, bool):
+            raise ParamsError("Parameter '%s' must be boolean, got %s" %
+                              (name, json_type(value)))
+        return value
+    return check
+
+
+def _convert(name, function):
+    def check(value):
+        try:
+            return function(value)
+        except (TypeError, ValueError), ex:
+            raise ParamsError("Invalid value for parameter '%s': %s" %
+                              (name, ex))
+    return check
+
+
+def _check_any(name, checks, type_names):
+    def check(value):
+        for check in checks:
+            try:
+                return check(value)
+            except ParamsError:
+                pass
+        raise ParamsError("Parameter '%s' must be %s, got %s" %
+                          (name, ' or '.join(type_names), json_type(value)))
+    return check
+
+
+def compile_check(name, schema):
+    """Returns a function checking and converting the value of a parameter.
+
+    :param string name: The name of the parameter.
+    :param schema: A type, a tuple of types or a conversion function.
+    :returns: A function returning the converted value or raising
+        ParamsError.
+    """
+    if isinstance(schema, tuple):
+        checks = [compile_check(name, s) for s in schema]
+        type_names = [type_name(s) for s in schema]
+        return _check_any(name, checks, type_names)
+    if schema is bool:
+        return _check_bool(name)
+    if schema in (int, long):
+        return _check_type(name, (int, long), 'integer')
+    if schema is float:
+        return _check_type(name, (int, long, float), 'number', float)
+    if schema in (str, unicode, basestring):
+        return _check_type(name, basestring, 'string')
+    if schema in (list, tuple):
+        return _check_type(name, (list, tuple), 'array')
+    if schema is dict:
+        return _check_type(name, dict, 'object')
+    if callable(schema):
+        return _convert(name, schema)
+    raise TypeError('Invalid schema for parameter %s: %r' % (name, schema))
+
+
+def type_name(schema):
+    """Returns the JSON type name of a schema."""
+    if schema in (str, unicode):
+        return 'string'
+    for python_types, name in JSON_TYPES:
+        if not isinstance(python_types, tuple):
+            python_types = (python_types,)
+        if schema in python_types:
+            return name
+    return getattr(schema, '__name__', repr(schema))
+
+
+def compile_adapter(args, defaults=(), schema=None):
+    """Compiles the parameter adapter of a service method.
+
+    The adapter takes the JSON-RPC params of a call, i.e. None, a list or a
+    dictionary, and returns the arguments in positional order. Named
+    parameters are looked up once each; no intermediate dictionary is built.
+
+    :param tuple args: The names of the arguments.
+    :param tuple defaults: The defaults of the last arguments.
+    :param dict schema: Maps argument names to types or conversion functions.
+    :returns: A function raising ParamsError for invalid parameters.
+    """
+    args = tuple(args)
+    arity = len(args)
+    defaults = list(defaults or ())
+    required = arity - len(defaults)
+    schema = schema or {}
+    for name in schema:
+        if name not in args:
+            raise TypeError('Schema for unknown parameter %s' % name)
+    checks = []
+    for index, name in enumerate(args):
+        if name in schema:
+            check = compile_check(name, schema[name])
+            if index >= required and defaults[index - required] is None:
+                check = _nullable(check)
+            checks.append((index, check))
+    arg_set = frozenset(args)
+
+    if required == arity:
+        expected = '%i' % arity
+    else:
+        expected = '%i to %i' % (required, arity)
+
+    def adapt(params):
+        if params is None:
+            if required:
+                raise ParamsError(
+                    "Wrong number of parameters; expected %s but 'params' "
+                    "was omitted from JSON-RPC message" % expected)
+            values = list(defaults)
+        elif isinstance(params, dict):
+            get = params.get
+            values = [get(name, _MISSING) for name in args]
+            found = arity - values.count(_MISSING)
+            if found != len(params):
+                unknown = sorted(name for name in params
+                                 if name not in arg_set)
+                raise ParamsError("Unexpected parameter '%s'" % unknown[0])
+            if found != arity:
+                for index in xrange(arity):
+                    if values[index] is _MISSING:
+                        if index < required:
+                            raise ParamsError("Missing parameter '%s'" %
+                                              args[index])
+                        values[index] = defaults[index - required]
+        else:
+            count = len(params)
+            if count == arity:
+                if not checks:
+                    return params
+                values = list(params)
+            elif required <= count < arity:
+                values = list(params)
+                values.extend(defaults[count - required:])
+            else:
+                raise ParamsError("Wrong number of parameters; "
+                                  "expected %s got %i" % (expected, count))
+        for index, check in checks:
+            values[index] = check(values[index])
+        return values
+
+    return adapt
+
+
+def _nullable(check):
+    def nullable(value):
+        if value is None:
+            return None
+        return check(value)
+    return nullable
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Sampled profiling of the JSON-RPC pipeline with cProfile.
+
+Usage:
+
+    class RPCHandler(JsonRpcHandler):
+
+        profiler = SampledProfiler(sample_rate=0.01)
+
+A fraction of requests is profiled. Their profiles are aggregated in memory
+per phase of the pipeline, i.e. parsing the body, executing and serializing
+the calls, and per service method. Administrators retrieve the top functions
+by calling the reserved method 'rpc.profile'; dump writes them to a file
+readable by pstats.
+
+Only the request thread and the threads of the batch executor are profiled.
+Asynchronous calls are profiled until they are started, streamed results
+until their response starts.
+"""
+
+import random
+import thread
+import threading
+
+
+PHASES = ('parse', 'execute', 'serialize')
+
+SORT_KEYS = ('calls', 'cumulative', 'time')
+
+
+class Snapshot(object):
+    """Copies statistics for a new pstats.Stats.
+
+    :param dict stats: The stats of a pstats.Stats.
+    """
+
+    def __init__(self, stats):
+        self.stats = dict(stats)
+
+    def create_stats(self):
+        pass
+
+
+class ProfileSession(object):
+    """Collects the profiles of one request.
+
+    Every phase and method is profiled with a profile per thread, since a
+    profile must not be enabled by two threads at once.
+    """
+
+    def __init__(self):
+        import cProfile
+        self.profile_class = cProfile.Profile
+        self.profiles = {}
+
+    def run(self, phase, method, function, *args):
+        """Calls a function while profiling it.
+
+        :param string phase: The phase of the pipeline.
+        :param string method: The name of the service method or None.
+        :param function function: The function.
+        :returns: The return value of the function.
+        """
+        key = (phase, method, thread.get_ident())
+        profile = self.profiles.get(key)
+        if profile is None:
+            profile = self.profiles[key] = self.profile_class()
+        return profile.runcall(function, *args)
+
+
+class SampledProfiler(object):
+    """Profiles a sample of requests and aggregates their statistics.
+
+    An object for Dispatcher.profiler.
+
+    :param float sample_rate: The fraction of requests to profile.
+    """
+
+    def __init__(self, sample_rate=0.01):
+        self.sample_rate = sample_rate
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Discards all statistics."""
+        self.samples = 0
+        self.stats = {}
+
+    def sample(self):
+        """Decides whether to profile a request.
+
+        :returns: A ProfileSession or None.
+        """
+        if random.random() >= self.sample_rate:
+            return None
+        return ProfileSession()
+
+    def add(self, session):
+        """Aggregates the profiles of a finished request.
+
+        :param session: The ProfileSession of the request.
+        """
+        import pstats
+        self._lock.acquire()
+        try:
+            self.samples += 1
+            for (phase, method, ident), profile in \
+                    session.profiles.iteritems():
+                profile.create_stats()
+                if not profile.stats:
+                    continue
+                stats = self.stats.get((phase, method))
+                if stats is None:
+                    self.stats[(phase, method)] = pstats.Stats(
+                        Snapshot(profile.stats))
+                else:
+                    stats.add(Snapshot(profile.stats))
+        finally:
+            self._lock.release()
+
+    def merged(self, phase=None, method=None):
+        """Returns the statistics of a phase and method merged.
+
+        :param string phase: A phase or None for all phases.
+        :param string method: A method name or None for all methods.
+        :returns: A pstats.Stats or None if nothing was profiled.
+        """
+        import pstats
+        if phase is not None and phase not in PHASES:
+            raise ValueError('Unknown phase %r' % phase)
+        self._lock.acquire()
+        try:
+            selected = [stats for (p, m), stats in self.stats.iteritems()
+                        if phase in (None, p) and method in (None, m)]
+            if not selected:
+                return None
+            merged = pstats.Stats(Snapshot(selected[0].stats))
+            merged.add(*selected[1:])
+            return merged
+        finally:
+            self._lock.release()
+
+    def report(self, top=20, sort='cumulative', phase=None, method=None):
+        """Returns the aggregated statistics.
+
+        Times are totals over all samples in milliseconds.
+
+        :param int top: The number of functions listed.
+        :param string sort: Order of the functions; one of SORT_KEYS.
+        :param string phase: Lists the functions of a phase only.
+        :param string method: Lists the functions of a method only.
+        :returns: A dictionary of the number of samples, the times per phase
+            and per method and the top functions.
+        """
+        if sort not in SORT_KEYS:
+            raise ValueError('Unknown sort key %r' % sort)
+        self._lock.acquire()
+        try:
+            phases = dict.fromkeys(PHASES, 0.0)
+            methods = {}
+            for (p, m), stats in self.stats.iteritems():
+                phases[p] += stats.total_tt * 1000
+                if m is not None:
+                    methods.setdefault(m, {})[p] = stats.total_tt * 1000
+            result = {'samples': self.samples, 'phases': phases,
+                      'methods': methods, 'functions': []}
+        finally:
+            self._lock.release()
+        merged = self.merged(phase, method)
+        if merged is not None:
+            import pstats
+            merged.sort_stats(sort)
+            for func in merged.fcn_list[:top]:
+                cc, nc, tt, ct, callers = merged.stats[func]
+                result['functions'].append({
+                    'function': pstats.func_std_string(func),
+                    'calls': nc,
+                    'primitive_calls': cc,
+                    'total_time': tt * 1000,
+                    'cumulative_time': ct * 1000,
+                })
+        return result
+
+    def dump(self, filename, phase=None, method=None):
+        """Writes the aggregated statistics to a file readable by pstats.
+
+        :param string filename: The name of the file.
+        :param string phase: Writes the statistics of a phase only.
+        :param string method: Writes the statistics of a method only.
+        :returns: True or False if nothing was profiled.
+        """
+        merged = self.merged(phase, method)
+        if merged is None:
+            return False
+        merged.dump_stats(filename)
+        return True
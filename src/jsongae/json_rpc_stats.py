@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Instruments collecting statistics about service methods.
+
+Usage:
+
+    class RPCHandler(JsonRpcHandler):
+
+        instruments = [MethodStats()]
+
+The statistics are kept in memory per instance and can be retrieved by
+calling the reserved method 'rpc.stats' as an administrator. Calls of unknown
+methods are aggregated under json_rpc.UNKNOWN_METHOD.
+"""
+
+import threading
+
+
+class Histogram(object):
+    """Histogram of durations with exponentially growing buckets.
+
+    Percentiles are approximated by the upper bound of the bucket they fall
+    into.
+
+    :param float smallest: Upper bound of the first bucket in seconds.
+    :param int buckets: Number of buckets; each doubles the previous bound.
+    """
+
+    def __init__(self, smallest=0.0001, buckets=24):
+        self.bounds = [smallest * 2 ** i for i in range(buckets)]
+        self.counts = [0] * (buckets + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        """Adds a duration.
+
+        :param float value: The duration in seconds.
+        """
+        index = 0
+        bounds = self.bounds
+        while index < len(bounds) and value > bounds[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+
+    def percentile(self, q):
+        """Returns the approximated q-th percentile.
+
+        Values beyond the last bucket are reported as its bound.
+
+        :param float q: The percentile between 0 and 100.
+        """
+        if not self.count:
+            return 0.0
+        rank = q / 100.0 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                break
+        return self.bounds[min(index, len(self.bounds) - 1)]
+
+    def mean(self):
+        """Returns the mean duration."""
+        if not self.count:
+            return 0.0
+        return self.total / self.count
+
+
+class MethodStats(object):
+    """Aggregates count, errors and latencies per service method.
+
+    An instrument for Dispatcher.instruments.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Discards all statistics."""
+        self.methods = {}
+
+    def before_dispatch(self, event):
+        pass
+
+    def after_dispatch(self, event):
+        """Records a call.
+
+        :param event: A json_rpc.DispatchEvent.
+        """
+        self._lock.acquire()
+        try:
+            stats = self.methods.get(event.method)
+            if stats is None:
+                stats = self.methods[event.method] = {
+                    'count': 0,
+                    'errors': 0,
+                    'execution': Histogram(),
+                    'parse_time': 0.0,
+                    'serialization_time': 0.0,
+                    'param_size': 0,
+                }
+            stats['count'] += 1
+            if event.error is not None:
+                stats['errors'] += 1
+            stats['execution'].add(event.execution_time)
+            stats['parse_time'] += event.parse_time
+            stats['serialization_time'] += event.serialization_time
+            stats['param_size'] += event.param_size
+        finally:
+            self._lock.release()
+
+    def snapshot(self):
+        """Returns the statistics of all methods.
+
+        Times are given in milliseconds; parse and serialization times and
+        the parameter size are means per call.
+
+        :returns: A dictionary mapping method names to their statistics.
+        """
+        self._lock.acquire()
+        try:
+            result = {}
+            for method, stats in self.methods.iteritems():
+                count = stats['count']
+                execution = stats['execution']
+                result[method] = {
+                    'count': count,
+                    'errors': stats['errors'],
+                    'error_rate': float(stats['errors']) / count,
+                    'mean': execution.mean() * 1000,
+                    'p50': execution.percentile(50) * 1000,
+                    'p95': execution.percentile(95) * 1000,
+                    'p99': execution.percentile(99) * 1000,
+                    'parse_time': stats['parse_time'] / count * 1000,
+                    'serialization_time':
+                        stats['serialization_time'] / count * 1000,
+                    'param_size': float(stats['param_size']) / count,
+                }
+            return result
+        finally:
+            self._lock.release()
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Incremental reading of JSON-RPC batch requests.
+
+An ArrayReader splits a JSON array read from a stream into the texts of its
+elements without decoding them, so a batch can be decoded and executed one
+message at a time while the request body is read:
+
+    reader = ArrayReader(BodyStream(environ['wsgi.input'], length))
+    if reader.peek() == '[':
+        for text in reader.elements():
+            message = codec.loads(text)
+
+The reader only tracks strings and nesting to find the elements; their
+syntax is checked when they are decoded.
+
+Streamed response bodies are wrapped in a ClosingIterator to release the
+resources of the request once the body is consumed or closed.
+"""
+
+import re
+
+
+CHUNK_SIZE = 64 * 1024
+
+WHITESPACE = ' \t\n\r'
+
+_STRUCTURE = re.compile(r'["\[\]{},]')
+
+# The rest of a string after its opening quote
+_STRING_TAIL = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+
+
+class BodyStream(object):
+    """Reads at most length bytes from a file-like object.
+
+    WSGI input streams must not be read beyond the Content-Length.
+
+    :param file: An object with a read method.
+    :param int length: The length of the body.
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.length = length
+        self.remaining = length
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        if not size:
+            return ''
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+
+class ArrayReader(object):
+    """Splits a JSON array read from a stream into its elements.
+
+    :param stream: An object with a read method or a string.
+    :param int chunk_size: The number of bytes read at once.
+    """
+
+    def __init__(self, stream, chunk_size=CHUNK_SIZE):
+        if isinstance(stream, basestring):
+            self.read = lambda size, data=[stream]: data and data.pop() or ''
+        else:
+            self.read = stream.read
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        """Reads a chunk, dropping the consumed part of the buffer."""
+        if self.eof:
+            return False
+        chunk = self.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def _skip_whitespace(self):
+        while True:
+            buf = self.buffer
+            pos = self.pos
+            while pos < len(buf) and buf[pos] in WHITESPACE:
+                pos += 1
+            self.pos = pos
+            if pos < len(buf) or not self._fill():
+                return
+
+    def peek(self):
+        """Returns the first character that is not whitespace or ''."""
+        self._skip_whitespace()
+        return self.buffer[self.pos:self.pos + 1]
+
+    def read_all(self):
+        """Returns the unconsumed rest of the stream."""
+        chunks = [self.buffer[self.pos:]]
+        while self._fill():
+            chunks.append(self.buffer)
+            self.pos = len(self.buffer)
+        self.buffer = ''
+        self.pos = 0
+        return ''.join(chunks)
+
+    def elements(self):
+        """Yields the text of every element of the array.
+
+        Raises ValueError if the stream does not hold an array, ends before
+        the array is closed or holds anything but whitespace after it.
+        """
+        if self.peek() != '[':
+            raise ValueError('Expected an array')
+        self.pos += 1
+        if self.peek() == ']':
+            self.pos += 1
+        else:
+            while self._scan_element():
+                yield self.buffer[self.start:self.end].strip(WHITESPACE)
+            yield self.buffer[self.start:self.end].strip(WHITESPACE)
+        if self.peek():
+            raise ValueError('Extra data after the array')
+
+    def _scan_element(self):
+        """Finds the end of the next element.
+
+        Sets start and end to its bounds in the buffer and moves past the
+        following separator. Returns False if the array was closed.
+        """
+        start = self.start = self.pos
+        depth = 0
+        pos = start
+        search = _STRUCTURE.search
+        while True:
+            buf = self.buffer
+            match = search(buf, pos)
+            if match is None:
+                pos = len(buf)
+            else:
+                pos = match.start()
+                char = buf[pos]
+                if char == '"':
+                    tail = _STRING_TAIL.match(buf, pos + 1)
+                    if tail is not None:
+                        pos = tail.end()
+                        continue
+                elif char in '[{':
+                    depth += 1
+                    pos += 1
+                    continue
+                elif depth:
+                    if char != ',':
+                        depth -= 1
+                    pos += 1
+                    continue
+                elif char == '}' or pos == start:
+                    raise ValueError('Expected an element')
+                else:
+                    self.end = pos
+                    self.pos = pos + 1
+                    return char == ','
+            # The element continues beyond the buffer
+            offset = self.pos
+            if not self._fill():
+                raise ValueError('Unexpected end of array')
+            start -= offset
+            pos -= offset
+            self.start = start
+
+
+class ClosingIterator(object):
+    """Iterates over chunks and calls functions once they are done.
+
+    The callbacks run when the chunks are exhausted, iterating them fails or
+    the iterator is closed. WSGI servers close response bodies also when the
+    client disconnects before it is consumed; unlike the finally clause of a
+    generator, close runs the callbacks even if iteration never started.
+
+    :param chunks: An iterable of strings; closed along with the iterator
+        if it has a close method.
+    :param callbacks: Functions called without arguments.
+    """
+
+    def __init__(self, chunks, *callbacks):
+        self._chunks = chunks
+        self._iterator = iter(chunks)
+        self._callbacks = callbacks
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        try:
+            return self._iterator.next()
+        except:
+            self.close()
+            raise
+
+    def close(self):
+        """Closes the chunks and runs the callbacks unless done before."""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            close = getattr(self._chunks, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            for callback in self._callbacks:
+                callback()
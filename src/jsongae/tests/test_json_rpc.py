@@ -17,11 +17,18 @@
  
 from jsongae.json_rpc import *
 from google.appengine.ext.webapp import Request, Response
+import StringIO
 import google.appengine.ext.webapp
+import jsongae.json_rpc_codecs as json_rpc_codecs
+import jsongae.json_rpc_msgpack as json_rpc_msgpack
+import jsongae.json_rpc_stream as json_rpc_stream
 import logging
 import simplejson
+import threading
+import time
 import unittest
 import webob
+import webtest
 
 LOG_FORMAT = '%(levelname)-8s %(asctime)s %(filename)s:%(lineno)s] %(message)s'
 
@@ -158,6 +165,15 @@ class JSONRPCHandlerFunctionalTest(unittest.TestCase):
         self.assertEqual(r_status, status)
         self.assertEqual(simplejson.loads(r_resp), simplejson.loads(resp))
 
+    def test_scalar_body(self):
+        """Test rpc call with a JSON value that is neither object nor array."""
+        req = '5'
+        resp = '{"jsonrpc": "2.0", "error": {"code": -32600, "message": "InvalidRequestError: Invalid JSON-RPC Message; must be an object"}, "id": null}'
+        status = 400
+        r_status, r_resp = self.exec_handler(req)
+        self.assertEqual(r_status, status)
+        self.assertEqual(simplejson.loads(r_resp), simplejson.loads(resp))
+
     def test_empty_array(self):
         """Test rpc call with an empty Array."""
         req = '[]'
@@ -319,3 +335,838 @@ class JsonRpcHandlerTestCase(unittest.TestCase):
         self.assertEqual(
             repr(msg.error), 'InternalError("Error executing service method")')
         self.assertTrue(isinstance(msg.error, InternalError))
+
+    def testMessageValidation(self):
+        """Messages are validated in a single pass and carry no __dict__."""
+        msg = JsonRpcMessage(
+            {'jsonrpc': '2.0', 'method': 'myMethod', 'params': [1, 2]})
+        self.assertFalse(hasattr(msg, '__dict__'))
+        self.assertEqual((msg.method_name, msg.params, msg.message_id),
+                         ('myMethod', [1, 2], None))
+        self.assertTrue(msg.notification)
+        self.assertEqual(msg.error, None)
+        for json, message in [
+                ({'jsonrpc': '2.0', 'method': 'x', 'foo': 1, 'id': 1},
+                 'Invalid members in request object'),
+                ({'method': 'x', 'foo': 1}, 'Invalid members in request object'),
+                ({'method': 'x', 'id': 1}, 'Server supports JSON-RPC 2.0 only'),
+                ({'jsonrpc': '2.0', 'id': None}, 'No method specified'),
+                ({'jsonrpc': '2.0', 'method': None, 'id': 1},
+                 'Method must be a string'),
+                ({'jsonrpc': '2.0', 'method': 'x', 'params': None},
+                 "'params' must be an array or object")]:
+            msg = JsonRpcMessage(json)
+            self.assertTrue(isinstance(msg.error, InvalidRequestError))
+            self.assertEqual(str(msg.error), message)
+        msg = JsonRpcMessage({'jsonrpc': '2.0', 'method': 'x', 'id': None})
+        self.assertEqual((msg.error, msg.notification), (None, False))
+
+    def testServiceMethodRegistry(self):
+        """Service methods are collected once per class."""
+        methods = self.MyTestHandler.service_methods
+        self.assertEqual(
+            sorted(methods),
+            ['brokenMethod', 'myMethod', 'noParamsMethod', 'rpc.profile',
+             'rpc.stats', 'variableParamsMethod'])
+        spec = methods['myMethod'].service_spec
+        self.assertEqual(spec.args, ('a', 'b'))
+        self.assertEqual(spec.arg_set, frozenset(['a', 'b']))
+        self.assertEqual(spec.arity, 2)
+        self.assertFalse(spec.variable)
+        self.assertTrue(methods['variableParamsMethod'].service_spec.variable)
+
+    def testOverriddenServiceMethod(self):
+        """Overriding without the decorator hides a service method."""
+        class DerivedHandler(self.MyTestHandler):
+            def myMethod(self, a, b):
+                return a - b
+            @ServiceMethod
+            def derivedMethod(self):
+                return 'derived'
+        self.assertFalse('myMethod' in DerivedHandler.service_methods)
+        self.assertTrue('derivedMethod' in DerivedHandler.service_methods)
+        self.assertTrue('noParamsMethod' in DerivedHandler.service_methods)
+        h = DerivedHandler()
+        self.assertRaises(MethodNotFoundError, h.get_service_method, 'myMethod')
+        self.assertRaises(
+            MethodNotFoundError, h.get_service_method, 'noServiceMethod')
+        self.assertEqual(h.get_service_method('derivedMethod')(), 'derived')
+
+
+class ThreadedBatchExecutorTestCase(unittest.TestCase):
+    """Tests for executing batch entries concurrently."""
+    class MyTestHandler(JsonRpcHandler):
+        batch_executor = ThreadedBatchExecutor(max_workers=3, timeout=1.0)
+        lock = threading.Lock()
+        running = [0, 0]
+        @ServiceMethod
+        def slow(self, value):
+            self.lock.acquire()
+            self.running[0] += 1
+            self.running[1] = max(self.running)
+            self.lock.release()
+            time.sleep(0.05)
+            self.lock.acquire()
+            self.running[0] -= 1
+            self.lock.release()
+            return value
+        @ServiceMethod
+        def hang(self):
+            time.sleep(1.5)
+            return 'too late'
+        @ServiceMethod
+        def broken(self):
+            raise ValueError
+
+    def exec_handler(self, body):
+        h = self.MyTestHandler()
+        h.request = Request.blank('/rpc/')
+        h.response = Response()
+        h.request.body = body
+        h.post()
+        return (h.response.status, simplejson.loads(h.response.out.getvalue()))
+
+    def testConcurrentBatch(self):
+        """Batch entries run concurrently and keep their order."""
+        self.MyTestHandler.running[:] = [0, 0]
+        req = simplejson.dumps(
+            [{"jsonrpc": "2.0", "method": "slow", "params": [i + 1],
+              "id": i} for i in range(6)] +
+            [{"jsonrpc": "2.0", "method": "slow", "params": [6]},
+             {"jsonrpc": "2.0", "method": "broken", "id": 7},
+             {"jsonrpc": "2.0", "method": "missing", "id": 8},
+             {"foo": "boo"}])
+        status, resp = self.exec_handler(req)
+        self.assertEqual(status, 200)
+        self.assertEqual([r['result'] for r in resp[:6]], range(1, 7))
+        self.assertEqual([r['id'] for r in resp], range(6) + [7, 8, None])
+        self.assertEqual(resp[6]['error']['code'], -32603)
+        self.assertEqual(resp[7]['error']['code'], -32601)
+        self.assertEqual(resp[8]['error']['code'], -32600)
+        self.assertEqual(self.MyTestHandler.running[1], 3)
+
+    def testTimeout(self):
+        """Calls exceeding the timeout are answered with an error."""
+        req = simplejson.dumps(
+            [{"jsonrpc": "2.0", "method": "hang", "id": 1},
+             {"jsonrpc": "2.0", "method": "slow", "params": [2], "id": 2}])
+        status, resp = self.exec_handler(req)
+        self.assertEqual(resp[0]['error']['code'], -32001)
+        self.assertEqual(resp[1]['result'], 2)
+
+    def testAbandonedCalls(self):
+        """Abandoned calls hold their workers; no thread is started per call."""
+        class Message(object):
+            method_name = 'block'
+        release = threading.Event()
+        def block(msg):
+            release.wait()
+            return 'late', None
+        executor = ThreadedBatchExecutor(max_workers=2, timeout=0.05)
+        outcomes = list(executor.imap(block, [Message(), Message()]))
+        self.assertEqual([r for r, e in outcomes], [None, None])
+        self.assertEqual(executor.abandoned, 2)
+        for i in range(5):
+            result, error = executor.call(block, Message())
+            self.assertTrue(isinstance(error, ExecutionTimeoutError))
+        self.assertEqual(executor.workers, 2)
+        release.set()
+        while executor.abandoned:
+            time.sleep(0.01)
+        outcomes = list(executor.imap(lambda msg: (msg.method_name, None),
+                                      [Message(), Message(), Message()]))
+        self.assertEqual(outcomes, [('block', None)] * 3)
+        self.assertEqual(executor.abandoned, 0)
+        deadline = time.time() + 5
+        while executor.workers and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(executor.workers, 0)
+
+    def testWithoutThreads(self):
+        """Calls are executed sequentially if no thread can be started."""
+        class SequentialExecutor(ThreadedBatchExecutor):
+            def start_worker(self):
+                raise threading.ThreadError("can't start new thread")
+        class SequentialHandler(self.MyTestHandler):
+            batch_executor = SequentialExecutor(max_workers=3, timeout=1.0)
+        self.MyTestHandler.running[:] = [0, 0]
+        h = SequentialHandler()
+        h.request = Request.blank('/rpc/')
+        h.response = Response()
+        h.request.body = simplejson.dumps(
+            [{"jsonrpc": "2.0", "method": "slow", "params": [i], "id": i}
+             for i in range(3)])
+        h.post()
+        resp = simplejson.loads(h.response.out.getvalue())
+        self.assertEqual([r['result'] for r in resp], range(3))
+        self.assertEqual(self.MyTestHandler.running[1], 1)
+
+
+class StreamingBatchTestCase(unittest.TestCase):
+    """Tests for streaming batch responses."""
+    class MyTestHandler(JsonRpcHandler):
+        stream_batches = True
+        @ServiceMethod
+        def echo(self, value):
+            return value
+        @ServiceMethod
+        def notify_hello(self, num):
+            pass
+
+    def exec_handler(self, handler_class, body):
+        h = handler_class()
+        h.request = Request.blank('/rpc/')
+        h.response = Response()
+        h.request.body = body
+        h.post()
+        return (h.response.status, h.response.out.getvalue())
+
+    def testStreamedBatch(self):
+        """Streamed batches are identical to encoded batches."""
+        class BufferedHandler(self.MyTestHandler):
+            stream_batches = False
+        req = '''[{"jsonrpc": "2.0", "method": "echo", "params": ["a"], "id": 1},
+                  {"jsonrpc": "2.0", "method": "notify_hello", "params": [7]},
+                  {"foo": "boo"},
+                  {"jsonrpc": "2.0", "method": "echo", "params": [[1, 2]], "id": 2}
+                 ]'''
+        streamed = self.exec_handler(self.MyTestHandler, req)
+        buffered = self.exec_handler(BufferedHandler, req)
+        self.assertEqual(streamed, buffered)
+        self.assertEqual(streamed[0], 200)
+        self.assertEqual(len(simplejson.loads(streamed[1])), 3)
+
+    def testStreamedNotificationBatch(self):
+        """Batches of notifications still answer with 204."""
+        req = '''[{"jsonrpc": "2.0", "method": "notify_hello", "params": [7]},
+                  {"jsonrpc": "2.0", "method": "notify_hello", "params": [7]}
+                 ]'''
+        self.assertEqual(self.exec_handler(self.MyTestHandler, req), (204, ''))
+
+
+class IncrementalBatchTestCase(unittest.TestCase):
+    """Tests for executing batches while they are read."""
+    class MyTestHandler(JsonRpcHandler):
+        incremental_batches = True
+        calls = []
+        @ServiceMethod
+        def echo(self, value):
+            self.calls.append(value)
+            return value
+        @ServiceMethod
+        def notify_hello(self, num):
+            pass
+
+    def setUp(self):
+        self.MyTestHandler.calls = []
+
+    def exec_handler(self, handler_class, body):
+        h = handler_class()
+        h.request = Request.blank('/rpc/')
+        h.response = Response()
+        h.request.body = body
+        h.post()
+        return (h.response.status, h.response.out.getvalue())
+
+    def testIncrementalBatch(self):
+        """Responses are identical to those of batches read at once."""
+        class BufferedHandler(self.MyTestHandler):
+            incremental_batches = False
+        for req in [
+                '''[{"jsonrpc": "2.0", "method": "echo", "params": ["a]"], "id": 1},
+                  {"jsonrpc": "2.0", "method": "notify_hello", "params": [7]},
+                  {"foo": "boo"}, 1,
+                  {"jsonrpc": "2.0", "method": "echo", "params": [[1, {}]], "id": 2}
+                 ]''',
+                '[{"jsonrpc": "2.0", "method": "notify_hello", "params": [7]}]',
+                '{"jsonrpc": "2.0", "method": "echo", "params": ["a"], "id": 1}',
+                '[]', '[{"jsonrpc": "2.0", "method"', '{"jsonrpc": ']:
+            self.assertEqual(self.exec_handler(self.MyTestHandler, req),
+                             self.exec_handler(BufferedHandler, req))
+
+    def testPipelining(self):
+        """Calls are executed while the response is consumed."""
+        status, body = self.MyTestHandler().dispatch(
+            json_rpc_stream.BodyStream(StringIO.StringIO(
+                '[{"jsonrpc": "2.0", "method": "echo", "params": [1], "id": 1},'
+                ' {"jsonrpc": "2.0", "method": "echo", "params": [2], "id": 2}]'),
+                1000))
+        self.assertEqual(status, 200)
+        self.assertEqual(self.MyTestHandler.calls, [1])
+        self.assertEqual(body.next(), '[{"jsonrpc": "2.0", "result": 1, "id": 1}')
+        self.assertEqual(self.MyTestHandler.calls, [1])
+        self.assertEqual(list(body), [
+            ', {"jsonrpc": "2.0", "result": 2, "id": 2}', ']'])
+        self.assertEqual(self.MyTestHandler.calls, [1, 2])
+
+    def testMalformedBatch(self):
+        """Malformed JSON after the first call ends the response."""
+        status, body = self.exec_handler(
+            self.MyTestHandler,
+            '[{"jsonrpc": "2.0", "method": "echo", "params": [1], "id": 1},'
+            ' {"jsonrpc": "2.0", "method": "echo", "params": [2], "id": 2}'
+            ' {"jsonrpc": "2.0", "method": "echo", "params": [3], "id": 3}]')
+        self.assertEqual(status, 200)
+        response = simplejson.loads(body)
+        self.assertEqual(response[0]['result'], 1)
+        self.assertEqual(response[1]['error']['code'], -32700)
+        self.assertEqual(response[1]['id'], None)
+        self.assertEqual(self.MyTestHandler.calls, [1])
+
+
+class StreamedResultTestCase(unittest.TestCase):
+    """Tests for streaming iterator results."""
+    class MyTestHandler(JsonRpcHandler):
+        produced = []
+        @ServiceMethod(safe=True)
+        def count(self, n):
+            for i in range(n):
+                self.produced.append(i)
+                yield {'i': i}
+        @ServiceMethod
+        def page(self, n):
+            return Page(iter(range(n)), lambda: n < 3 and 'next' or None)
+        @ServiceMethod
+        def fail(self):
+            yield 1
+            raise ValueError('boom')
+
+    def setUp(self):
+        self.MyTestHandler.produced = []
+
+    def call(self, method, params, handler_class=None, **options):
+        h = (handler_class or self.MyTestHandler)()
+        for name, value in options.items():
+            setattr(h, name, value)
+        return h.dispatch(simplejson.dumps(
+            {'jsonrpc': '2.0', 'method': method, 'params': params, 'id': 1}))
+
+    def testStreamedResult(self):
+        """Items are encoded while the response is consumed."""
+        status, body = self.call('count', [3])
+        self.assertEqual(status, 200)
+        self.assertEqual(self.MyTestHandler.produced, [])
+        self.assertEqual(body.next(), '{"jsonrpc": "2.0", "result": ')
+        self.assertEqual(body.next(), '[{"i": 0}')
+        self.assertEqual(self.MyTestHandler.produced, [0])
+        self.assertEqual(''.join(body), ', {"i": 1}, {"i": 2}], "id": 1}')
+        self.assertEqual(''.join(self.call('count', [0])[1]),
+                         '{"jsonrpc": "2.0", "result": [], "id": 1}')
+
+    def testEquivalence(self):
+        """Streamed results encode like lists, also within batches."""
+        expected = simplejson.dumps(
+            {'jsonrpc': '2.0', 'result': [{'i': 0}, {'i': 1}], 'id': 1})
+        self.assertEqual(''.join(self.call('count', [2])[1]), expected)
+        for options in ({}, {'stream_batches': True},
+                        {'deduplicate_batches': True}):
+            h = self.MyTestHandler()
+            for name, value in options.items():
+                setattr(h, name, value)
+            status, body = h.dispatch(simplejson.dumps(
+                [{'jsonrpc': '2.0', 'method': 'count', 'params': [2],
+                  'id': 1},
+                 {'jsonrpc': '2.0', 'method': 'count', 'params': [2],
+                  'id': 1}]))
+            self.assertEqual(''.join(body), '[%s, %s]' % (expected, expected))
+
+    def testPage(self):
+        """Pages are encoded as items and the cursor of the next page."""
+        status, body = self.call('page', [2])
+        self.assertEqual(simplejson.loads(''.join(body))['result'],
+                         {'items': [0, 1], 'cursor': 'next'})
+        status, body = self.call('page', [3])
+        self.assertEqual(simplejson.loads(''.join(body))['result'],
+                         {'items': [0, 1, 2], 'cursor': None})
+
+    def testGetRequest(self):
+        """GET responses are joined to compute their ETag."""
+        status, body, headers = self.MyTestHandler().dispatch_get(
+            'method=count&params=%5B1%5D&id=1')
+        self.assertEqual(body, ['{"jsonrpc": "2.0", "result": [{"i": 0}], '
+                                '"id": 1}'])
+        self.assertEqual(headers[0][0], 'ETag')
+
+    def testErrorAbortsResponse(self):
+        """Errors of the iterator propagate while the response is written."""
+        status, body = self.call('fail', [])
+        self.assertEqual(status, 200)
+        self.assertRaises(ValueError, list, body)
+
+
+class UserService(Service):
+    created = 0
+    def __init__(self, dispatcher):
+        Service.__init__(self, dispatcher)
+        UserService.created += 1
+    @ServiceMethod(safe=True)
+    def get(self, user_id):
+        return {'id': user_id}
+
+
+class DataService(Service):
+    services = {'users': UserService}
+    @ServiceMethod(name='fetch')
+    def fetch_data(self, key):
+        return [key, self.dispatcher.__class__.__name__]
+
+
+class ServiceRouterTestCase(unittest.TestCase):
+    """Tests for mounting services under namespaces."""
+    class Router(Dispatcher):
+        services = {'users': UserService, 'data': DataService}
+        @ServiceMethod
+        def echo(self, value):
+            return value
+
+    def setUp(self):
+        UserService.created = 0
+
+    def testDispatchTable(self):
+        """Mounted methods are compiled into one flat table."""
+        self.assertEqual(
+            sorted(self.Router.dispatch_table),
+            ['data.fetch', 'data.users.get', 'echo', 'rpc.profile',
+             'rpc.stats', 'users.get'])
+        self.assertEqual(self.Router.dispatch_table['users.get'],
+                         (UserService.get.im_func, UserService))
+        self.assertEqual(
+            self.Router.dispatch_table['data.users.get'][1], UserService)
+        self.assertEqual(self.Router.dispatch_table['echo'][1], None)
+        self.assertEqual(sorted(self.Router.service_methods),
+                         sorted(self.Router.dispatch_table))
+
+    def testBatchSpanningServices(self):
+        """One batch calls methods of several services."""
+        status, body = self.Router().dispatch(simplejson.dumps([
+            {'jsonrpc': '2.0', 'method': 'users.get', 'params': [1], 'id': 1},
+            {'jsonrpc': '2.0', 'method': 'data.fetch', 'params': ['k'],
+             'id': 2},
+            {'jsonrpc': '2.0', 'method': 'echo', 'params': ['e'], 'id': 3},
+            {'jsonrpc': '2.0', 'method': 'users.get', 'params': [2], 'id': 4},
+            {'jsonrpc': '2.0', 'method': 'data.users.get', 'params': [3],
+             'id': 5},
+            {'jsonrpc': '2.0', 'method': 'users.missing', 'id': 6}]))
+        responses = simplejson.loads(''.join(body))
+        self.assertEqual([r.get('result') for r in responses],
+                         [{'id': 1}, ['k', 'Router'], 'e', {'id': 2},
+                          {'id': 3}, None])
+        self.assertEqual(responses[-1]['error']['code'], -32601)
+        # One instance per service and request
+        self.assertEqual(UserService.created, 1)
+
+    def testInvalidMounts(self):
+        """Only services can be mounted, without overlapping names."""
+        def mount(**services):
+            return ServiceMethodRegistry('Router', (Dispatcher,),
+                                         {'services': services})
+        self.assertRaises(TypeError, mount, users=dict)
+        self.assertRaises(ValueError, mount, rpc=type(
+            'RPC', (Service,),
+            {'stats': ServiceMethod(name='stats')(lambda self: 1)}))
+
+
+class DeduplicationTestCase(unittest.TestCase):
+    """Tests for executing equal calls within a batch only once."""
+    class MyTestHandler(JsonRpcHandler):
+        deduplicate_batches = True
+        stream_batches = True
+        @ServiceMethod(safe=True)
+        def data(self, key_name):
+            self.calls.append(key_name)
+            return [key_name]
+        @ServiceMethod
+        def update(self, key_name):
+            self.calls.append(key_name)
+            return [key_name]
+
+    def exec_handler(self, handler_class, body):
+        h = handler_class()
+        h.calls = []
+        h.request = Request.blank('/rpc/')
+        h.response = Response()
+        h.request.body = body
+        h.post()
+        return h.calls, simplejson.loads(h.response.out.getvalue())
+
+    def testDeduplicatedBatch(self):
+        """Equal calls of safe methods are executed once."""
+        class ThreadedHandler(self.MyTestHandler):
+            batch_executor = ThreadedBatchExecutor()
+        req = '''[{"jsonrpc": "2.0", "method": "data", "params": ["a"], "id": 1},
+                  {"jsonrpc": "2.0", "method": "data", "params": ["b"], "id": 2},
+                  {"jsonrpc": "2.0", "method": "data", "params": {"key_name": "a"}, "id": 3},
+                  {"jsonrpc": "2.0", "method": "data", "params": ["a"]},
+                  {"jsonrpc": "2.0", "method": "data", "params": ["a", "b"], "id": 4},
+                  {"jsonrpc": "2.0", "method": "update", "params": ["a"], "id": 5},
+                  {"jsonrpc": "2.0", "method": "update", "params": ["a"], "id": 6},
+                  {"jsonrpc": "2.0", "method": "data", "params": ["a"], "id": 7}
+                 ]'''
+        for handler_class in (self.MyTestHandler, ThreadedHandler):
+            calls, resp = self.exec_handler(handler_class, req)
+            self.assertEqual(sorted(calls), ['a', 'a', 'a', 'b'])
+            self.assertEqual([r['id'] for r in resp], [1, 2, 3, 4, 5, 6, 7])
+            self.assertEqual(resp[0]['result'], ['a'])
+            self.assertEqual(resp[2]['result'], ['a'])
+            self.assertEqual(resp[3]['error']['code'], -32602)
+            self.assertEqual(resp[6]['result'], ['a'])
+
+    def testBinaryParams(self):
+        """Calls with params not encodable as JSON are not deduplicated."""
+        codec = json_rpc_msgpack.get_codec()
+        h = self.MyTestHandler()
+        h.calls = []
+        # Binary data is sent in the bin format
+        body = codec.dumps(
+            [{'jsonrpc': '2.0', 'method': 'data', 'params': [u'@@'],
+              'id': i} for i in range(2)]).replace('\xa2@@', '\xc4\x02\xff\xfe')
+        status, body = h.dispatch(body, codecs=(codec, codec))
+        self.assertEqual(status, 200)
+        ''.join(body)
+        self.assertEqual(h.calls, ['\xff\xfe'] * 2)
+
+    def testDisabled(self):
+        """Deduplication is opt-in."""
+        class PlainHandler(self.MyTestHandler):
+            deduplicate_batches = False
+        req = '''[{"jsonrpc": "2.0", "method": "data", "params": ["a"], "id": 1},
+                  {"jsonrpc": "2.0", "method": "data", "params": ["a"], "id": 2}
+                 ]'''
+        calls, resp = self.exec_handler(PlainHandler, req)
+        self.assertEqual(calls, ['a', 'a'])
+
+
+class LoggingPolicyTestCase(unittest.TestCase):
+    """Tests for logging request bodies and tracebacks lazily."""
+    class MyTestHandler(JsonRpcHandler):
+        log_body_limit = 20
+        @ServiceMethod
+        def broken(self):
+            raise ValueError('broken')
+
+    class ListHandler(logging.Handler):
+        def __init__(self):
+            logging.Handler.__init__(self)
+            self.records = []
+        def emit(self, record):
+            self.records.append(record.getMessage())
+
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.level = self.logger.level
+        self.records = self.ListHandler()
+        self.logger.addHandler(self.records)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.records)
+        self.logger.setLevel(self.level)
+
+    def exec_handler(self, handler_class, body):
+        h = handler_class()
+        h.request = Request.blank('/rpc/')
+        h.response = Response()
+        h.request.body = body
+        h.post()
+        return simplejson.loads(h.response.out.getvalue() or 'null')
+
+    def testTruncatedBody(self):
+        """Logged bodies are truncated."""
+        self.logger.setLevel(logging.DEBUG)
+        body = '{"jsonrpc": "2.0", "method": "broken", "id": 1}'
+        self.exec_handler(self.MyTestHandler, body)
+        self.assertTrue('Raw JSON-RPC (20 of %i bytes): %s' %
+                        (len(body), body[:20]) in self.records.records)
+        self.assertTrue([r for r in self.records.records
+                         if r.startswith('Traceback')])
+
+    def testNoDebugLogging(self):
+        """Neither bodies nor tracebacks are formatted without debug level."""
+        class SampledHandler(self.MyTestHandler):
+            log_body_sample_rate = 0.0
+        self.logger.setLevel(logging.DEBUG)
+        self.exec_handler(SampledHandler, '{"jsonrpc": "2.0", "method": "x"}')
+        self.assertFalse([r for r in self.records.records
+                          if r.startswith('Raw JSON-RPC')])
+        self.logger.setLevel(logging.INFO)
+        h = self.MyTestHandler()
+        msg = JsonRpcMessage({"jsonrpc": "2.0", "method": "broken", "id": 1})
+        h.handle_message(msg)
+        self.assertEqual(msg.error.exc_info, None)
+        self.assertEqual(msg.error.data, None)
+        self.assertFalse([r for r in self.records.records
+                          if r.startswith('Traceback')])
+
+    def testIncludeTracebacks(self):
+        """Tracebacks are returned for calls but not kept for notifications."""
+        class DebugHandler(self.MyTestHandler):
+            include_tracebacks = True
+        self.logger.setLevel(logging.INFO)
+        resp = self.exec_handler(
+            DebugHandler, '{"jsonrpc": "2.0", "method": "broken", "id": 1}')
+        self.assertTrue(resp['error']['data'].startswith('Traceback'))
+        self.assertTrue('ValueError: broken' in resp['error']['data'])
+        h = DebugHandler()
+        msg = JsonRpcMessage({"jsonrpc": "2.0", "method": "broken"})
+        h.handle_message(msg)
+        self.assertEqual(msg.error.data, None)
+
+
+class FakeRPC(object):
+    """A future logging when it is started and waited for."""
+
+    def __init__(self, log, value, error=None):
+        self.log = log
+        self.value = value
+        self.error = error
+        log.append(('start', value))
+
+    def get_result(self):
+        self.log.append(('wait', self.value))
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class AsyncServiceMethodTestCase(unittest.TestCase):
+    """Tests for service methods returning futures and coroutines."""
+    class MyService(Dispatcher):
+        @ServiceMethod
+        def lookup(self, key):
+            return FakeRPC(self.log, key)
+        @ServiceMethod(coroutine=True)
+        def pair(self, key):
+            first = yield FakeRPC(self.log, key)
+            second, third = yield [FakeRPC(self.log, key + 1),
+                                   self.lookup(key + 2)]
+            raise Return([first, second, third])
+        @ServiceMethod(coroutine=True)
+        def nested(self, key):
+            result = yield self.pair(key)
+            raise Return(sum(result))
+        @ServiceMethod(coroutine=True)
+        def recover(self):
+            try:
+                yield FakeRPC(self.log, 0, ValueError('lost'))
+            except ValueError, ex:
+                raise Return(str(ex))
+        @ServiceMethod(coroutine=True)
+        def broken(self):
+            yield FakeRPC(self.log, 0)
+            raise ValueError('broken')
+        @ServiceMethod
+        def echo(self, value):
+            return value
+
+    def dispatch(self, service, body):
+        service.log = []
+        status, chunks = service.dispatch(simplejson.dumps(body))
+        return status, simplejson.loads(''.join(chunks))
+
+    def testBatchOfFutures(self):
+        """All calls of a batch are started before any is waited for."""
+        service = self.MyService()
+        status, resp = self.dispatch(service, [
+            {"jsonrpc": "2.0", "method": "echo", "params": [0], "id": 0}] + [
+            {"jsonrpc": "2.0", "method": "lookup", "params": [i], "id": i}
+            for i in range(1, 4)])
+        self.assertEqual(status, 200)
+        self.assertEqual([r['result'] for r in resp], [0, 1, 2, 3])
+        self.assertEqual(service.log, [
+            ('start', 1), ('start', 2), ('start', 3),
+            ('wait', 1), ('wait', 2), ('wait', 3)])
+
+    def testCoroutines(self):
+        """Coroutines are resumed in turns."""
+        service = self.MyService()
+        status, resp = self.dispatch(service, [
+            {"jsonrpc": "2.0", "method": "pair", "params": [10], "id": 1},
+            {"jsonrpc": "2.0", "method": "pair", "params": [20], "id": 2}])
+        self.assertEqual([r['result'] for r in resp],
+                         [[10, 11, 12], [20, 21, 22]])
+        self.assertEqual(service.log[:8], [
+            ('start', 10), ('start', 20),
+            ('wait', 10), ('start', 11), ('start', 12),
+            ('wait', 20), ('start', 21), ('start', 22)])
+        status, resp = self.dispatch(self.MyService(),
+            {"jsonrpc": "2.0", "method": "nested", "params": [1], "id": 1})
+        self.assertEqual((status, resp['result']), (200, 6))
+
+    def testErrors(self):
+        """Exceptions are raised inside the coroutine or answered as errors."""
+        status, resp = self.dispatch(self.MyService(), [
+            {"jsonrpc": "2.0", "method": "recover", "id": 1},
+            {"jsonrpc": "2.0", "method": "broken", "id": 2},
+            {"jsonrpc": "2.0", "method": "broken"}])
+        self.assertEqual(resp[0]['result'], 'lost')
+        self.assertEqual(resp[1]['error']['code'], -32603)
+        self.assertEqual(len(resp), 2)
+        status, resp = self.dispatch(self.MyService(),
+            {"jsonrpc": "2.0", "method": "broken", "id": 1})
+        self.assertEqual((status, resp['error']['code']), (500, -32603))
+
+    def testNotification(self):
+        """Tasks of notifications are finished too."""
+        service = self.MyService()
+        service.log = []
+        status, body = service.dispatch(
+            '{"jsonrpc": "2.0", "method": "lookup", "params": [1]}')
+        self.assertEqual((status, list(body)), (204, []))
+        self.assertEqual(service.log, [('start', 1), ('wait', 1)])
+
+
+class HttpGetTestCase(unittest.TestCase):
+    """Tests for calling safe methods with HTTP GET."""
+    class MyTestHandler(JsonRpcHandler):
+        allow_get = True
+        compression_threshold = None
+        @ServiceMethod(safe=True, cache_control='public, max-age=60')
+        def data(self, key_name, count):
+            return [key_name] * count
+        @ServiceMethod(safe=True)
+        def test(self, message):
+            return message
+        @ServiceMethod
+        def update(self, key_name):
+            return key_name
+
+    def exec_handler(self, handler_class, query, **headers):
+        h = handler_class()
+        h.request = Request.blank('/rpc?' + query, headers=headers)
+        h.response = Response()
+        h.get()
+        return h.response
+
+    def testGet(self):
+        """Safe methods are called with the params in the query string."""
+        response = self.exec_handler(
+            self.MyTestHandler, 'method=data&params=%5B%22a%22%2C%202%5D&id=3')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.out.getvalue(),
+                         '{"jsonrpc": "2.0", "result": ["a", "a"], "id": 3}')
+        self.assertEqual(response.headers['Cache-Control'],
+                         'public, max-age=60')
+        etag = response.headers['ETag']
+        self.assertTrue(etag.startswith('W/"'))
+        response = self.exec_handler(
+            self.MyTestHandler,
+            'method=data&params=eyJrZXlfbmFtZSI6ICJhIiwgImNvdW50IjogMn0&id=3'
+            '&_=12345', **{'If-None-Match': '"foo", ' + etag})
+        self.assertEqual(response.status, 304)
+        self.assertEqual(response.out.getvalue(), '')
+        self.assertEqual(response.headers['ETag'], etag)
+        response = self.exec_handler(
+            self.MyTestHandler, 'method=test&params=["b"]&id=abc')
+        self.assertEqual(simplejson.loads(response.out.getvalue()),
+                         {"jsonrpc": "2.0", "result": "b", "id": "abc"})
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def testErrors(self):
+        """Unsafe methods and invalid queries are answered with errors."""
+        for query, status, code in [
+                ('method=update&params=["a"]&id=1', 405, -32600),
+                ('method=missing&id=1', 404, -32601),
+                ('method=test&params=[&id=1', 500, -32700),
+                ('method=test&method=data&id=1', 400, -32600),
+                ('params=["a"]&id=1', 400, -32600)]:
+            response = self.exec_handler(self.MyTestHandler, query)
+            self.assertEqual(response.status, status)
+            self.assertEqual(
+                simplejson.loads(response.out.getvalue())['error']['code'],
+                code)
+            self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+            self.assertFalse('ETag' in response.headers)
+
+        class PostOnlyHandler(self.MyTestHandler):
+            allow_get = False
+        response = self.exec_handler(PostOnlyHandler, 'method=test&id=1')
+        self.assertEqual(response.status, 405)
+        self.assertEqual(response.headers['Allow'], 'POST')
+
+    def testWSGIApplication(self):
+        """The WSGI application answers GET requests, too."""
+        app = webtest.TestApp(JsonRpcApplication(self.MyTestHandler))
+        response = app.get('/rpc?method=test&params=[1]&id=1')
+        self.assertEqual(response.body, '{"jsonrpc": "2.0", "result": 1, "id": 1}')
+        response = app.get('/rpc?method=test&params=[1]&id=1', headers={
+            'If-None-Match': response.headers['ETag']}, status=304)
+        app.put('/rpc', status=405)
+
+    def testVary(self):
+        """Responses vary with the Accept header if MessagePack is offered."""
+        response = self.exec_handler(
+            self.MyTestHandler, 'method=test&params=[1]&id=1')
+        self.assertEqual(response.headers['Vary'], 'Accept')
+        app = webtest.TestApp(JsonRpcApplication(self.MyTestHandler))
+        response = app.get('/rpc?method=test&params=[1]&id=1',
+                           headers={'Accept': 'application/msgpack'})
+        self.assertEqual(response.headers['Vary'], 'Accept')
+        class JsonOnlyHandler(self.MyTestHandler):
+            binary_content_types = ()
+        response = self.exec_handler(
+            JsonOnlyHandler, 'method=test&params=[1]&id=1')
+        self.assertFalse('Vary' in response.headers)
+        JsonOnlyHandler.compression_threshold = 1024
+        response = self.exec_handler(
+            JsonOnlyHandler, 'method=test&params=[1]&id=1')
+        self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+
+
+class DispatcherTestCase(unittest.TestCase):
+    """Tests for the framework independent dispatcher."""
+    class MyService(Dispatcher):
+        @ServiceMethod
+        def subtract(self, minuend, subtrahend):
+            return minuend - subtrahend
+
+    def testDispatch(self):
+        """Dispatching returns the status and the encoded body."""
+        status, body = self.MyService().dispatch(
+            '{"jsonrpc": "2.0", "method": "subtract", "params": [42, 23], "id": 1}')
+        self.assertEqual(status, 200)
+        self.assertEqual(list(body), ['{"jsonrpc": "2.0", "result": 19, "id": 1}'])
+        status, body = self.MyService().dispatch('{"jsonrpc": "2.0", "method"')
+        self.assertEqual(status, 500)
+        self.assertEqual(simplejson.loads(''.join(body))['error']['code'], -32700)
+        status, body = self.MyService().dispatch(
+            '{"jsonrpc": "2.0", "method": "subtract", "params": [42, 23]}')
+        self.assertEqual((status, list(body)), (204, []))
+
+    def testStreamedDispatch(self):
+        """Streamed batches are executed while the body is consumed."""
+        class StreamingService(self.MyService):
+            stream_batches = True
+        status, body = StreamingService().dispatch(
+            '[{"jsonrpc": "2.0", "method": "subtract", "params": [2, 1], "id": 1},'
+            ' {"jsonrpc": "2.0", "method": "subtract", "params": [3, 1], "id": 2}]')
+        self.assertEqual(status, 200)
+        self.assertEqual(list(body), [
+            '[{"jsonrpc": "2.0", "result": 1, "id": 1}',
+            ', {"jsonrpc": "2.0", "result": 2, "id": 2}',
+            ']'])
+
+    def testWarmUp(self):
+        """Warming up selects the codecs."""
+        json_rpc_codecs.unregister_backend('none')
+        self.assertEqual(json_rpc_codecs._default, None)
+        self.MyService.warm_up()
+        self.assertTrue(json_rpc_codecs._default is not None)
+
+    def testWSGIApplication(self):
+        """Dispatchers are served as plain WSGI applications."""
+        app = webtest.TestApp(JsonRpcApplication(self.MyService))
+        response = app.post(
+            '/rpc',
+            '{"jsonrpc": "2.0", "method": "subtract", "params": [42, 23], "id": 1}')
+        self.assertEqual(response.status, '200 OK')
+        self.assertEqual(response.headers['Content-Type'], 'application/json-rpc')
+        self.assertEqual(response.body, '{"jsonrpc": "2.0", "result": 19, "id": 1}')
+        response = app.post(
+            '/rpc', '{"jsonrpc": "2.0", "method": "foo", "id": 1}', status=404)
+        self.assertEqual(
+            simplejson.loads(response.body)['error']['code'], -32601)
+        response = app.post(
+            '/rpc', '{"jsonrpc": "2.0", "method": "subtract", "params": [1, 1]}',
+            status=204)
+        self.assertEqual(response.body, '')
+        app.get('/rpc', status=405)
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for the admission control."""
+
+from jsongae.json_rpc import *
+from jsongae.json_rpc_admission import *
+from jsongae.json_rpc_cache import FakeMemcacheClient
+from jsongae.tests.test_json_rpc_cache import Clock
+from google.appengine.ext.webapp import Request, Response
+import StringIO
+import simplejson
+import unittest
+
+
+class RateStoreTestCase(unittest.TestCase):
+    """Tests for the token bucket stores."""
+
+    def testLocalRateStore(self):
+        """Buckets hold burst tokens and are refilled at the rate."""
+        clock = Clock()
+        store = LocalRateStore(clock=clock)
+        self.assertEqual([store.consume('a', 2, 3) for i in range(4)],
+                         [True, True, True, False])
+        self.assertTrue(store.consume('b', 2, 3))
+        clock.now += 0.5
+        self.assertEqual([store.consume('a', 2, 3) for i in range(2)],
+                         [True, False])
+        clock.now += 10
+        self.assertEqual([store.consume('a', 2, 3) for i in range(4)],
+                         [True, True, True, False])
+
+    def testPrune(self):
+        """Idle buckets are dropped once the store is full."""
+        clock = Clock()
+        store = LocalRateStore(max_size=2, clock=clock)
+        store.consume('a', 1, 1)
+        store.consume('b', 1, 1)
+        clock.now += 60
+        store.consume('c', 1, 1)
+        self.assertEqual(len(store), 1)
+        store.clear()
+        self.assertEqual(len(store), 0)
+
+    def testMaxSize(self):
+        """The least recently used buckets are evicted beyond max_size."""
+        clock = Clock()
+        store = LocalRateStore(max_size=10, clock=clock)
+        for i in range(100):
+            clock.now += 0.1
+            store.consume(str(i), 1, 1)
+            self.assertTrue(len(store) <= 10)
+        self.assertFalse(store.consume('99', 1, 1))
+
+    def testMemcacheRateStore(self):
+        """Shared buckets admit burst calls per window."""
+        clock = Clock()
+        store = MemcacheRateStore(FakeMemcacheClient(clock), clock)
+        self.assertEqual([store.consume('a', 1, 2) for i in range(3)],
+                         [True, True, False])
+        self.assertTrue(store.consume('b', 1, 2))
+        clock.now += 2
+        self.assertTrue(store.consume('a', 1, 2))
+
+
+class AdmissionTestCase(unittest.TestCase):
+    """Tests for admission control of requests and calls."""
+
+    def setUp(self):
+        clock = self.clock = Clock()
+
+        class MyTestHandler(JsonRpcHandler):
+            admission = AdmissionControl(
+                max_body_size=200, max_batch_size=3,
+                rate_limits={'limited': (1, 2), None: (10, 10)},
+                max_concurrent_requests=1,
+                store=LocalRateStore(clock=clock))
+            @ServiceMethod
+            def limited(self):
+                return 'limited'
+            @ServiceMethod
+            def other(self):
+                return 'other'
+        self.handler_class = MyTestHandler
+
+    def post(self, body, remote_addr='10.0.0.1'):
+        h = self.handler_class()
+        h.request = Request.blank(
+            '/rpc', environ={'REMOTE_ADDR': remote_addr})
+        h.request.body = body
+        h.response = Response()
+        h.post()
+        return h.response.status, simplejson.loads(h.response.out.getvalue())
+
+    def call(self, method, message_id=1):
+        return simplejson.dumps(
+            {"jsonrpc": "2.0", "method": method, "id": message_id})
+
+    def testBodySize(self):
+        """Oversized bodies are rejected before they are decoded."""
+        status, response = self.post('[' + ' ' * 200 + ']')
+        self.assertEqual(status, 413)
+        self.assertEqual(response['error']['code'], -32002)
+
+    def testBatchSize(self):
+        """Batches with too many calls are rejected as a whole."""
+        batch = '[%s]' % ', '.join([self.call('other', i) for i in range(4)])
+        status, response = self.post(batch)
+        self.assertEqual(status, 413)
+        self.assertEqual(response['error']['code'], -32002)
+        batch = '[%s]' % ', '.join([self.call('other', i) for i in range(3)])
+        status, response = self.post(batch)
+        self.assertEqual([r['result'] for r in response], ['other'] * 3)
+
+    def testRateLimits(self):
+        """Calls exceeding the limit of their client and method fail."""
+        batch = '[%s]' % ', '.join(
+            [self.call('limited', i) for i in range(3)])
+        status, response = self.post(batch)
+        self.assertEqual(status, 200)
+        self.assertEqual(response[0]['result'], 'limited')
+        self.assertEqual(response[1]['result'], 'limited')
+        self.assertEqual(response[2]['error']['code'], -32003)
+        status, response = self.post(self.call('limited'))
+        self.assertEqual(status, 429)
+        self.assertEqual(self.post(self.call('other'))[1]['result'], 'other')
+        status, response = self.post(self.call('limited'), '10.0.0.2')
+        self.assertEqual(response['result'], 'limited')
+        # Unknown methods share the bucket of the default limit
+        store = self.handler_class.admission.store
+        size = len(store)
+        for i in range(20):
+            self.post(self.call('missing%i' % i), '10.0.0.3')
+        self.assertEqual(len(store), size + 1)
+        status, response = self.post(self.call('missing'), '10.0.0.3')
+        self.assertEqual(response['error']['code'], -32003)
+        self.clock.now += 1
+        status, response = self.post(self.call('limited'))
+        self.assertEqual(response['result'], 'limited')
+
+    def testConcurrency(self):
+        """Requests are rejected while the maximum is being handled."""
+        admission = self.handler_class.admission
+        self.assertTrue(admission.enter())
+        status, response = self.post(self.call('other'))
+        self.assertEqual(status, 503)
+        self.assertEqual(response['error']['code'], -32004)
+        admission.leave()
+        self.assertEqual(self.post(self.call('other'))[0], 200)
+        self.assertEqual(admission.active, 0)
+
+    def testStreamedBatch(self):
+        """Streamed batches are counted until they are consumed."""
+        dispatcher = self.handler_class()
+        dispatcher.stream_batches = True
+        batch = '[%s]' % ', '.join([self.call('other', i) for i in range(2)])
+        status, body = dispatcher.dispatch(batch)
+        self.assertEqual(dispatcher.admission.active, 1)
+        self.assertEqual(len(simplejson.loads(''.join(body))), 2)
+        self.assertEqual(dispatcher.admission.active, 0)
+
+    def testClosedStreamedBatch(self):
+        """Closing a streamed batch before it is consumed releases the slot."""
+        batch = '[%s]' % ', '.join([self.call('other', i) for i in range(2)])
+        for accept_encoding in (None, 'gzip'):
+            dispatcher = self.handler_class()
+            dispatcher.stream_batches = True
+            dispatcher.compression_threshold = 1
+            status, body = dispatcher.dispatch(batch)
+            self.assertEqual(dispatcher.admission.active, 1)
+            coding, body = dispatcher.compress_response(body, accept_encoding)
+            body.close()
+            self.assertEqual(dispatcher.admission.active, 0)
+            self.assertEqual(self.post(self.call('other'))[0], 200)
+
+    def testWSGIApplication(self):
+        """The WSGI application rejects oversized bodies without reading."""
+        started = []
+        def start_response(status, headers):
+            started.append(status)
+        class Input(object):
+            def read(self, size):
+                raise AssertionError('Body was read')
+        application = JsonRpcApplication(self.handler_class)
+        body = application({'REQUEST_METHOD': 'POST', 'CONTENT_LENGTH': '201',
+                            'REMOTE_ADDR': '10.0.0.1',
+                            'wsgi.input': Input()}, start_response)
+        self.assertEqual(started, ['413 Request Entity Too Large'])
+        self.assertEqual(simplejson.loads(''.join(body))['error']['code'],
+                         -32002)
+        for i in range(2):
+            body = self.call('limited')
+            application({'REQUEST_METHOD': 'POST',
+                         'CONTENT_LENGTH': str(len(body)),
+                         'REMOTE_ADDR': '10.0.0.1',
+                         'wsgi.input': StringIO.StringIO(body)},
+                        start_response)
+        body = application({'REQUEST_METHOD': 'POST',
+                            'CONTENT_LENGTH': str(len(body)),
+                            'REMOTE_ADDR': '10.0.0.1',
+                            'wsgi.input': StringIO.StringIO(body)},
+                           start_response)
+        self.assertEqual(started[-1], '429 Too Many Requests')
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for the result cache."""
+
+from jsongae.json_rpc import *
+from jsongae.json_rpc_cache import *
+from google.appengine.ext.webapp import Request, Response
+import simplejson
+import unittest
+
+
+class Clock(object):
+    """A clock advanced by hand."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class LocalCacheTestCase(unittest.TestCase):
+    """Tests for the in-process cache backend."""
+
+    def testLRU(self):
+        """Least recently used entries are evicted first."""
+        cache = LocalCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        cache.set('a', 4)
+        cache.set('d', 5)
+        self.assertEqual(cache.get('a'), 4)
+        self.assertEqual(cache.get('c'), None)
+        cache.delete('a')
+        self.assertEqual(cache.get('a'), None)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def testTTL(self):
+        """Entries expire."""
+        clock = Clock()
+        cache = LocalCache(clock=clock)
+        cache.set('a', 1, ttl=10)
+        cache.set('b', 2)
+        clock.now += 10
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('b'), 2)
+        self.assertEqual(len(cache), 1)
+
+
+class ResultCacheTestCase(unittest.TestCase):
+    """Tests for caching results of service methods."""
+
+    def setUp(self):
+        self.clock = clock = Clock()
+        self.memcache = memcache = FakeMemcacheClient(clock=clock)
+
+        class MyTestHandler(JsonRpcHandler):
+            calls = []
+            @ServiceMethod(cache=ResultCache(
+                ttl=30, backend=LocalCache(clock=clock)))
+            def data(self, key_name, version):
+                self.calls.append((key_name, version))
+                return {'key_name': key_name, 'version': version}
+            @ServiceMethod(cache=ResultCache(
+                ttl=30, backend=MemcacheCache(memcache)))
+            def shared(self, key_name):
+                self.calls.append(key_name)
+                return key_name
+            @ServiceMethod(cache=ResultCache())
+            def broken(self):
+                self.calls.append('broken')
+                raise ValueError
+            @ServiceMethod(cache=ResultCache())
+            def items(self, count):
+                self.calls.append(count)
+                return iter(range(count))
+        self.handler_class = MyTestHandler
+
+    def call(self, method, params):
+        h = self.handler_class()
+        h.request = Request.blank('/rpc/')
+        h.response = Response()
+        h.request.body = simplejson.dumps(
+            {"jsonrpc": "2.0", "method": method, "params": params, "id": 1})
+        h.post()
+        return simplejson.loads(h.response.out.getvalue())
+
+    def testCachedResult(self):
+        """Positional and named calls share cached results."""
+        calls = self.handler_class.calls
+        resp = self.call('data', ['foo', 1])
+        self.assertEqual(resp['result'], {'key_name': 'foo', 'version': 1})
+        self.assertEqual(
+            self.call('data', {'version': 1, 'key_name': 'foo'}), resp)
+        self.assertEqual(calls, [('foo', 1)])
+        self.call('data', ['foo', 2])
+        self.assertEqual(len(calls), 2)
+        self.clock.now += 30
+        self.call('data', ['foo', 1])
+        self.assertEqual(len(calls), 3)
+
+    def testInvalidate(self):
+        """Cached results can be invalidated explicitly."""
+        calls = self.handler_class.calls
+        self.call('data', ['foo', 1])
+        self.handler_class.invalidate_cache('data', 'foo', 1)
+        self.call('data', ['foo', 1])
+        self.handler_class.invalidate_cache('data', key_name='foo', version=1)
+        self.call('data', ['foo', 1])
+        self.assertEqual(len(calls), 3)
+        self.assertRaises(
+            ValueError, self.handler_class.invalidate_cache, 'missing')
+
+    def testStreamedResult(self):
+        """Iterator results are not cached."""
+        self.assertEqual(self.call('items', [2])['result'], [0, 1])
+        self.assertEqual(self.call('items', [2])['result'], [0, 1])
+        self.assertEqual(self.handler_class.calls, [2, 2])
+
+    def testMemcacheBackend(self):
+        """Results are cached in memcache."""
+        calls = self.handler_class.calls
+        self.assertEqual(self.call('shared', ['foo'])['result'], 'foo')
+        self.assertEqual(self.call('shared', ['foo'])['result'], 'foo')
+        self.assertEqual(calls, ['foo'])
+        self.handler_class.invalidate_cache('shared', 'foo')
+        self.call('shared', ['foo'])
+        self.assertEqual(len(calls), 2)
+        self.clock.now += 30
+        self.call('shared', ['foo'])
+        self.assertEqual(len(calls), 3)
+        cache = self.handler_class.shared.service_spec.cache
+        self.assertRaises(ValueError, cache.clear)
+        self.assertEqual(self.call('shared', ['foo'])['result'], 'foo')
+        self.assertEqual(len(calls), 3)
+
+    def testNoneResult(self):
+        """None is a result, too."""
+        cache = self.handler_class.shared.service_spec.cache
+        key = cache.key(['bar'])
+        self.assertEqual(cache.get(key), None)
+        cache.set(key, None)
+        self.assertEqual(cache.get(key), (None,))
+
+    def testErrorsNotCached(self):
+        """Errors and invalid calls are not cached."""
+        calls = self.handler_class.calls
+        self.call('broken', [])
+        resp = self.call('broken', [])
+        self.assertEqual(resp['error']['code'], -32603)
+        self.assertEqual(calls, ['broken', 'broken'])
+        resp = self.call('data', ['foo'])
+        self.assertEqual(resp['error']['code'], -32602)
+
+    def testBindOnce(self):
+        """A cache serves one service method only."""
+        cache = ResultCache()
+        ServiceMethod(cache=cache)(lambda self: None)
+        self.assertRaises(
+            ValueError, ServiceMethod(cache=cache), lambda self: None)
+
+    def testQualifiedKeys(self):
+        """Methods of equal name in different classes have separate keys."""
+        backend = MemcacheCache(self.memcache)
+        class UserService(Service):
+            @ServiceMethod(cache=ResultCache(backend=backend))
+            def get(self, key):
+                return 'user'
+        class DataService(Service):
+            @ServiceMethod(cache=ResultCache(backend=backend))
+            def get(self, key):
+                return 'data'
+        class Router(Dispatcher):
+            services = {'users': UserService, 'data': DataService}
+        for method, result in [('users.get', 'user'), ('data.get', 'data'),
+                               ('users.get', 'user'), ('data.get', 'data')]:
+            status, body = Router().dispatch(simplejson.dumps(
+                {'jsonrpc': '2.0', 'method': method, 'params': [1], 'id': 1}))
+            self.assertEqual(simplejson.loads(''.join(body))['result'],
+                             result)
+        self.assertTrue(UserService.get.service_spec.cache.name.endswith(
+            '.UserService.get'))
+        cache = ResultCache(name='users')
+        class Named(Service):
+            @ServiceMethod(cache=cache)
+            def get(self, key):
+                pass
+        self.assertEqual(cache.prefix, 'jsonrpc:users:')
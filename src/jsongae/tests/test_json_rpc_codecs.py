@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for the JSON codecs."""
+
+from jsongae import json_rpc_codecs
+from jsongae.json_rpc import *
+from google.appengine.ext.webapp import Request, Response
+import simplejson
+import unittest
+
+
+def _compact():
+    def dumps(obj):
+        return simplejson.dumps(obj, separators=(',', ':'))
+    return simplejson.loads, dumps
+
+
+def _lossy():
+    def loads(text):
+        # Decodes like libraries rounding floats and dropping surrogates
+        obj = simplejson.loads(text)
+        if isinstance(obj, list):
+            obj = [isinstance(v, float) and round(v, 15) or v for v in obj]
+        return obj
+    return loads, simplejson.dumps
+
+
+def _missing():
+    import no_such_json_library
+    return no_such_json_library.loads, no_such_json_library.dumps
+
+
+class CodecTestCase(unittest.TestCase):
+    """Tests for selecting JSON codecs."""
+
+    def tearDown(self):
+        json_rpc_codecs.unregister_backend('compact')
+        json_rpc_codecs.unregister_backend('missing')
+        json_rpc_codecs.unregister_backend('lossy')
+
+    def testAvailableBackends(self):
+        """Only importable backends are available."""
+        json_rpc_codecs.register_backend('missing', _missing)
+        backends = json_rpc_codecs.available_backends()
+        self.assertTrue('simplejson' in backends)
+        self.assertFalse('missing' in backends)
+        self.assertRaises(ValueError, json_rpc_codecs.get_codec, 'missing')
+        self.assertRaises(ValueError, json_rpc_codecs.get_codec, 'unknown')
+
+    def testDefaultCodec(self):
+        """The default codec produces the reference wire format."""
+        codec = json_rpc_codecs.get_codec()
+        self.assertTrue(codec is json_rpc_codecs.get_codec())
+        for probe in json_rpc_codecs.PROBES:
+            self.assertEqual(codec.dumps(probe), simplejson.dumps(probe))
+            self.assertEqual(codec.loads(simplejson.dumps(probe)), probe)
+        self.assertRaises(ValueError, codec.loads, '{"jsonrpc": ')
+
+    def testNonConformingEncoder(self):
+        """Backends with a different output are only used for decoding."""
+        json_rpc_codecs.register_backend('compact', _compact)
+        self.assertTrue(json_rpc_codecs.is_conforming('compact', False))
+        self.assertFalse(json_rpc_codecs.is_conforming('compact'))
+        codec = json_rpc_codecs.get_codec()
+        self.assertTrue(codec.name.startswith('compact/'))
+        self.assertEqual(codec.dumps({'id': 1}), '{"id": 1}')
+        codec = json_rpc_codecs.get_codec('compact')
+        self.assertEqual(codec.name, 'compact/simplejson')
+        self.assertEqual(codec.dumps({'id': 1}), '{"id": 1}')
+
+    def testLossyDecoder(self):
+        """Backends decoding values differently are not selected."""
+        json_rpc_codecs.register_backend('lossy', _lossy)
+        self.assertFalse(json_rpc_codecs.is_conforming('lossy', False))
+        self.assertFalse(
+            json_rpc_codecs.get_codec().name.startswith('lossy'))
+        self.assertEqual(json_rpc_codecs.get_codec('lossy').name, 'lossy')
+
+    def testDecodedParams(self):
+        """Floats, big integers and lone surrogates reach the method."""
+        class MyService(Dispatcher):
+            @ServiceMethod
+            def echo(self, value):
+                self.value = value
+                return value
+        for text, value in [('1.0000000000000002', 1.0000000000000002),
+                            ('123456789012345678901234567890',
+                             123456789012345678901234567890),
+                            ('"\\ud800"', u'\ud800')]:
+            service = MyService()
+            status, body = service.dispatch(
+                '{"jsonrpc": "2.0", "method": "echo", "params": [%s], '
+                '"id": 1}' % text)
+            self.assertEqual(status, 200)
+            self.assertEqual(repr(service.value), repr(value))
+
+    def testHandlerCodec(self):
+        """Handlers use the configured codec."""
+        class MyTestHandler(JsonRpcHandler):
+            codec = json_rpc_codecs.get_codec('simplejson')
+            @ServiceMethod
+            def echo(self, value):
+                return value
+        h = MyTestHandler()
+        h.request = Request.blank('/rpc/')
+        h.response = Response()
+        h.request.body = (
+            '{"jsonrpc": "2.0", "method": "echo", "params": ["a"], "id": 1}')
+        h.post()
+        self.assertEqual(h.get_codec(), MyTestHandler.codec)
+        self.assertEqual(
+            h.response.out.getvalue(),
+            '{"jsonrpc": "2.0", "result": "a", "id": 1}')
+
+    def testBestMatch(self):
+        """Media types are selected by quality and specificity."""
+        best_match = json_rpc_codecs.best_match
+        offered = ['application/json-rpc', 'application/msgpack']
+        self.assertEqual(best_match('*/*', offered), 'application/json-rpc')
+        self.assertEqual(
+            best_match('application/msgpack, */*;q=0.1', offered),
+            'application/msgpack')
+        self.assertEqual(
+            best_match('application/*;q=0.5, application/msgpack', offered),
+            'application/msgpack')
+        self.assertEqual(
+            best_match('application/*, application/json-rpc;q=0', offered),
+            'application/msgpack')
+        self.assertEqual(best_match('text/html', offered), None)
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for compressed requests and responses."""
+
+from jsongae.json_rpc import *
+from jsongae.json_rpc_compression import *
+from google.appengine.ext.webapp import Request, Response
+import gzip
+import simplejson
+import StringIO
+import unittest
+import webtest
+import zlib
+
+
+def gzip_data(data):
+    buf = StringIO.StringIO()
+    f = gzip.GzipFile(fileobj=buf, mode='wb')
+    f.write(data)
+    f.close()
+    return buf.getvalue()
+
+
+def gunzip_data(data):
+    return gzip.GzipFile(fileobj=StringIO.StringIO(data)).read()
+
+
+class CompressionTestCase(unittest.TestCase):
+    """Tests for the compression helpers."""
+
+    def testNegotiate(self):
+        """The accepted coding with the highest quality is selected."""
+        self.assertEqual(negotiate(None), None)
+        self.assertEqual(negotiate('identity'), None)
+        self.assertEqual(negotiate('gzip, deflate'), 'gzip')
+        self.assertEqual(negotiate('deflate, gzip'), 'gzip')
+        self.assertEqual(negotiate('gzip;q=0.5, deflate'), 'deflate')
+        self.assertEqual(negotiate('gzip;q=0, *'), 'deflate')
+        self.assertEqual(negotiate('*;q=0'), None)
+        self.assertEqual(negotiate('X-GZIP'), 'gzip')
+
+    def testCompressChunks(self):
+        """Bodies reaching the threshold are compressed."""
+        self.assertEqual(compress_chunks(['abc'], None), (None, ['abc']))
+        self.assertEqual(compress_chunks(iter(['ab', 'c']), 'gzip', 4),
+                         (None, ['ab', 'c']))
+        chunks = ['[1', ', 2' * 100, ']']
+        coding, body = compress_chunks(chunks, 'gzip', 10)
+        self.assertEqual(coding, 'gzip')
+        self.assertTrue(isinstance(body, list))
+        self.assertEqual(gunzip_data(''.join(body)), ''.join(chunks))
+        coding, body = compress_chunks(iter(chunks), 'deflate', 10)
+        self.assertFalse(isinstance(body, list))
+        self.assertEqual(zlib.decompress(''.join(body)), ''.join(chunks))
+
+    def testDecompress(self):
+        """Request bodies are decoded according to their coding."""
+        data = '{"jsonrpc": "2.0"}' * 10
+        self.assertEqual(decompress(data, None), data)
+        self.assertEqual(decompress(gzip_data(data), 'gzip'), data)
+        self.assertEqual(decompress(zlib.compress(data), 'deflate'), data)
+        self.assertEqual(decompress(zlib.compress(data)[2:-4], 'deflate'),
+                         data)
+        self.assertRaises(DecompressionError, decompress, data, 'br')
+        self.assertRaises(DecompressionError, decompress, data, 'gzip')
+        self.assertRaises(DecompressionError, decompress,
+                          gzip_data(data), 'gzip', 100)
+
+
+class CompressedHandlerTestCase(unittest.TestCase):
+    """Tests for compression with the handler and the WSGI application."""
+    class MyService(Dispatcher):
+        compression_threshold = 100
+        @ServiceMethod
+        def echo(self, value):
+            return value
+
+    class MyHandler(JsonRpcHandler, MyService):
+        pass
+
+    def exec_handler(self, body, **headers):
+        h = self.MyHandler()
+        h.request = Request.blank('/rpc', headers=headers)
+        h.response = Response()
+        h.request.body = body
+        h.post()
+        return h.response
+
+    def testHandler(self):
+        """Large responses are compressed if the client accepts it."""
+        small = simplejson.dumps(
+            {"jsonrpc": "2.0", "method": "echo", "params": ["a"], "id": 1})
+        large = simplejson.dumps(
+            {"jsonrpc": "2.0", "method": "echo", "params": ["a" * 200], "id": 1})
+        response = self.exec_handler(small, **{'Accept-Encoding': 'gzip'})
+        self.assertFalse('Content-Encoding' in response.headers)
+        self.assertEqual(response.headers['Vary'], 'Accept, Accept-Encoding')
+        response = self.exec_handler(large)
+        self.assertFalse('Content-Encoding' in response.headers)
+        response = self.exec_handler(large, **{'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(
+            simplejson.loads(gunzip_data(response.out.getvalue()))['result'],
+            'a' * 200)
+        response = self.exec_handler(
+            gzip_data(large), **{'Content-Encoding': 'gzip'})
+        self.assertEqual(simplejson.loads(response.out.getvalue())['result'],
+                         'a' * 200)
+        response = self.exec_handler(large, **{'Content-Encoding': 'br'})
+        self.assertEqual(response.status, 400)
+
+    def testWSGIApplication(self):
+        """Streamed batches are compressed while they are produced."""
+        class StreamingService(self.MyService):
+            stream_batches = True
+        app = webtest.TestApp(JsonRpcApplication(StreamingService))
+        body = simplejson.dumps(
+            [{"jsonrpc": "2.0", "method": "echo", "params": [i], "id": i}
+             for i in range(20)])
+        response = app.post('/rpc', zlib.compress(body), headers={
+            'Content-Encoding': 'deflate', 'Accept-Encoding': 'deflate'})
+        self.assertEqual(response.headers['Content-Encoding'], 'deflate')
+        self.assertEqual(
+            [r['result'] for r in simplejson.loads(
+                zlib.decompress(response.body))], range(20))
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for deferring notifications."""
+
+from jsongae.json_rpc import *
+from jsongae.json_rpc_deferred import *
+from google.appengine.ext.webapp import Request, Response
+import simplejson
+import unittest
+
+
+class DeferredNotificationTestCase(unittest.TestCase):
+    """Tests for enqueueing notifications instead of executing them."""
+
+    def setUp(self):
+        self.taskqueue = FakeTaskQueue()
+
+        class MyTestHandler(JsonRpcHandler):
+            notification_queue = TaskQueue(taskqueue=self.taskqueue)
+            calls = []
+            @ServiceMethod
+            def notify(self, message, number=1):
+                self.calls.append((message, number))
+            @ServiceMethod
+            def echo(self, value):
+                return value
+        self.handler_class = MyTestHandler
+
+    def post(self, body, environ=None, **headers):
+        h = self.handler_class()
+        h.request = Request.blank('/rpc', environ=environ, headers=headers)
+        h.request.body = body
+        h.response = Response()
+        h.post()
+        return h.response.status, h.response.out.getvalue()
+
+    def testDeferred(self):
+        """Notifications are enqueued with one write and answered at once."""
+        status, body = self.post(simplejson.dumps([
+            {'jsonrpc': '2.0', 'method': 'notify', 'params': ['a', 2]},
+            {'jsonrpc': '2.0', 'method': 'notify', 'params': {'message': 'b'}},
+            {'jsonrpc': '2.0', 'method': 'notify', 'params': []},
+            {'jsonrpc': '2.0', 'method': 'missing'},
+        ]))
+        self.assertEqual((status, body), (204, ''))
+        self.assertEqual(self.handler_class.calls, [])
+        self.assertEqual(len(self.taskqueue.tasks), 1)
+        task = self.taskqueue.tasks[0]
+        self.assertEqual(task['url'], '/rpc')
+        self.assertEqual(len(simplejson.loads(task['payload'])), 2)
+
+        status, body = self.post(
+            task['payload'],
+            {'SERVER_SOFTWARE': 'Google App Engine/1.9.88'},
+            **{'X-AppEngine-QueueName': 'default'})
+        self.assertEqual(status, 204)
+        self.assertEqual(self.handler_class.calls, [('a', 2), ('b', 1)])
+        self.assertEqual(len(self.taskqueue.tasks), 1)
+
+    def testUntrustedQueueHeader(self):
+        """The queue header is ignored where clients can send it."""
+        body = simplejson.dumps(
+            {'jsonrpc': '2.0', 'method': 'notify', 'params': ['a']})
+        headers = {'X-AppEngine-QueueName': 'default'}
+        for environ in ({'SERVER_SOFTWARE': 'CherryPy/3.2'}, {}):
+            self.assertEqual(self.post(body, environ, **headers)[0], 204)
+        self.assertEqual(self.handler_class.calls, [])
+        self.assertEqual(len(self.taskqueue.tasks), 2)
+        self.handler_class.trust_queue_header = True
+        self.post(body, {'SERVER_SOFTWARE': 'CherryPy/3.2'}, **headers)
+        self.assertEqual(self.handler_class.calls, [('a', 1)])
+        environ = {'SERVER_SOFTWARE': 'Development/2.0',
+                   'HTTP_X_APPENGINE_QUEUENAME': 'default'}
+        self.handler_class.trust_queue_header = None
+        self.assertTrue(self.handler_class().is_queued(environ))
+        self.handler_class.trust_queue_header = False
+        self.assertFalse(self.handler_class().is_queued(environ))
+
+    def testMixedBatch(self):
+        """Calls of a batch are still executed and answered."""
+        status, body = self.post(simplejson.dumps([
+            {'jsonrpc': '2.0', 'method': 'notify', 'params': ['a']},
+            {'jsonrpc': '2.0', 'method': 'echo', 'params': ['b'], 'id': 1},
+        ]))
+        self.assertEqual(status, 200)
+        self.assertEqual(simplejson.loads(body)[0]['result'], 'b')
+        self.assertEqual(len(self.taskqueue.tasks), 1)
+        self.assertEqual(self.handler_class.calls, [])
+
+    def testEnqueueFailure(self):
+        """Notifications are executed if they cannot be enqueued."""
+        def add(**kwargs):
+            raise RuntimeError('Queue unavailable')
+        self.taskqueue.add = add
+        status, body = self.post(simplejson.dumps(
+            {'jsonrpc': '2.0', 'method': 'notify', 'params': ['a']}))
+        self.assertEqual(status, 204)
+        self.assertEqual(self.handler_class.calls, [('a', 1)])
+
+    def testInProcessQueue(self):
+        """The in-process queue executes notifications in a thread."""
+        class MyService(Dispatcher):
+            notification_queue = InProcessQueue()
+            calls = []
+            @ServiceMethod
+            def notify(self, message):
+                self.calls.append(message)
+        status, body = MyService().dispatch(simplejson.dumps(
+            [{'jsonrpc': '2.0', 'method': 'notify', 'params': [i]}
+             for i in range(3)]))
+        self.assertEqual(status, 204)
+        MyService.notification_queue.join()
+        self.assertEqual(MyService.calls, [0, 1, 2])
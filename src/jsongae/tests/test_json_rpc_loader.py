@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for the request scoped entity loader."""
+
+from jsongae.json_rpc import *
+from jsongae.json_rpc_loader import *
+import simplejson
+import unittest
+
+
+class FakeDatastore(object):
+    """Answers bulk gets from a dictionary and records them."""
+
+    def __init__(self, entities):
+        self.entities = entities
+        self.gets = []
+
+    def get(self, keys):
+        self.gets.append(sorted(keys))
+        if 'broken' in keys:
+            raise ValueError('datastore unavailable')
+        return [self.entities.get(key) for key in keys]
+
+
+class EntityLoaderTestCase(unittest.TestCase):
+    """Tests for collecting and caching datastore gets."""
+
+    def setUp(self):
+        self.datastore = FakeDatastore({'a': ['A'], 'b': ['B']})
+        self.loader = EntityLoader(self.datastore.get)
+
+    def testBulkGet(self):
+        """Keys requested before the first result are fetched at once."""
+        a = self.loader.get('a')
+        b, missing, again = self.loader.get_many(['b', 'c', 'a']).futures
+        self.assertEqual(self.datastore.gets, [])
+        self.assertEqual(a.get_result(), ['A'])
+        self.assertEqual(self.datastore.gets, [['a', 'b', 'c']])
+        self.assertEqual(missing.get_result(), None)
+        self.assertTrue(again.get_result() is a.get_result())
+        self.assertEqual(self.loader.get('b').get_result(), ['B'])
+        self.assertEqual(self.loader.get('d').get_result(), None)
+        self.assertEqual(self.datastore.gets, [['a', 'b', 'c'], ['d']])
+
+    def testFailure(self):
+        """A failing bulk get is raised for every pending key."""
+        a = self.loader.get('a')
+        broken = self.loader.get('broken')
+        self.assertRaises(ValueError, a.get_result)
+        self.assertRaises(ValueError, broken.get_result)
+        self.assertEqual(len(self.datastore.gets), 1)
+        self.loader.prime(Entity('a'))
+        self.assertEqual(self.loader.get('a').get_result().name, 'a')
+
+
+class Entity(object):
+    """A stand-in for a db.Model instance."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def key(self):
+        return self.name
+
+
+class LoaderDispatchTestCase(unittest.TestCase):
+    """Tests for the loader of a Dispatcher."""
+
+    def setUp(self):
+        datastore = self.datastore = FakeDatastore({'a': 1, 'b': 2})
+
+        class MyService(Dispatcher):
+            loader_class = lambda self: EntityLoader(datastore.get)
+            @ServiceMethod(coroutine=True)
+            def double(self, key):
+                value = yield self.loader.get(key)
+                raise Return(value * 2)
+            @ServiceMethod
+            def load(self, key):
+                return self.loader.get(key)
+
+        self.service = MyService
+
+    def testBatch(self):
+        """The gets of all calls in a batch are resolved together."""
+        service = self.service()
+        status, body = service.dispatch(simplejson.dumps(
+            [{"jsonrpc": "2.0", "method": "double", "params": ["a"], "id": 1},
+             {"jsonrpc": "2.0", "method": "load", "params": ["b"], "id": 2},
+             {"jsonrpc": "2.0", "method": "double", "params": ["b"], "id": 3},
+             {"jsonrpc": "2.0", "method": "load", "params": ["c"], "id": 4}]))
+        self.assertEqual(
+            [r['result'] for r in simplejson.loads(''.join(body))],
+            [2, 2, 4, None])
+        self.assertEqual(self.datastore.gets, [['a', 'b', 'c']])
+
+    def testRequestScope(self):
+        """Every request starts with an empty loader."""
+        service = self.service()
+        request = '{"jsonrpc": "2.0", "method": "load", "params": ["a"], "id": 1}'
+        service.dispatch(request)
+        loader = service.loader
+        service.dispatch(request)
+        self.assertFalse(service.loader is loader)
+        self.assertEqual(self.datastore.gets, [['a'], ['a']])
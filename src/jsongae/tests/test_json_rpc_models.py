@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for encoding datastore entities."""
+
+from jsongae.json_rpc import *
+from jsongae.json_rpc_codecs import get_codec
+from jsongae.json_rpc_models import *
+from jsongae import json_rpc_msgpack
+from google.appengine.api import users
+from google.appengine.ext import db
+import datetime
+import os
+import simplejson
+import unittest
+
+os.environ.setdefault('APPLICATION_ID', 'test')
+
+
+class Author(db.Model):
+    name = db.StringProperty()
+
+
+class Story(db.Model):
+    title = db.StringProperty()
+    author = db.ReferenceProperty(Author)
+    published = db.DateTimeProperty()
+    day = db.DateProperty()
+    tags = db.StringListProperty()
+    related = db.ListProperty(db.Key)
+    owner = db.UserProperty()
+    location = db.GeoPtProperty()
+    data = db.BlobProperty()
+    version = db.IntegerProperty(default=1)
+
+
+class FakeQuery(object):
+    """Query over a list of entities with integer cursors."""
+
+    _model_class = Story
+
+    def __init__(self, entities):
+        self.entities = entities
+        self.offset = self.position = 0
+
+    def with_cursor(self, cursor):
+        if not cursor.isdigit():
+            raise db.BadValueError('Invalid cursor')
+        self.offset = int(cursor)
+
+    def run(self, limit):
+        for entity in self.entities[self.offset:self.offset + limit]:
+            self.position += 1
+            yield entity
+
+    def cursor(self):
+        return str(self.offset + self.position)
+
+
+class ModelSerializerTestCase(unittest.TestCase):
+    """Tests for encoding entities."""
+
+    def setUp(self):
+        self.author_key = db.Key.from_path('Author', 'ann')
+        self.story = Story(
+            key_name='s1', title=u'Tïtle', author=self.author_key,
+            published=datetime.datetime(2011, 2, 3, 4, 5, 6),
+            day=datetime.date(2011, 2, 3), tags=['a', 'b'],
+            related=[self.author_key],
+            owner=users.User('ann@example.com', _auth_domain='example.com'),
+            location=db.GeoPt(1.5, 2.5), data=db.Blob('\x00\xff'))
+
+    def testToPython(self):
+        """Properties are encoded as JSON values."""
+        obj = ModelSerializer().to_python(self.story)
+        self.assertEqual(obj, {
+            'key': str(self.story.key()),
+            'title': u'Tïtle',
+            'author': str(self.author_key),
+            'published': '2011-02-03T04:05:06',
+            'day': '2011-02-03',
+            'tags': ['a', 'b'],
+            'related': [str(self.author_key)],
+            'owner': 'ann@example.com',
+            'location': {'lat': 1.5, 'lon': 2.5},
+            'data': 'AP8=',
+            'version': 1,
+        })
+        obj = ModelSerializer().to_python(Story(), ('title', 'author'))
+        self.assertEqual(obj, {'key': None, 'title': None, 'author': None})
+
+    def testEncode(self):
+        """Entities, lists of them and projections are encoded."""
+        serializer = ModelSerializer()
+        codec = get_codec()
+        text = serializer.encode(self.story, codec)
+        self.assertEqual(simplejson.loads(text),
+                         serializer.to_python(self.story))
+        text = serializer.encode(
+            Projection([self.story, None], ['title']), codec)
+        self.assertEqual(simplejson.loads(text), [
+            {'key': str(self.story.key()), 'title': u'Tïtle'}, None])
+        self.assertEqual(serializer.encode([self.story, 1], codec), None)
+        self.assertEqual(serializer.encode([], codec), None)
+        self.assertEqual(serializer.encode(Projection([], ['x']), codec),
+                         '[]')
+        self.assertRaises(InvalidParamsError, Projection, self.story, ['x'])
+
+    def testProjections(self):
+        """Encoders of projections are cached by their properties only."""
+        serializer = ModelSerializer(max_projections=2)
+        encoders = serializer.encoders(Story, ('title', 'day', 'title', 'x'))
+        self.assertEqual([e[0] for e in encoders], ['day', 'title'])
+        self.assertTrue(serializer.encoders(Story, ('day', 'title', 'y'))
+                        is encoders)
+        for fields in [('owner',), ('data',), ('title',)]:
+            serializer.encoders(Story, fields)
+        self.assertEqual(len(serializer._projections), 2)
+        self.assertEqual(encode_value([self.story.owner]),
+                         ['ann@example.com'])
+
+    def testCache(self):
+        """Encoded entities are cached per version."""
+        serializer = ModelSerializer(version_property='version')
+        codec = get_codec()
+        first = serializer.encode(self.story, codec)
+        self.story.title = u'Changed'
+        self.assertEqual(serializer.encode(self.story, codec), first)
+        self.story.version = 2
+        self.assertNotEqual(serializer.encode(self.story, codec), first)
+        self.assertEqual(len(serializer.cache), 2)
+
+
+class ModelResultTestCase(unittest.TestCase):
+    """Tests for service methods returning entities."""
+    class MyService(Dispatcher):
+        model_serializer = ModelSerializer()
+        @ServiceMethod(params={'fields': list})
+        def stories(self, fields=None):
+            return Projection([Story(key_name='s1', title=u'a'),
+                               Story(key_name='s2', title=u'b')], fields)
+        @ServiceMethod
+        def story(self):
+            return Story(key_name='s1', title=u'a')
+
+    def testResponses(self):
+        """Responses are identical to encoding the entities as objects."""
+        service = self.MyService()
+        for codec in (get_codec(), json_rpc_msgpack.get_codec()):
+            response = {'jsonrpc': '2.0', 'result': [u'a', 1], 'id': 7}
+            self.assertEqual(
+                codec.encode_result(codec.dumps([u'a', 1]), 7),
+                codec.dumps(response))
+            for method, params in [('stories', [['title']]),
+                                   ('story', None)]:
+                request = {'jsonrpc': '2.0', 'method': method, 'id': 1}
+                if params is not None:
+                    request['params'] = params
+                status, body = service.dispatch(
+                    codec.dumps(request), codecs=(codec, codec))
+                self.assertEqual(status, 200)
+                response = codec.loads(''.join(body))
+                if method == 'stories':
+                    self.assertEqual(response['result'][1],
+                                     {'key': str(db.Key.from_path('Story', 's2')),
+                                      'title': u'b'})
+                else:
+                    self.assertEqual(response['result']['title'], u'a')
+                self.assertEqual(response['id'], 1)
+        status, body = service.dispatch(simplejson.dumps(
+            {'jsonrpc': '2.0', 'method': 'stories', 'params': [['x']],
+             'id': 1}))
+        self.assertEqual(simplejson.loads(''.join(body))['error']['code'],
+                         -32602)
+
+    def testPaginate(self):
+        """Pages are streamed with the cursor of the next page."""
+        stories = [Story(key_name='s%i' % i, title=u'%i' % i)
+                   for i in range(5)]
+        service = self.MyService()
+        pages = []
+        cursor = None
+        while True:
+            page = paginate(FakeQuery(stories), 2, cursor, ['title'])
+            result = simplejson.loads(''.join(service.encode_response(
+                {'jsonrpc': '2.0', 'result': page, 'id': 1},
+                get_codec())))['result']
+            pages.append([item['title'] for item in result['items']])
+            self.assertEqual(sorted(result['items'][0]), ['key', 'title'])
+            cursor = result['cursor']
+            if cursor is None:
+                break
+        self.assertEqual(pages, [[u'0', u'1'], [u'2', u'3'], [u'4']])
+        self.assertRaises(InvalidParamsError, paginate,
+                          FakeQuery(stories), 2, 'x')
+        self.assertRaises(InvalidParamsError, paginate,
+                          FakeQuery(stories), 2, None, ['x'])
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for the MessagePack codec."""
+
+from jsongae.json_rpc import *
+from jsongae.json_rpc_msgpack import *
+from jsongae import json_rpc_msgpack
+from google.appengine.ext.webapp import Request, Response
+import unittest
+import webtest
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class MessagePackTestCase(unittest.TestCase):
+    """Tests for the pure Python MessagePack implementation."""
+
+    def testEncoding(self):
+        """Values are encoded in their most compact form."""
+        for obj, data in [
+                (None, '\xc0'), (True, '\xc3'), (False, '\xc2'),
+                (0, '\x00'), (127, '\x7f'), (-1, '\xff'), (-32, '\xe0'),
+                (128, '\xcc\x80'), (-33, '\xd0\xdf'), (65536, '\xce\x00\x01\x00\x00'),
+                (-2 ** 63, '\xd3\x80' + '\x00' * 7), (2 ** 64 - 1, '\xcf' + '\xff' * 8),
+                (1.5, '\xcb\x3f\xf8' + '\x00' * 6),
+                (u'\xe4', '\xa2\xc3\xa4'), ('a' * 32, '\xda\x00\x20' + 'a' * 32),
+                ([1, 2], '\x92\x01\x02'), ((1,), '\x91\x01'), ([], '\x90'),
+                ({'a': 1}, '\x81\xa1a\x01'),
+                (range(16), '\xdc\x00\x10' + ''.join(map(chr, range(16))))]:
+            self.assertEqual(packb(obj), data)
+            self.assertEqual(unpackb(data), isinstance(obj, tuple)
+                             and list(obj) or obj)
+        self.assertRaises(ValueError, packb, 2 ** 64)
+        self.assertRaises(TypeError, packb, object())
+
+    def testRoundTrip(self):
+        """Decoding results in the same objects as JSON."""
+        obj = {u'jsonrpc': u'2.0', u'id': 7, u'result': [
+            1, -2, 3.5, 1e100, True, None, 2 ** 40, -2 ** 40, u'€' * 300,
+            {u'nested': [{}] * 20}, range(70000)]}
+        decoded = unpackb(packb(obj))
+        self.assertEqual(decoded, obj)
+        self.assertTrue(isinstance(decoded[u'jsonrpc'], unicode))
+        self.assertEqual(unpackb('\xc4\x02\x00\xff'), '\x00\xff')
+        self.assertEqual(unpackb('\xca\x3f\xc0\x00\x00'), 1.5)
+
+    def testInvalidData(self):
+        """Invalid data raises ValueError."""
+        for data in ['', '\x92\x01', '\xa3ab', '\xcd\x01', '\xc1', '\x01\x02',
+                     '\xd4\x01\x00']:
+            self.assertRaises(ValueError, unpackb, data)
+
+
+    @unittest.skipIf(msgpack is None, 'msgpack is not installed')
+    def testLibrary(self):
+        """The msgpack library encodes responses like the pure packer."""
+        loads, dumps = json_rpc_msgpack._msgpack()
+        library = MessagePackCodec('msgpack', loads, dumps)
+        pure = MessagePackCodec('msgpack.pure', unpackb, packb)
+        for obj in [
+                {'jsonrpc': '2.0', 'result': [u'\xe4', 'a' * 40, 1.5], 'id': 1},
+                {'jsonrpc': '2.0', 'error': {'code': -32601,
+                 'message': 'Method not found'}, 'id': None},
+                [u'x' * 300, 2 ** 40, -2 ** 40, None, True, {}]]:
+            self.assertEqual(dumps(obj), packb(obj))
+            self.assertEqual(loads(packb(obj)), unpackb(packb(obj)))
+        self.assertEqual(library.encode_result(dumps('a'), 7),
+                         pure.encode_result(packb('a'), 7))
+
+
+class MessagePackDispatchTestCase(unittest.TestCase):
+    """Tests for negotiating MessagePack with the handlers."""
+    class MyService(Dispatcher):
+        compression_threshold = None
+        @ServiceMethod
+        def echo(self, value):
+            return value
+        @ServiceMethod
+        def items(self, count):
+            return (i for i in range(count))
+        @ServiceMethod
+        def page(self, count):
+            return Page(iter(range(count)), 'next')
+
+    class MyHandler(JsonRpcHandler, MyService):
+        pass
+
+    def exec_handler(self, body, **headers):
+        h = self.MyHandler()
+        h.request = Request.blank('/rpc', headers=headers)
+        h.response = Response()
+        h.request.body = body
+        h.post()
+        return h.response
+
+    def testHandler(self):
+        """Binary requests are answered with binary responses."""
+        codec = get_codec()
+        response = self.exec_handler(codec.dumps(
+            {'jsonrpc': '2.0', 'method': 'echo', 'params': [[1.5, u'a']],
+             'id': 1}), **{'Content-Type': 'application/msgpack'})
+        self.assertEqual(response.headers['Content-Type'], CONTENT_TYPE)
+        self.assertEqual(codec.loads(response.out.getvalue()),
+                         {'jsonrpc': '2.0', 'result': [1.5, u'a'], 'id': 1})
+        response = self.exec_handler(
+            '\x92\x01', **{'Content-Type': 'application/x-msgpack'})
+        self.assertEqual(response.status, 500)
+        self.assertEqual(
+            codec.loads(response.out.getvalue())['error']['code'], -32700)
+        response = self.exec_handler(
+            '{"jsonrpc": "2.0", "method": "echo", "params": [1], "id": 1}',
+            **{'Accept': 'application/msgpack'})
+        self.assertEqual(codec.loads(response.out.getvalue())['result'], 1)
+        response = self.exec_handler(codec.dumps(
+            {'jsonrpc': '2.0', 'method': 'echo', 'params': [1], 'id': 1}),
+            **{'Content-Type': 'application/msgpack',
+               'Accept': 'application/json-rpc'})
+        self.assertEqual(response.headers['Content-Type'],
+                         'application/json-rpc')
+        self.assertEqual(response.out.getvalue(),
+                         '{"jsonrpc": "2.0", "result": 1, "id": 1}')
+
+    def testBatches(self):
+        """Batches are framed as MessagePack arrays, also when streamed."""
+        class StreamingService(self.MyService):
+            stream_batches = True
+        codec = get_codec()
+        body = codec.dumps(
+            [{'jsonrpc': '2.0', 'method': 'echo', 'params': [i], 'id': i}
+             for i in range(20)] +
+            [{'jsonrpc': '2.0', 'method': 'echo', 'params': [0]},
+             {'foo': 'boo'}])
+        for service in (self.MyService, StreamingService):
+            app = webtest.TestApp(JsonRpcApplication(service))
+            response = app.post('/rpc', body, headers={
+                'Content-Type': 'application/msgpack'})
+            responses = codec.loads(response.body)
+            self.assertEqual([r.get('result') for r in responses],
+                             range(20) + [None])
+            self.assertEqual(responses[-1]['error']['code'], -32600)
+
+    def testStreamedResults(self):
+        """Streamed results are buffered to frame their arrays."""
+        class StreamingService(self.MyService):
+            stream_batches = True
+        codec = get_codec()
+        body = codec.dumps(
+            [{'jsonrpc': '2.0', 'method': 'items', 'params': [20], 'id': 1},
+             {'jsonrpc': '2.0', 'method': 'page', 'params': [3], 'id': 2}])
+        for service in (self.MyService, StreamingService):
+            app = webtest.TestApp(JsonRpcApplication(service))
+            response = app.post('/rpc', body, headers={
+                'Content-Type': 'application/msgpack'})
+            self.assertEqual(codec.loads(response.body), [
+                {'jsonrpc': '2.0', 'result': range(20), 'id': 1},
+                {'jsonrpc': '2.0', 'result': {'items': [0, 1, 2],
+                                              'cursor': 'next'}, 'id': 2}])
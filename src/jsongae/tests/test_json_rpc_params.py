@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for the parameter adapters."""
+
+from jsongae.json_rpc import *
+from jsongae.json_rpc_params import *
+from google.appengine.ext.webapp import Request, Response
+import simplejson
+import unittest
+
+
+class AdapterTestCase(unittest.TestCase):
+    """Tests for compiled parameter adapters."""
+
+    def assertError(self, adapt, params, message):
+        try:
+            adapt(params)
+        except ParamsError, ex:
+            self.assertEqual(str(ex), message)
+        else:
+            self.fail('No ParamsError raised')
+
+    def testPositionalOrder(self):
+        """Named and positional params result in the same arguments."""
+        adapt = compile_adapter(('a', 'b', 'c'), (3, None))
+        self.assertEqual(adapt([1, 2, 4]), [1, 2, 4])
+        self.assertEqual(adapt([1]), [1, 3, None])
+        self.assertEqual(adapt({u'b': 2, u'a': 1}), [1, 2, None])
+        self.assertEqual(adapt({'c': 4, 'a': 1}), [1, 3, 4])
+        self.assertEqual(compile_adapter(())(None), [])
+        self.assertEqual(compile_adapter(('a',), (1,))(None), [1])
+
+    def testErrors(self):
+        """Mismatching params are reported precisely."""
+        adapt = compile_adapter(('a', 'b'), (2,))
+        self.assertError(adapt, [], 'Wrong number of parameters; '
+                         'expected 1 to 2 got 0')
+        self.assertError(adapt, [1, 2, 3], 'Wrong number of parameters; '
+                         'expected 1 to 2 got 3')
+        self.assertError(adapt, None, "Wrong number of parameters; expected "
+                         "1 to 2 but 'params' was omitted from JSON-RPC "
+                         "message")
+        self.assertError(adapt, {'b': 1}, "Missing parameter 'a'")
+        self.assertError(adapt, {'a': 1, 'd': 1, 'c': 1},
+                         "Unexpected parameter 'c'")
+
+    def testSchema(self):
+        """Values are checked and converted according to the schema."""
+        adapt = compile_adapter(
+            ('name', 'count', 'ratio', 'flag', 'items', 'tag'), (None,),
+            {'name': basestring, 'count': int, 'ratio': float, 'flag': bool,
+             'items': (list, dict), 'tag': str})
+        self.assertEqual(adapt([u'a', 1, 2, True, [], None]),
+                         [u'a', 1, 2.0, True, [], None])
+        self.assertTrue(isinstance(adapt(['a', 1, 2, True, {}])[2], float))
+        self.assertError(adapt, ['a', True, 2, True, []],
+                         "Parameter 'count' must be integer, got boolean")
+        self.assertError(adapt, ['a', 1, '2', True, []],
+                         "Parameter 'ratio' must be number, got string")
+        self.assertError(adapt, [1, 1, 2, True, []],
+                         "Parameter 'name' must be string, got integer")
+        self.assertError(adapt, ['a', 1, 2, 1, []],
+                         "Parameter 'flag' must be boolean, got integer")
+        self.assertError(adapt, ['a', 1, 2, True, 'x'],
+                         "Parameter 'items' must be array or object, "
+                         "got string")
+        self.assertError(adapt, [None, 1, 2, True, []],
+                         "Parameter 'name' must be string, got null")
+
+    def testConversion(self):
+        """Functions convert values."""
+        adapt = compile_adapter(('number',), (), {'number': lambda v: int(v)})
+        self.assertEqual(adapt({'number': '42'}), [42])
+        self.assertError(adapt, ['x'], "Invalid value for parameter 'number': "
+                         "invalid literal for int() with base 10: 'x'")
+
+    def testInvalidSchema(self):
+        """Schemas must match the arguments."""
+        self.assertRaises(TypeError, compile_adapter, ('a',), (), {'b': int})
+        self.assertRaises(TypeError, compile_adapter, ('a',), (), {'a': 1})
+
+
+class ServiceMethodParamsTestCase(unittest.TestCase):
+    """Tests for service methods with defaults and schemas."""
+    class MyTestHandler(JsonRpcHandler):
+        @ServiceMethod(params={'key_name': basestring, 'count': int})
+        def data(self, key_name, count=1):
+            return [key_name] * count
+
+    def call(self, params):
+        h = self.MyTestHandler()
+        h.request = Request.blank('/rpc/')
+        h.response = Response()
+        h.request.body = simplejson.dumps(
+            {"jsonrpc": "2.0", "method": "data", "params": params, "id": 1})
+        h.post()
+        return simplejson.loads(h.response.out.getvalue())
+
+    def testCalls(self):
+        """Defaults are applied and invalid params are rejected."""
+        self.assertEqual(self.call(['a'])['result'], ['a'])
+        self.assertEqual(self.call({'count': 2, 'key_name': 'a'})['result'],
+                         ['a', 'a'])
+        error = self.call(['a', 'b'])['error']
+        self.assertEqual(error['code'], -32602)
+        self.assertEqual(error['message'], "InvalidParamsError: Parameter "
+                         "'count' must be integer, got string")
+
+    def testCanonicalParams(self):
+        """All forms of a call have the same canonical params."""
+        spec = self.MyTestHandler.data.service_spec
+        self.assertEqual(spec.canonical_params(['a']),
+                         spec.canonical_params({'key_name': 'a', 'count': 1}))
+        self.assertEqual(spec.canonical_params([1]), None)
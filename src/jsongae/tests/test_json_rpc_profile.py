@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for the sampled profiler."""
+
+from jsongae.json_rpc import *
+from jsongae.json_rpc_profile import *
+from google.appengine.ext.webapp import Request, Response
+import os
+import pstats
+import shutil
+import simplejson
+import tempfile
+import unittest
+
+
+def fibonacci(n):
+    if n < 2:
+        return n
+    return fibonacci(n - 1) + fibonacci(n - 2)
+
+
+class SampledProfilerTestCase(unittest.TestCase):
+    """Tests for profiling a sample of requests."""
+
+    def setUp(self):
+        self.profiler = profiler = SampledProfiler(sample_rate=1.0)
+
+        class MyService(Dispatcher):
+            @ServiceMethod
+            def fib(self, n):
+                return fibonacci(n)
+            @ServiceMethod
+            def items(self, n):
+                return iter(range(n))
+        MyService.profiler = profiler
+        self.service_class = MyService
+
+    def call(self, body, admin=False, **options):
+        service = self.service_class()
+        service.admin = admin
+        for name, value in options.items():
+            setattr(service, name, value)
+        status, body = service.dispatch(simplejson.dumps(body))
+        return status, ''.join(body)
+
+    def batch(self):
+        return [{'jsonrpc': '2.0', 'method': 'fib', 'params': [10], 'id': 1},
+                {'jsonrpc': '2.0', 'method': 'items', 'params': [3], 'id': 2}]
+
+    def testReport(self):
+        """Statistics are aggregated per phase and method."""
+        self.call(self.batch())
+        self.call(self.batch(), batch_executor=ThreadedBatchExecutor())
+        self.call([{'jsonrpc': '2.0', 'method': 'x%i' % i, 'id': i}
+                   for i in range(3)])
+        report = self.profiler.report(top=5)
+        self.assertEqual(report['samples'], 3)
+        self.assertEqual(sorted(report['phases']),
+                         ['execute', 'parse', 'serialize'])
+        self.assertEqual(sorted(report['methods']),
+                         [UNKNOWN_METHOD, 'fib', 'items'])
+        self.assertEqual(sorted(report['methods']['fib']),
+                         ['execute', 'serialize'])
+        self.assertEqual(len(report['functions']), 5)
+        report = self.profiler.report(phase='execute', method='fib',
+                                      sort='calls')
+        function = report['functions'][0]
+        self.assertTrue(function['function'].endswith('(fibonacci)'))
+        self.assertEqual(function['calls'], 2 * 177)
+        self.assertEqual(function['primitive_calls'], 2)
+        self.assertRaises(ValueError, self.profiler.report, sort='x')
+        self.assertRaises(ValueError, self.profiler.report, phase='x')
+        self.assertEqual(self.profiler.report(method='x')['functions'], [])
+
+    def testSampleRate(self):
+        """Only a fraction of requests is profiled."""
+        self.profiler.sample_rate = 0.0
+        self.call(self.batch())
+        self.assertEqual(self.profiler.report(),
+                         {'samples': 0, 'methods': {}, 'functions': [],
+                          'phases': {'parse': 0.0, 'execute': 0.0,
+                                     'serialize': 0.0}})
+
+    def testReusedDispatcher(self):
+        """Requests which are not sampled are not added to a prior session."""
+        service = self.service_class()
+        status, body = service.dispatch(simplejson.dumps(self.batch()))
+        ''.join(body)
+        report = self.profiler.report()
+        self.profiler.sample_rate = 0.0
+        status, body = service.dispatch(simplejson.dumps(self.batch()))
+        ''.join(body)
+        self.assertEqual(service._profile, None)
+        service._profile = object()
+        status, body, headers = service.dispatch_get(
+            'method=fib&params=[10]&id=1')
+        self.assertEqual(service._profile, None)
+        self.assertEqual(self.profiler.report(), report)
+
+    def testStreamedResponse(self):
+        """Streamed responses are added once they are consumed."""
+        service = self.service_class()
+        service.stream_batches = True
+        status, body = service.dispatch(simplejson.dumps(self.batch()))
+        self.assertEqual(self.profiler.samples, 0)
+        list(body)
+        self.assertEqual(self.profiler.samples, 1)
+
+    def testRpcProfile(self):
+        """The reserved method is available to administrators only."""
+        self.call(self.batch())
+        request = {'jsonrpc': '2.0', 'method': 'rpc.profile',
+                   'params': {'top': 3, 'phase': 'execute'}, 'id': 1}
+        status, body = self.call(request)
+        self.assertEqual(simplejson.loads(body)['error']['code'], -32601)
+        status, body = self.call(request, admin=True)
+        result = simplejson.loads(body)['result']
+        self.assertEqual(result['samples'], 2)
+        self.assertEqual(len(result['functions']), 3)
+        request['params'] = {'sort': 'x'}
+        status, body = self.call(request, admin=True)
+        self.assertEqual(simplejson.loads(body)['error']['code'], -32602)
+
+    def testAdminFlag(self):
+        """The handler flags requests of App Engine administrators."""
+        class MyHandler(JsonRpcHandler, self.service_class):
+            pass
+        for environ, admin in [({}, False), ({'USER_IS_ADMIN': '1'}, True)]:
+            h = MyHandler()
+            h.request = Request.blank('/rpc', environ=environ)
+            h.response = Response()
+            h.request.body = simplejson.dumps(
+                {'jsonrpc': '2.0', 'method': 'fib', 'params': [1], 'id': 1})
+            h.post()
+            self.assertEqual(h.admin, admin)
+
+    def testDump(self):
+        """Statistics are written to files readable by pstats."""
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'profile')
+            self.assertEqual(self.profiler.dump(filename), False)
+            self.call(self.batch())
+            self.assertEqual(self.profiler.dump(filename, 'execute'), True)
+            stats = pstats.Stats(filename)
+            self.assertTrue([f for f in stats.stats if f[2] == 'fibonacci'])
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for the instrumentation of the JSON-RPC handler."""
+
+from jsongae.json_rpc import *
+from jsongae.json_rpc_stats import *
+from google.appengine.ext.webapp import Request, Response
+import simplejson
+import unittest
+
+
+class Recorder(object):
+    """Records the hook calls of an instrument."""
+
+    def __init__(self):
+        self.calls = []
+
+    def before_dispatch(self, event):
+        self.calls.append(('before', event.method, event.execution_time))
+
+    def after_dispatch(self, event):
+        self.calls.append(('after', event.method, event))
+
+
+class HistogramTestCase(unittest.TestCase):
+    """Tests for the latency histogram."""
+
+    def testPercentiles(self):
+        """Percentiles are approximated by bucket bounds."""
+        h = Histogram(smallest=0.001, buckets=4)
+        self.assertEqual(h.percentile(50), 0.0)
+        for value in [0.0005] * 50 + [0.003] * 45 + [0.006] * 4 + [1]:
+            h.add(value)
+        self.assertEqual(h.count, 100)
+        self.assertEqual(h.percentile(50), 0.001)
+        self.assertEqual(h.percentile(95), 0.004)
+        self.assertEqual(h.percentile(99), 0.008)
+        self.assertEqual(h.percentile(100), 0.008)
+        self.assertAlmostEqual(h.mean(), 0.01184)
+
+
+class InstrumentationTestCase(unittest.TestCase):
+    """Tests for the dispatch hooks and the method statistics."""
+
+    def setUp(self):
+        class MyTestHandler(JsonRpcHandler):
+            instruments = [Recorder(), MethodStats()]
+            @ServiceMethod
+            def subtract(self, minuend, subtrahend):
+                return minuend - subtrahend
+            @ServiceMethod
+            def broken(self):
+                raise ValueError
+        self.handler_class = MyTestHandler
+
+    def call(self, body, admin=True):
+        h = self.handler_class()
+        h.request = Request.blank(
+            '/rpc/', {'USER_IS_ADMIN': admin and '1' or '0'})
+        h.response = Response()
+        h.request.body = body
+        h.post()
+        return h.response.out.getvalue()
+
+    def testHooks(self):
+        """Instruments are notified before and after each call."""
+        self.call('''[{"jsonrpc": "2.0", "method": "subtract", "params": [5, 5], "id": 1},
+                      {"jsonrpc": "2.0", "method": "subtract", "params": {"minuend": 1, "subtrahend": 2}},
+                      {"foo": "boo"}]''')
+        calls = self.handler_class.instruments[0].calls
+        self.assertEqual([c[:2] for c in calls],
+                         [('before', 'subtract'), ('after', 'subtract'),
+                          ('before', 'subtract'), ('after', 'subtract')])
+        self.assertEqual(calls[0][2], 0.0)
+        event = calls[1][2]
+        self.assertEqual(event.message_id, 1)
+        self.assertEqual(event.param_size, 2)
+        self.assertFalse(event.notification)
+        self.assertEqual(event.error, None)
+        self.assertTrue(event.parse_time > 0)
+        self.assertTrue(event.execution_time > 0)
+        self.assertTrue(event.serialization_time > 0)
+        event = calls[3][2]
+        self.assertTrue(event.notification)
+        self.assertEqual(event.serialization_time, 0.0)
+
+    def testStats(self):
+        """Statistics are exposed via rpc.stats."""
+        self.call('''[{"jsonrpc": "2.0", "method": "subtract", "params": [2, 1], "id": 1},
+                      {"jsonrpc": "2.0", "method": "broken", "id": 2},
+                      {"jsonrpc": "2.0", "method": "subtract", "params": [2, 1], "id": 3},
+                      {"jsonrpc": "2.0", "method": "subtract", "params": [2], "id": 4},
+                      {"jsonrpc": "2.0", "method": "missing1", "id": 5},
+                      {"jsonrpc": "2.0", "method": "missing2", "id": 6}]''')
+        resp = simplejson.loads(
+            self.call('{"jsonrpc": "2.0", "method": "rpc.stats", "id": 1}',
+                      admin=False))
+        self.assertEqual(resp['error']['code'], -32601)
+        resp = simplejson.loads(
+            self.call('{"jsonrpc": "2.0", "method": "rpc.stats", "id": 1}'))
+        stats = resp['result']
+        self.assertEqual(sorted(stats),
+                         ['(unknown)', 'broken', 'rpc.stats', 'subtract'])
+        self.assertEqual(stats['(unknown)']['count'], 2)
+        self.assertEqual(stats['subtract']['count'], 3)
+        self.assertEqual(stats['subtract']['errors'], 1)
+        self.assertAlmostEqual(stats['subtract']['error_rate'], 1 / 3.0)
+        self.assertEqual(stats['broken']['error_rate'], 1.0)
+        self.assertTrue(0 < stats['subtract']['p50'] <= stats['subtract']['p99'])
+        self.assertEqual(stats['subtract']['param_size'], 5 / 3.0)
+
+    def testNoStats(self):
+        """rpc.stats is only available with a statistics instrument."""
+        class PlainHandler(self.handler_class):
+            instruments = [Recorder()]
+        self.handler_class = PlainHandler
+        resp = simplejson.loads(
+            self.call('{"jsonrpc": "2.0", "method": "rpc.stats", "id": 1}'))
+        self.assertEqual(resp['error']['code'], -32601)
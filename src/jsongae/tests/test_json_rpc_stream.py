@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2010, 2011 Florian Glanzner (fgl), Tobias Rodäbel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for reading batch requests incrementally."""
+
+from jsongae.json_rpc_stream import *
+import StringIO
+import simplejson
+import unittest
+
+
+class ArrayReaderTestCase(unittest.TestCase):
+    """Tests for splitting arrays into their elements."""
+
+    def split(self, text, chunk_size=3):
+        reader = ArrayReader(StringIO.StringIO(text), chunk_size)
+        return list(reader.elements())
+
+    def testElements(self):
+        """Elements are split at any chunk size."""
+        batch = [{'a': 'x\\"]}', 'b': [1, {'c': []}]}, 1.5, 's,]', [], {},
+                 None, u'€']
+        for indent in (None, 2):
+            text = simplejson.dumps(batch, indent=indent)
+            for chunk_size in (1, 2, 5, 64):
+                self.assertEqual(
+                    [simplejson.loads(t) for t in self.split(text, chunk_size)],
+                    batch)
+        self.assertEqual(self.split(' [ 1 , "a" ] \n'), ['1', '"a"'])
+        self.assertEqual(self.split('[]'), [])
+
+    def testMalformed(self):
+        """Malformed arrays raise ValueError."""
+        for text in ['', '{}', '[1', '[1,', '[1}', '[,]', '["a]', '[1] x',
+                     '[{]']:
+            self.assertRaises(ValueError, self.split, text)
+
+    def testReadAll(self):
+        """Bodies not read incrementally are returned as a whole."""
+        reader = ArrayReader('  {"a": 1}')
+        self.assertEqual(reader.peek(), '{')
+        self.assertEqual(reader.read_all(), '{"a": 1}')
+
+    def testBodyStream(self):
+        """Streams are not read beyond the length of the body."""
+        stream = BodyStream(StringIO.StringIO('[1, 2]garbage'), 6)
+        self.assertEqual(len(stream), 6)
+        self.assertEqual(list(ArrayReader(stream, 4).elements()), ['1', '2'])